@@ -0,0 +1,73 @@
+#
+# PAOFLOW
+#
+# Utility to construct and operate on Hamiltonians from the Projections of DFT wfc on Atomic Orbital bases (PAO)
+#
+# Copyright (C) 2016-2024 ERMES group (http://ermes.unt.edu, mbn@unt.edu)
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+#
+
+import sys
+import numpy as np
+from time import time
+from PAOFLOW.defs.do_eigh import batched_eigh
+
+############# Benchmark of the batched eigensolver #############
+## Usage:
+##  "python bench_eigh.py [nk] [nawf] [chunk]"
+##
+## Default:
+##  "python bench_eigh.py 4096 32 1024"
+##
+################################################################
+
+def random_hermitian ( nk, nawf ):
+  rng = np.random.default_rng(0)
+  H = rng.standard_normal((nk,nawf,nawf)) + 1.j*rng.standard_normal((nk,nawf,nawf))
+  return (H + np.conj(np.swapaxes(H,1,2)))/2.
+
+def loop_eigh ( Hks ):
+  nk,nawf,_ = Hks.shape
+  E_k = np.empty((nk,nawf), dtype=float)
+  v_k = np.empty((nk,nawf,nawf), dtype=complex)
+  for ik in range(nk):
+    E_k[ik],v_k[ik] = np.linalg.eigh(Hks[ik], UPLO='U')
+  return E_k, v_k
+
+def loop_eigvalsh ( Hks ):
+  nk,nawf,_ = Hks.shape
+  E_k = np.empty((nk,nawf), dtype=float)
+  for ik in range(nk):
+    E_k[ik] = np.linalg.eigvalsh(Hks[ik])
+  return E_k
+
+def main ( nk=4096, nawf=32, chunk=1024 ):
+
+  Hks = random_hermitian(nk, nawf)
+  print('Diagonalizing %d matrices of size %dx%d (chunk=%d)'%(nk,nawf,nawf,chunk))
+
+  t0 = time()
+  E_loop,_ = loop_eigh(Hks)
+  t_loop = time() - t0
+
+  t0 = time()
+  E_bat,_ = batched_eigh(Hks, chunk=chunk)
+  t_bat = time() - t0
+
+  t0 = time()
+  loop_eigvalsh(Hks)
+  t_vloop = time() - t0
+
+  t0 = time()
+  E_val = batched_eigh(Hks, chunk=chunk, eigvals_only=True)
+  t_val = time() - t0
+
+  print('Max eigenvalue deviation: %.3e'%max(np.amax(np.abs(E_loop-E_bat)),np.amax(np.abs(E_loop-E_val))))
+  print('eigh     loop: %8.3f sec   batched: %8.3f sec   speedup: %6.2fx'%(t_loop,t_bat,t_loop/t_bat))
+  print('eigvalsh loop: %8.3f sec   batched: %8.3f sec   speedup: %6.2fx'%(t_vloop,t_val,t_vloop/t_val))
+
+if __name__ == '__main__':
+  main(*[int(a) for a in sys.argv[1:4]])
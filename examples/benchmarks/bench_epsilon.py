@@ -0,0 +1,102 @@
+#
+# PAOFLOW
+#
+# Utility to construct and operate on Hamiltonians from the Projections of DFT wfc on Atomic Orbital bases (PAO)
+#
+# Copyright (C) 2016-2024 ERMES group (http://ermes.unt.edu, mbn@unt.edu)
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+#
+
+import sys
+import numpy as np
+from time import time
+from random_bands import random_bands
+from PAOFLOW.defs.do_epsilon import eps_loop, do_epsilon
+
+################ Benchmark of the dielectric tensor engine ################
+## Usage:
+##  "python bench_epsilon.py [nk] [bnd] [ne]"
+##
+## Default:
+##  "python bench_epsilon.py 400 12 500"
+##
+## PAOFLOW.dielectric_tensor is still disabled in the public interface
+## (the routine is under construction), so the engine is driven through
+## eps_loop and do_epsilon on random band energies and momenta. The
+## vectorized eps_loop is compared against the per-transition loop it
+## replaced, for an insulator and a metal, on all nine tensor components.
+###########################################################################
+
+def loop_eps ( dc, ene, ispin, ipol, jpol ):
+  # Per-transition accumulation, as eps_loop was written before vectorization
+  from PAOFLOW.defs.constants import EPS0, RYTOEV, BOHR_RADIUS_ANGS
+  arrays,attributes = dc.data_dicts()
+  bnd,temp,delta = attributes['bnd'],attributes['temp'],attributes['delta']
+  E_k,pksp = arrays['E_k'],arrays['pksp']
+  epsi,epsr,jdos = np.zeros(ene.size),np.zeros(ene.size),np.zeros(ene.size)
+
+  fn = 2./(1.+np.exp(E_k[:,:bnd,ispin]/temp))
+  if not attributes['metal']:
+    fn = np.round(fn,0)
+  pfac = attributes['alat']*BOHR_RADIUS_ANGS/(EPS0*RYTOEV)
+  for ik in range(fn.shape[0]):
+    for iband2 in range(bnd):
+      for iband1 in range(bnd):
+        if iband1 != iband2:
+          E_diff_nm = E_k[ik,iband2,ispin] - E_k[ik,iband1,ispin]
+          f_nm = fn[ik,iband2] - fn[ik,iband1]
+          if np.abs(f_nm) > 2.e-3 and fn[ik,iband1] > 1.e-4 and fn[ik,iband2] < 2.0:
+            pksp2 = pfac*np.real(pksp[ik,ipol,iband1,iband2,ispin]*pksp[ik,jpol,iband2,iband1,ispin])
+            den = ((E_diff_nm**2-ene**2)**2+delta**2*ene**2)*E_diff_nm
+            epsi += pksp2*delta*ene*fn[ik,iband1]/den
+            epsr += pksp2*(E_diff_nm**2-ene**2)*fn[ik,iband1]/den
+            jdos += delta*(fn[ik,iband1]-fn[ik,iband2])/(np.pi*((E_diff_nm-ene)**2+delta**2))
+
+  if attributes['metal']:
+    with np.errstate(over='ignore'):
+      fnF = .5/(1.+np.cosh(E_k[:,:bnd,ispin]/temp))/temp
+    for ik in range(fn.shape[0]):
+      for iband1 in range(bnd):
+        pksp2 = np.real(pksp[ik,ipol,iband1,iband1,ispin]*pksp[ik,jpol,iband1,iband1,ispin])
+        pksp2 *= attributes['alat']*BOHR_RADIUS_ANGS/(EPS0*RYTOEV**3)
+        epsi += pksp2*delta*ene*fnF[ik,iband1]/((ene**4+delta**2*ene**2)*.05)
+        epsr -= pksp2*fnF[ik,iband1]*ene**2/((ene**4+delta**2*ene**2)*.05)
+
+  return epsi, epsr, jdos
+
+def main ( nk=400, bnd=12, ne=500 ):
+
+  ene = np.linspace(0., 10., ne)
+  ene[0] = .00001
+
+  for metal in [False, True]:
+    dc = random_bands(nk, bnd, metal)
+    d_tensor = np.array([[i,j] for i in range(3) for j in range(3)])
+
+    t0 = time()
+    ref = [loop_eps(dc, ene, 0, i, j) for i,j in d_tensor]
+    t_loop = time() - t0
+
+    t0 = time()
+    epsi,epsr,jdos,_ = eps_loop(dc, ene, 0, d_tensor)
+    t_vec = time() - t0
+
+    dev = 0.
+    for n in range(d_tensor.shape[0]):
+      for new,old in [(epsi[n],ref[n][0]),(epsr[n],ref[n][1]),(jdos,ref[n][2])]:
+        dev = max(dev, np.amax(np.abs(new-old))/np.amax(np.abs(old)))
+
+    print('metal=%-5s %d k-points, %d bands, %d energies, %d components'%(metal,nk,bnd,ne,d_tensor.shape[0]))
+    print('  loop: %8.3f sec   vectorized: %8.3f sec   speedup: %6.2fx   relative deviation: %.3e'%(t_loop,t_vec,t_loop/t_vec,dev))
+    assert dev < 1.e-10, 'Vectorized eps_loop deviates from the loop'
+
+    # Full dielectric tensor pipeline (reductions, Kramers-Kronig, eels, ieps)
+    t0 = time()
+    do_epsilon(dc, ene, 0, d_tensor)
+    print('  do_epsilon: %8.3f sec'%(time()-t0))
+
+if __name__ == '__main__':
+  main(*[int(a) for a in sys.argv[1:4]])
@@ -0,0 +1,93 @@
+#
+# PAOFLOW
+#
+# Utility to construct and operate on Hamiltonians from the Projections of DFT wfc on Atomic Orbital bases (PAO)
+#
+# Copyright (C) 2016-2024 ERMES group (http://ermes.unt.edu, mbn@unt.edu)
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+#
+
+import sys
+import numpy as np
+from time import time
+from scipy import sparse
+from PAOFLOW.defs.kspace_hamiltonian import hamiltonian_k
+
+############# Benchmark of the k-point Hamiltonian evaluator #############
+## Usage:
+##  "python bench_hk.py [nkpi] [nawf] [nr] [sparsity]"
+##
+## Default:
+##  "python bench_hk.py 500 32 12 0.1"
+##
+## H(k), dH/dk and d2H/dk2 on nkpi random k-points from a random H(R) on
+## an nr x nr x nr grid. The truncated (sparse) representation keeps the
+## fraction 'sparsity' of shortest lattice vectors
+##########################################################################
+
+def random_HR ( nawf, nr ):
+  rng = np.random.default_rng(0)
+  nR = nr**3
+  HRs = rng.standard_normal((nawf,nawf,nR,1)) + 1.j*rng.standard_normal((nawf,nawf,nR,1))
+  R = np.stack(np.meshgrid(*[np.arange(nr)-nr//2]*3, indexing='ij'), axis=-1).reshape(-1,3).astype(float)
+  return HRs, R, rng
+
+def loop_derivatives ( HRs, R, kq ):
+  # One Fourier sum per component, with the weighted H(R) built element by element
+  nawf,_,nR,nspin = HRs.shape
+  kdot = np.exp(2.0j*np.pi*np.tensordot(R, kq, axes=([1],[0])))
+  Rc = 2*np.pi*R
+
+  def fsum ( HRaux ):
+    return np.transpose(np.tensordot(HRaux[:,:,:,0], kdot, axes=([2],[0])), (2,0,1))
+
+  Hks = fsum(HRs)
+  dHks,d2Hks = [],[]
+  for l in range(3):
+    dHRs = np.zeros_like(HRs)
+    for n in range(nawf):
+      for m in range(nawf):
+        dHRs[n,m,:,0] = 1.0j*Rc[:,l]*HRs[n,m,:,0]
+    dHks.append(fsum(dHRs))
+    for lp in range(3):
+      d2HRs = np.zeros_like(HRs)
+      for n in range(nawf):
+        for m in range(nawf):
+          d2HRs[n,m,:,0] = -Rc[:,l]*Rc[:,lp]*HRs[n,m,:,0]
+      d2Hks.append(fsum(d2HRs))
+  return Hks, np.stack(dHks,axis=1), np.stack(d2Hks,axis=1).reshape((kq.shape[1],3,3,nawf,nawf))
+
+def main ( nkpi=500, nawf=32, nr=12, sparsity=0.1 ):
+
+  HRs,R,rng = random_HR(nawf, nr)
+  kq = rng.random((3,nkpi))
+  print('H(k), dH/dk, d2H/dk2 at %d k-points, %d orbitals, %d lattice vectors'%(nkpi,nawf,R.shape[0]))
+
+  t0 = time()
+  H_loop,dH_loop,d2H_loop = loop_derivatives(HRs, R, kq)
+  t_loop = time() - t0
+
+  t0 = time()
+  H_bat,dH_bat,d2H_bat = hamiltonian_k(HRs, R, kq, order=2)
+  t_bat = time() - t0
+
+  dev = max(np.amax(np.abs(H_loop-H_bat[...,0])), np.amax(np.abs(dH_loop-dH_bat[...,0])), np.amax(np.abs(d2H_loop-d2H_bat[...,0])))
+
+  # Truncated hoppings, as stored by truncated_HR (rows (R,ispin), columns (i,j))
+  Rnorm = np.linalg.norm(R, axis=1)
+  keep = Rnorm <= np.quantile(Rnorm, sparsity)
+  HRsp = sparse.csr_matrix(np.reshape(np.moveaxis(HRs[:,:,keep,0], 2, 0), (np.count_nonzero(keep),nawf*nawf)))
+
+  t0 = time()
+  hamiltonian_k(HRsp, R[keep], kq, order=2)
+  t_sp = time() - t0
+
+  print('Max deviation: %.3e'%dev)
+  print('loop: %8.3f sec   batched: %8.3f sec   speedup: %6.2fx'%(t_loop,t_bat,t_loop/t_bat))
+  print('sparse (%d of %d entries): %8.3f sec   speedup: %6.2fx'%(HRsp.nnz,HRs.size,t_sp,t_loop/t_sp))
+
+if __name__ == '__main__':
+  main(*[f(a) for f,a in zip([int,int,int,float], sys.argv[1:5])])
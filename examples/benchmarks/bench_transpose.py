@@ -0,0 +1,75 @@
+#
+# PAOFLOW
+#
+# Utility to construct and operate on Hamiltonians from the Projections of DFT wfc on Atomic Orbital bases (PAO)
+#
+# Copyright (C) 2016-2024 ERMES group (http://ermes.unt.edu, mbn@unt.edu)
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+#
+
+import sys
+import numpy as np
+from time import time
+from mpi4py import MPI
+from PAOFLOW.defs.communication import scatter_full, gather_full, gather_scatter
+
+########## Benchmark of the distributed transpose ##########
+## Compares gather_scatter (rank-to-rank Ialltoallw) with the
+## former transpose, which gathers every block through a single
+## root rank with gather_full, on the (nawf**2, nk, nspin)
+## Hamiltonian layout of interpolated_hamiltonian.
+## Meant to be run at 16-512 ranks.
+##
+## Usage:
+##  "mpirun -np N python bench_transpose.py [nawf] [nk] [npool]"
+##
+## Default:
+##  "mpirun -np N python bench_transpose.py 32 8000 1"
+##
+############################################################
+
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+size = comm.Get_size()
+
+def root_gather_scatter ( arr, scatter_axis, npool ):
+  # Transpose through the root of each gather_full (previous implementation)
+  axis_ind = scatter_full(np.arange(arr.shape[scatter_axis]) if rank==0 else None, npool)
+  inds = comm.allgather(axis_ind)
+  temp = None
+  for r in range(size):
+    comm.Barrier()
+    part = gather_full(np.take(arr,inds[r],axis=scatter_axis), npool, sroot=r)
+    if r == rank:
+      temp = part
+  return temp
+
+def timed ( func, *args ):
+  comm.Barrier()
+  t0 = time()
+  out = func(*args)
+  comm.Barrier()
+  return out, time()-t0
+
+def main ( nawf=32, nk=8000, npool=1 ):
+
+  rng = np.random.default_rng(rank)
+  Hk = scatter_full(np.empty((nawf**2,nk,1), dtype=complex) if rank==0 else None, npool)
+  Hk[...] = rng.standard_normal(Hk.shape) + 1.j*rng.standard_normal(Hk.shape)
+
+  if rank == 0:
+    print('Transposing (%d,%d,1) complex on %d ranks, npool=%d (%.2f GB)'%(nawf**2,nk,size,npool,16.*nawf**2*nk/1024**3))
+
+  ref,t_root = timed(root_gather_scatter, Hk, 1, npool)
+  new,t_a2a = timed(gather_scatter, Hk, 1, npool)
+
+  err = comm.allreduce(np.amax(np.abs(ref-new)) if new.size else 0., op=MPI.MAX)
+  if rank == 0:
+    print('Max deviation: %.3e'%err)
+    print('root funneled: %8.3f sec   alltoallw: %8.3f sec   speedup: %6.2fx'%(t_root,t_a2a,t_root/t_a2a))
+
+if __name__ == '__main__':
+  main(*[int(a) for a in sys.argv[1:4]])
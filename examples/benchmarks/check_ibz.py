@@ -0,0 +1,95 @@
+#
+# PAOFLOW
+#
+# Utility to construct and operate on Hamiltonians from the Projections of DFT wfc on Atomic Orbital bases (PAO)
+#
+# Copyright (C) 2016-2024 ERMES group (http://ermes.unt.edu, mbn@unt.edu)
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+#
+
+import sys
+import numpy as np
+from os.path import join
+from tempfile import mkdtemp
+from itertools import permutations, product
+from PAOFLOW.PAOFLOW import PAOFLOW
+from PAOFLOW.defs.do_epsilon import do_epsilon
+
+############ Check of the irreducible wedge (IBZ) mode ############
+## DoS, transport and dielectric tensor of the metallic cubium2
+## model, whose optical response is intraband only, computed on the
+## irreducible wedge (pao_eigh with ibz=True) against the full grid.
+## Models carry no symmetry information, so the reduction must be
+## told explicitly whether time reversal holds. Alone it reduces the
+## grid by {E,-E}; the 48 operations of the cubic group are then
+## injected as the DFT symmetry information ('sym_rot', 'sym_TR')
+## to check the full point group reduction.
+##
+## Usage:
+##  "python check_ibz.py [nfft]"
+##
+## Default:
+##  "python check_ibz.py 10"
+##
+###################################################################
+
+def cubic_group ():
+  # Signed permutation matrices, the integer rotations of the simple cubic lattice
+  return np.array([np.diag(s)[list(p)] for p in permutations(range(3)) for s in product([1,-1],repeat=3)])
+
+def observables ( nfft, ibz, cubic=False ):
+  outputdir = mkdtemp()
+  paoflow = PAOFLOW(model={'label':'cubium2', 't':1.0, 'Eg':-0.5}, outputdir=outputdir, verbose=False)
+  paoflow.interpolated_hamiltonian(nfft1=nfft, nfft2=nfft, nfft3=nfft)
+  arrays,attr = paoflow.data_controller.data_dicts()
+  if cubic:
+    arrays['sym_rot'] = cubic_group()
+    arrays['sym_TR'] = np.zeros(arrays['sym_rot'].shape[0], dtype=bool)
+  paoflow.pao_eigh(ibz=ibz, time_reversal=True)
+  paoflow.gradient_and_momenta()
+  paoflow.adaptive_smearing()
+  nk = attr['nkibz'] if ibz else attr['nkpnts']
+
+  paoflow.dos(emin=-3., emax=3., ne=100)
+  paoflow.transport(emin=-1., emax=1., ne=20)
+  obs = {f:np.loadtxt(join(outputdir,'%s_0.dat'%f))[:,1:] for f in ['dosdk', 'sigma', 'Seebeck', 'kappa']}
+
+  attr['metal'] = True
+  # Fermi-Dirac occupations give a Fermi surface term much larger than the adaptive gaussians
+  attr['smearing'] = None
+  attr['delta'] = 0.01
+  attr['kk_method'] = 'simps'
+  ene = np.linspace(0., 5., 200)
+  d_tensor = np.array([[0,0],[0,1],[2,2]])
+  epsi,epsr,eels,jdos,ieps = do_epsilon(paoflow.data_controller, ene, 0, d_tensor)
+  # Re(epsilon) - 1 is compared, the vacuum term would hide small contributions
+  obs.update({'epsi':epsi, 'epsr-1':epsr-1., 'jdos':jdos, 'ieps':ieps})
+  return obs, nk
+
+def main ( nfft=10 ):
+
+  full,nkpnts = observables(nfft, False)
+  for label,cubic in [('time reversal', False), ('cubic group', True)]:
+    wedge,nkibz = observables(nfft, True, cubic)
+    print('%s: %d of %d k-points'%(label,nkibz,nkpnts))
+    assert nkibz < nkpnts, 'k-point grid not reduced'
+    for k in full:
+      err = np.amax(np.abs(wedge[k]-full[k]))/np.amax(np.abs(full[k]))
+      print('  %-7s relative deviation: %.3e'%(k,err))
+      assert err < 1.e-10, 'IBZ %s deviates from the full grid'%k
+
+  # Without symmetry information time reversal has to be stated
+  paoflow = PAOFLOW(model={'label':'cubium2', 't':1.0, 'Eg':-0.5}, outputdir=mkdtemp(), verbose=False)
+  paoflow.interpolated_hamiltonian(nfft1=nfft, nfft2=nfft, nfft3=nfft)
+  try:
+    paoflow.pao_eigh(ibz=True)
+  except ValueError:
+    print('ibz=True without time_reversal refused for a model')
+  else:
+    raise AssertionError('IBZ reduction of a model assumed time reversal')
+
+if __name__ == '__main__':
+  main(*[int(a) for a in sys.argv[1:2]])
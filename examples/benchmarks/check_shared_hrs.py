@@ -0,0 +1,64 @@
+#
+# PAOFLOW
+#
+# Utility to construct and operate on Hamiltonians from the Projections of DFT wfc on Atomic Orbital bases (PAO)
+#
+# Copyright (C) 2016-2024 ERMES group (http://ermes.unt.edu, mbn@unt.edu)
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+#
+
+import numpy as np
+from tempfile import mkdtemp
+from mpi4py import MPI
+from PAOFLOW.PAOFLOW import PAOFLOW
+
+########## Check of the Hamiltonian edits on node-shared HRs ##########
+## With shared_arrays=['HRs'] the real space Hamiltonian is a read-only
+## buffer shared by the ranks of a node. cutting_Hamiltonian and
+## doubling_Hamiltonian edit HRs, so they must work on private copies
+## and release the shared window on every rank. Their results are
+## compared against runs with private HRs.
+##
+## Usage:
+##  "mpirun -np 2 python check_shared_hrs.py"
+##
+#######################################################################
+
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+
+def hamiltonian ( shared, edit ):
+  outputdir = comm.bcast(mkdtemp() if rank==0 else None)
+  paoflow = PAOFLOW(model={'label':'cubium2', 't':1.0, 'Eg':-0.5}, outputdir=outputdir, verbose=False,
+                    shared_arrays=(['HRs'] if shared else None))
+  if edit == 'cut':
+    paoflow.cutting_Hamiltonian(z=True)
+  else:
+    paoflow.doubling_Hamiltonian(1, 0, 0)
+  dc = paoflow.data_controller
+  HRs = np.array(dc.data_arrays['HRs'])
+  windows = sorted(dc.windows)
+  dc.free_windows()
+  return HRs, windows
+
+def main ():
+
+  for edit in ['cut', 'double']:
+    ref,_ = hamiltonian(False, edit)
+    HRs,windows = hamiltonian(True, edit)
+    dev = np.amax(np.abs(HRs-ref)) if HRs.shape == ref.shape else np.inf
+    devs = comm.gather(dev)
+    if rank == 0:
+      print('%-6s shape %s   max deviation over ranks: %.3e   windows left: %s'%(edit,ref.shape,max(devs),windows))
+      assert max(devs) == 0., '%s on node-shared HRs differs from private HRs'%edit
+    if edit == 'cut':
+      # The cut Hamiltonian is shared again
+      assert windows == ['HRs'], 'cut HRs not shared again'
+    else:
+      assert 'HRs' not in windows, 'doubled HRs still backed by the shared window'
+
+if __name__ == '__main__':
+  main()
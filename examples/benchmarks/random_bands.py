@@ -0,0 +1,48 @@
+#
+# PAOFLOW
+#
+# Utility to construct and operate on Hamiltonians from the Projections of DFT wfc on Atomic Orbital bases (PAO)
+#
+# Copyright (C) 2016-2024 ERMES group (http://ermes.unt.edu, mbn@unt.edu)
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+#
+
+import numpy as np
+
+########## Random band structures for the do_epsilon checks ##########
+## Shared by bench_epsilon.py and check_kramerskronig.py, which drive
+## the do_epsilon routines directly: a stand-in for the DataController
+## holding only the dictionaries they read, and seeded random band
+## energies and Hermitian momenta for a single spin.
+#######################################################################
+
+class Controller:
+  def __init__ ( self, arrays=None, attributes=None ):
+    self.data_arrays = {} if arrays is None else arrays
+    self.data_attributes = {} if attributes is None else attributes
+  def data_dicts ( self ):
+    return self.data_arrays, self.data_attributes
+
+def random_bands ( nk, bnd, metal=False, kk_method='simps' ):
+  '''
+  Controller holding random E_k and pksp, with the attributes read by do_epsilon
+
+  Arguments:
+      nk (int): Number of k-points
+      bnd (int): Number of bands
+      metal (bool): Whether Fermi-Dirac occupations and the intraband term are used
+      kk_method (str): Kramers-Kronig transform of do_epsilon, 'simps' or 'fft'
+
+  Returns:
+      dc (Controller): E_k (nk,bnd,1), pksp (nk,3,bnd,bnd,1) and the attributes
+  '''
+  rng = np.random.default_rng(0)
+  E_k = np.sort(3.*rng.standard_normal((nk,bnd,1)), axis=1)
+  pksp = rng.standard_normal((nk,3,bnd,bnd,1)) + 1.j*rng.standard_normal((nk,3,bnd,bnd,1))
+  pksp = pksp + np.conj(np.swapaxes(pksp,2,3))
+  attributes = {'bnd':bnd, 'temp':.025852, 'delta':.1, 'smearing':None, 'metal':metal, 'nkpnts':nk,
+                'alat':10., 'omega':1000., 'shift':20., 'kk_method':kk_method}
+  return Controller({'E_k':E_k, 'pksp':pksp}, attributes)
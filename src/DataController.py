@@ -25,7 +25,7 @@ class DataController:
 
   error_handler = report_exception = None
 
-  def __init__ ( self, workpath, outputdir, inputfile, model, savedir, npool, smearing, acbn0, verbose, restart, dft ):
+  def __init__ ( self, workpath, outputdir, inputfile, model, savedir, npool, smearing, acbn0, verbose, restart, dft, root_arrays=None, shared_arrays=None ):
     '''
     Initialize the DataController
     Arguments:
@@ -39,6 +39,9 @@ class DataController:
         smearing (str): Smearing type (None, m-p, gauss)
         verbose (bool): False supresses debugging output
         restart (bool): True if the run is being restarted from a .json data dump.
+        dft (str): 'QE' or 'VASP'
+        root_arrays (list): Keys of arrays read from the DFT output that are kept on rank 0 only
+        shared_arrays (list): Keys of read-only arrays stored once per node in MPI shared memory
     Returns:
         None
     '''
@@ -59,6 +62,10 @@ class DataController:
         print('\nERROR: Must specify \'.save\' directory path, either in PAOFLOW constructor or in an inputfile.')
       quit()
 
+    # MPI shared memory windows backing node-shared arrays
+    self.windows = {}
+    self.shared_keys = set([] if shared_arrays is None else shared_arrays)
+
     self.error_handler = ErrorHandler()
     self.report_exception = self.error_handler.report_exception
 
@@ -114,10 +121,13 @@ class DataController:
     self.comm.Barrier()
 
     if not restart:
-      # Broadcast Data
+      # Broadcast Data (arrays as raw buffers, everything else pickled)
       try:
-        self.data_arrays = self.comm.bcast(self.data_arrays, root=0)
-        self.data_attributes = self.comm.bcast(self.data_attributes, root=0)
+        from .defs.communication import bcast_dict
+        self.data_attributes,_ = bcast_dict(self.data_attributes, comm=self.comm)
+        root_only = [] if root_arrays is None else root_arrays
+        shared = [] if shared_arrays is None else shared_arrays
+        self.data_arrays,self.windows = bcast_dict(self.data_arrays, comm=self.comm, root_only=root_only, shared=shared)
       except Exception as e:
         print('ERROR: MPI was unable to broadcast')
         self.report_exception('Initialization Broadcast')
@@ -160,6 +170,11 @@ class DataController:
 
     # Band Path
     self.data_attributes['band_path'] = None
+
+    # Number of k-points diagonalized per stacked LAPACK call (0 for all at once)
+    self.data_attributes['eigh_chunk'] = 1024
+    # MBytes of phases and H(k) held per chunk of k-points by hamiltonian_k
+    self.data_attributes['hk_mem_budget'] = 256
     self.data_arrays['high_sym_points'] = {}
 
     # Electric Field
@@ -237,6 +252,37 @@ class DataController:
     self.comm.Barrier()
 
 
+  def write_file_cols ( self, fname, col1, cols, header=None ):
+    '''
+    Write a file with one leading column followed by several data columns
+
+    Arguments:
+        fname (str): Name of the file (written to outputdir)
+        col1 (ndarray): 1D array of values for the leftmost column
+        cols (ndarray): 2D array (ncol,len(col1)) of values for the remaining columns
+        header (str): Optional comment line written at the top of the file
+
+    Returns:
+        None
+    '''
+    if self.rank == 0:
+      from os.path import join
+      if cols.shape[1] != len(col1):
+        print('ERROR: Cannot write file: %s'%fname)
+        print('Data does not have the same shape')
+        self.comm.Abort()
+
+      attr = self.data_attributes
+
+      with open(join(attr['opath'],fname), 'w') as f:
+        if header is not None:
+          f.write('# %s\n'%header)
+        fmt = '%.5f' + ' %.15e'*cols.shape[0] + '\n'
+        for i in range(len(col1)):
+          f.write(fmt%((col1[i],)+tuple(cols[:,i])))
+    self.comm.Barrier()
+
+
   def write_bxsf ( self, fname, bands, nbnd, indices=None ):
     '''
     Write a file in the bxsf format
@@ -435,7 +481,7 @@ class DataController:
       if self.rank == 0:
         import numpy as np
         from os.path import join
-        from .defs.zero_pad import zero_pad
+        from .defs.zero_pad import spectral_pad
 
         arry,attr = self.data_dicts()
 
@@ -454,11 +500,8 @@ class DataController:
         else: pad3=1
 
 
-        HRS_interp=np.zeros((nawf,nawf,nk1+pad1,nk2+pad2,nk3+pad3,nspin),dtype=complex)
-        for n in range(nawf):
-          for m in range(nawf):
-            for ispin in range(nspin):
-              HRS_interp[n,m,:,:,:,ispin] = zero_pad(HRS[n,m,:,:,:,ispin],nk1,nk2,nk3,pad1,pad2,pad3)
+        HRS_interp = spectral_pad(np.reshape(HRS,(nawf**2,nk1,nk2,nk3,nspin)),(nk1+pad1,nk2+pad2,nk3+pad3))
+        HRS_interp = np.reshape(HRS_interp,(nawf,nawf,nk1+pad1,nk2+pad2,nk3+pad3,nspin))
 
         nk1+=pad1
         nk2+=pad2
@@ -520,7 +563,7 @@ class DataController:
 
 
 
-  def broadcast_single_array ( self, key, dtype=complex, root=0 ):
+  def broadcast_single_array ( self, key, dtype=complex, root=0, shared=None ):
     '''
     Broadcast array from 'data_arrays' with 'key' from 'root' to all other ranks
 
@@ -528,15 +571,68 @@ class DataController:
         key (str): The key for the array to broadcast (key must exist in dictionary 'data_arrays')
         dtype (dtype): The data type of the array to broadcast
         root (int): The rank which is the source of the broadcasted array
+        shared (bool): If True the array is stored once per node in a read-only MPI shared memory window. Defaults to True for the keys given in 'shared_arrays'
 
     Returns:
         None
     '''
     import numpy as np
-    ashape = self.comm.bcast((None if self.rank!=root else self.data_arrays[key].shape), root=root)
-    if self.rank != root:
-      self.data_arrays[key] = np.zeros(ashape, dtype=dtype, order='C')
-    self.comm.Bcast(np.ascontiguousarray(self.data_arrays[key]), root=root)
+
+    if shared is None:
+      shared = key in self.shared_keys
+
+    if shared:
+      from .defs.communication import shared_array
+      arr = self.data_arrays[key] if self.rank==root else None
+      arr,win = shared_array(arr, root=root, comm=self.comm)
+      # Release the previous window only once its contents are no longer needed
+      self.release_array(key)
+      self.data_arrays[key],self.windows[key] = arr,win
+      return
+
+    from .defs.communication import bcast_array
+
+    # Sent in chunks, so the size is not limited by the MPI int count
+    arr = self.data_arrays[key] if self.rank==root else None
+    if arr is not None and arr.dtype != np.dtype(dtype):
+      arr = arr.astype(dtype)
+    self.data_arrays[key] = bcast_array(arr, root=root, comm=self.comm)
+
+  def release_array ( self, key, keep=False ):
+    '''
+    Remove array 'key' from 'data_arrays' and free its MPI shared memory window, if it has one.
+    Must be called by every rank when the array is node-shared.
+
+    Arguments:
+        key (str): The key of the array to release
+        keep (bool): If True the array is kept as a private, writable copy instead of being removed
+
+    Returns:
+        None
+    '''
+    import numpy as np
+
+    win = self.windows.pop(key, None)
+    if keep:
+      if win is not None and key in self.data_arrays:
+        self.data_arrays[key] = np.array(self.data_arrays[key])
+    elif key in self.data_arrays:
+      del self.data_arrays[key]
+    if win is not None:
+      win.Free()
+
+  def free_windows ( self, keep=False ):
+    '''
+    Free every MPI shared memory window. Must be called by every rank.
+
+    Arguments:
+        keep (bool): If True the node-shared arrays are kept as private copies, otherwise they are removed
+
+    Returns:
+        None
+    '''
+    for key in sorted(self.windows):
+      self.release_array(key, keep=keep)
 
   def broadcast_attribute ( self, key, root=0 ):
     '''
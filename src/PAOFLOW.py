@@ -32,6 +32,12 @@ class PAOFLOW:
   # Function container for ErrorHandler's method
   report_exception = None
 
+  # Stage cache directory, size limit (GBytes) and key of the last stage
+  cache_dir = cache_size = cache_key = None
+
+  # Batched FFT library and threads requested in the constructor
+  fft_backend,fft_threads = 'scipy',None
+
 
   def print_data_keys ( self ):
     '''
@@ -50,7 +56,7 @@ class PAOFLOW:
 
 
 
-  def __init__ ( self, workpath='./', outputdir='output', inputfile=None, savedir=None, model=None, npool=1, smearing='gauss', acbn0=False, verbose=False, restart=False, dft='QE'):
+  def __init__ ( self, workpath='./', outputdir='output', inputfile=None, savedir=None, model=None, npool=1, smearing='gauss', acbn0=False, verbose=False, restart=False, dft='QE', root_arrays=None, shared_arrays=None, cache_dir=None, cache_size=10., fft_backend='scipy', fft_threads=None ):
     '''
     Initialize the PAOFLOW class, either with a save directory with required QE output or with an xml inputfile
     Arguments:
@@ -59,12 +65,18 @@ class PAOFLOW:
         inputfile (str): (optional) Name of the xml inputfile
         savedir (str): QE .save directory
         model (dict): Dictionary with 'label' key and parameters to build Hamiltonian from TB model
-        npool (int): The number of pools to use. Increasing npool may reduce memory requirements.
+        npool (int): The number of pools to use. Increasing npool may reduce memory requirements. MPI transfers of any size are split automatically, so npool is not needed for correctness
         smearing (str): Smearing type (None, m-p, gauss)
         acbn0 (bool): If True the Hamiltonian will be Orthogonalized after construction
         verbose (bool): False supresses debugging output
         restart (bool): True if the run is being restarted from a .json data dump.
         dft (str): 'QE' or 'VASP'
+        root_arrays (list): Keys of arrays read from the DFT output that only rank 0 needs. They are not broadcast to the other ranks.
+        shared_arrays (list): Keys of read-only arrays stored once per node in MPI shared memory, instead of once per rank (e.g. ['HRs','U']). Every later broadcast of these keys is node-shared as well
+        cache_dir (str): (optional) Directory of the stage cache. The outputs of projections, read_atomic_proj_QE, projectability, pao_hamiltonian, interpolated_hamiltonian, pao_eigh, gradient_and_momenta and adaptive_smearing are stored there, keyed by the inputs of every stage leading to them. A rerun loads the stages whose inputs did not change instead of computing them
+        cache_size (float): Maximum size of the stage cache in GBytes. The least recently used stages are removed first
+        fft_backend (str): Library performing the batched FFTs of the Fourier interpolation and the gradient, 'numpy', 'scipy' or 'pyfftw'. pyFFTW plans are measured once, and its wisdom is kept in 'pyfftw_wisdom.pkl' in outputdir
+        fft_threads (int): Threads used by each rank for the FFTs (default: the cores of the node divided by the number of ranks)
     Returns:
         None
     '''
@@ -90,10 +102,22 @@ class PAOFLOW:
       print("read from ", savedir)
     
     # Initialize Data Controller
-    self.data_controller = DataController(workpath, outputdir, inputfile, model, savedir, npool, smearing, acbn0, verbose, restart, dft)
+    self.data_controller = DataController(workpath, outputdir, inputfile, model, savedir, npool, smearing, acbn0, verbose, restart, dft, root_arrays, shared_arrays)
 
     self.report_exception = self.data_controller.report_exception
 
+    # The first stage key hashes the DFT output or model, and the initial attributes.
+    # Restarted runs have no attributes yet, restart_load keys them with the checkpoint
+    if cache_dir is not None:
+      from os.path import join
+      from .defs.stage_cache import path_fingerprint
+      self.cache_dir,self.cache_size = join(workpath,cache_dir),cache_size
+    if cache_dir is not None and not restart:
+      fpath = self.data_controller.data_attributes.get('fpath')
+      inputs = {'model':model, 'savedir':path_fingerprint(fpath),
+                'inputfile':path_fingerprint(None if inputfile is None else join(workpath,inputfile))}
+      self.cache_stage('initialization', inputs, load=False)
+
     if not restart:
       # Data Attributes
       attr = self.data_controller.data_attributes
@@ -110,6 +134,11 @@ class PAOFLOW:
         else:
           print('SciPy will perform FFTs')
 
+    # Batched FFT backend. A restarted run applies it once restart_load has read the attributes
+    self.fft_backend,self.fft_threads = fft_backend,fft_threads
+    if not restart:
+      self.setup_fft()
+
     # Report execution information
     if self.rank == 0:
       if restart:
@@ -151,23 +180,105 @@ class PAOFLOW:
 
 
 
+  def setup_fft ( self ):
+    '''
+      Store the batched FFT backend and threads requested in the constructor in the attributes,
+      and import the FFTW wisdom of previous runs from outputdir when pyFFTW performs the FFTs.
+
+      Arguments:
+          None
+
+      Returns:
+          None
+    '''
+    from os.path import join
+    from .defs.batched_fft import check_fft_backend,default_fft_threads,load_wisdom
+
+    attr = self.data_controller.data_attributes
+    attr['fft_backend'] = check_fft_backend(self.fft_backend)
+    if self.rank == 0 and attr['fft_backend'] != self.fft_backend:
+      print('WARNING: pyFFTW is not installed, scipy.fft will perform FFTs')
+    attr['fft_threads'] = default_fft_threads(self.size) if self.fft_threads is None else self.fft_threads
+    if attr['fft_backend'] == 'pyfftw':
+      # outputdir exists, the DataController creates it before its closing barrier
+      load_wisdom(join(attr['opath'],'pyfftw_wisdom.pkl'))
+
+
+
+  def cache_stage ( self, stage, args, load=True ):
+    '''
+      Advance the stage cache key with the inputs of a stage and load its output if it is cached.
+      Does nothing unless PAOFLOW was created with a 'cache_dir'.
+
+      Arguments:
+          stage (str): Name of the stage
+          args (dict): Arguments of the stage
+          load (bool): If False the key is only advanced. Used by methods which modify the data but are not cached
+
+      Returns:
+          hit (bool): True if the output of the stage was loaded from the cache
+    '''
+    from .defs.stage_cache import stage_key,load_stage
+
+    if self.cache_dir is None:
+      return False
+
+    key = stage_key(self.cache_key, stage, args, self.data_controller.data_attributes) if self.rank==0 else None
+    self.cache_key = self.comm.bcast(key, root=0)
+
+    if load and load_stage(self.data_controller, self.cache_dir, self.cache_key):
+      self.report_module_time('Cached %s'%stage)
+      return True
+    return False
+
+
+
+  def cache_store ( self ):
+    '''
+      Store the current data as the output of the last stage in the stage cache, if PAOFLOW was created with a 'cache_dir'.
+
+      Arguments:
+          None
+
+      Returns:
+          None
+    '''
+    from .defs.stage_cache import store_stage
+
+    if self.cache_dir is not None:
+      store_stage(self.data_controller, self.cache_dir, self.cache_key, self.cache_size)
+
+
+
+  def full_grid_required ( self, mname ):
+    '''
+      Raise an error if the k-space arrays only hold the irreducible wedge (pao_eigh with ibz=True)
+
+      Arguments:
+          mname (str): Name of the calculation which needs the full grid
+
+      Returns:
+          None
+    '''
+    if self.data_controller.data_attributes.get('ibz', False):
+      raise NotImplementedError('%s requires the full k-point grid. Call pao_eigh with ibz=False.'%mname)
+
+
+
   def restart_dump ( self, fname_prefix='paoflow_dump' ):
     '''
       Saves the necessary information to restart a PAOFLOW run from any step in calculation.
+      The checkpoint is a directory holding a manifest and one raw .npy block per array. Every rank writes its own part of the k-distributed arrays.
 
       Arguments:
-          fname_prefix (str): Prefix of the filenames which will be written. Files are written to the directory housing the python script which instantiates PAOFLOW, unless otherwise specified in this argument.
+          fname_prefix (str): Name of the checkpoint directory which will be written. It is created in the directory housing the python script which instantiates PAOFLOW, unless otherwise specified in this argument.
 
       Returns:
           None
     '''
-    from pickle import dump,HIGHEST_PROTOCOL
+    from .defs.checkpoint import write_checkpoint
 
-    fname = fname_prefix + '_%d'%self.rank + '.json'
-
-    arry,attr = self.data_controller.data_dicts()
-    with open(fname, 'wb') as f:
-      dump([arry,attr], f, HIGHEST_PROTOCOL)
+    write_checkpoint(self.data_controller, fname_prefix)
 
     self.report_module_time('Restart DUMP')
 
@@ -176,14 +287,29 @@ class PAOFLOW:
   def restart_load ( self, fname_prefix='paoflow_dump' ):
     '''
       Loads the previously dumped save files and populates the DataController with said data.
+      Arrays are memory mapped and read lazily. The run may use a different number of cores than the one which wrote the checkpoint.
+      Dumps in the former per-rank pickle format (<fname_prefix>_<rank>.json) are still read, with the same number of cores only.
 
       Arguments:
-          fname_prefix (str): Prefix of the filenames which will be written. Files are written to the directory housing the python script which instantiates PAOFLOW, unless otherwise specified in this argument.
+          fname_prefix (str): Name of the checkpoint directory to read. It is searched in the directory housing the python script which instantiates PAOFLOW, unless otherwise specified in this argument.
 
       Returns:
           None
     '''
-    from os.path import exists
+    from os.path import exists,join
+    from .defs.stage_cache import path_fingerprint
+
+    if self.cache_dir is not None:
+      ckpt = fname_prefix if exists(fname_prefix) else fname_prefix+'_0.json'
+      self.cache_stage('restart_load', {'checkpoint':path_fingerprint(ckpt)}, load=False)
+
+    if exists(join(fname_prefix,'manifest.json')):
+      from .defs.checkpoint import read_checkpoint
+      read_checkpoint(self.data_controller, fname_prefix)
+      self.setup_fft()
+      self.report_module_time('Restart LOAD')
+      return
+
     from pickle import load
 
     fname = fname_prefix + '_%d'%self.rank + '.json'
@@ -201,6 +327,7 @@ class PAOFLOW:
 
     self.data_controller.data_arrays = arry
     self.data_controller.data_attributes = attr
+    self.setup_fft()
 
     self.report_module_time('Restart LOAD')
 
@@ -241,6 +368,16 @@ class PAOFLOW:
     from time import time
     from mpi4py import MPI
 
+    # Node-shared arrays are released with their MPI windows
+    self.data_controller.free_windows()
+
+    # Keep the plans measured by FFTW for the next runs
+    attr = self.data_controller.data_attributes
+    if self.rank == 0 and attr.get('fft_backend') == 'pyfftw':
+      from os.path import join
+      from .defs.batched_fft import save_wisdom
+      save_wisdom(join(attr['opath'],'pyfftw_wisdom.pkl'))
+
     if self.rank == 0:
       tt = time() - self.start_time
       print('Total CPU time =%s%8.3f sec'%(25*' ',tt))
@@ -268,6 +405,9 @@ class PAOFLOW:
     Replaces projwfc.
     TODO  * add spin-orbit and non-collinear cases
     '''
+    if self.cache_stage('projections', locals()):
+      return
+
 
     from .defs.do_atwfc_proj import build_pswfc_basis_all
     from .defs.do_atwfc_proj import build_aewfc_basis
@@ -301,12 +441,12 @@ class PAOFLOW:
     
     Unew = np.zeros((nkpnts,nbnds,natwfc,nspin), dtype=complex) if self.rank == 0 else None
     gather_array(Unew,Unewaux)
-    if self.rank == 0: Unew = np.moveaxis(Unew,0,2)
-    Unew = self.comm.bcast(Unew, root=0)
-    
-    arry['U'] = Unew
+    if self.rank == 0: arry['U'] = np.ascontiguousarray(np.moveaxis(Unew,0,2))
+    self.data_controller.broadcast_single_array('U')
+
     arry['basis'] = basis
     
+    self.cache_store()
     self.report_module_time('Projections')
 
 
@@ -317,6 +457,9 @@ class PAOFLOW:
       in the .save directory specified in PAOFLOW's constructos. They are saved to the 
       DataController's arrays dictionary with keys 'U' and 'Sks', respectively.
     '''
+    if self.cache_stage('read_atomic_proj_QE', locals()):
+      return
+
     from .defs.read_upf import UPF
     from os.path import exists,join
 
@@ -339,6 +482,8 @@ class PAOFLOW:
       else:
         raise Exception('Pseudopotential not found: %s'%fname)
 
+    self.cache_store()
+
 
 
   def projectability ( self, pthr=0.95, shift='auto' ):
@@ -352,6 +497,9 @@ class PAOFLOW:
     Returns:
         None
     '''
+    if self.cache_stage('projectability', locals()):
+      return
+
     from .defs.do_projectability import do_projectability
 
     attr = self.data_controller.data_attributes
@@ -365,6 +513,9 @@ class PAOFLOW:
       self.report_exception('projectability')
       if attr['abort_on_exception']:
         raise e
+    else:
+      # A failed stage is not cached
+      self.cache_store()
 
     self.report_module_time('Projectability')
     
@@ -382,6 +533,9 @@ class PAOFLOW:
         None
     
     '''
+    if self.cache_stage('pao_hamiltonian', locals()):
+      return
+
     from .defs.get_K_grid_fft import get_K_grid_fft
     from .defs.do_build_pao_hamiltonian import do_build_pao_hamiltonian,do_Hks_to_HRs
     from .defs.do_Efermi import E_Fermi
@@ -407,16 +561,20 @@ class PAOFLOW:
       if rank == 0:
         print('WARNING: Non-ortho is currently not supported with pao_sym. Use nosym=.true., noinv=.true.')
 
+    # A failed stage is not cached
+    complete = True
+
     try:
       do_build_pao_hamiltonian(self.data_controller)
     except Exception as e:
+      complete = False
       self.report_exception('pao_hamiltonian')
       if attr['abort_on_exception']:
         raise e
     self.report_module_time('Building Hks')
 
     # Done with U and Sks
-    del arrays['U']
+    self.data_controller.release_array('U')
 
     try:
       do_Hks_to_HRs(self.data_controller)
@@ -426,9 +584,12 @@ class PAOFLOW:
 
       get_K_grid_fft(self.data_controller)
     except Exception as e:
+      complete = False
       self.report_exception('pao_hamiltonian')
       if attr['abort_on_exception']:
         raise e
+    if complete:
+      self.cache_store()
     self.report_module_time('k -> R')
 
 
@@ -462,6 +623,8 @@ class PAOFLOW:
         None
     
     '''
+    self.cache_stage('add_external_fields', locals(), load=False)
+
     arry,attr = self.data_controller.data_dicts()
 
     if any(v != 0. for v in Efield): arry['Efield'] = np.array(Efield)
@@ -506,6 +669,46 @@ class PAOFLOW:
 
 
 
+  def sparse_hamiltonian ( self, threshold=1.e-5, rcut=None ):
+    '''
+    Truncate the real space Hamiltonian used to interpolate H(k) at arbitrary k-points.
+    The hoppings are moved to the Wigner-Seitz lattice vectors, with degeneracy weights,
+    and only the entries with |H_ij(R)| >= threshold and |R| <= rcut are kept. Bands,
+    topology, Berry phase paths and Weyl point searches then sum over the kept entries only.
+    The truncation error is reported.
+
+    Arguments:
+        threshold (float): Smallest hopping kept (eV). None restores the full Hamiltonian
+        rcut (float): Longest lattice vector kept (Angstrom), None for no cutoff
+
+    Returns:
+        None
+    '''
+    from .defs.sparse_HR import truncated_HR
+
+    arrays,attr = self.data_controller.data_dicts()
+
+    try:
+      for k in ['sparse_HR_threshold', 'sparse_HR_rcut', 'sparse_HR_error']:
+        attr.pop(k, None)
+      if threshold is None:
+        return
+
+      if 'HRs' not in arrays:
+        raise KeyError('HRs')
+
+      # The truncation is only enabled once it keeps some hoppings
+      _,_,error = truncated_HR(self.data_controller, threshold, rcut, report=self.rank==0)
+      attr['sparse_HR_threshold'],attr['sparse_HR_rcut'],attr['sparse_HR_error'] = threshold,rcut,error
+
+    except Exception as e:
+      self.report_exception('sparse_hamiltonian')
+      if attr['abort_on_exception']:
+        raise e
+
+    self.report_module_time('Sparse Hamiltonian')
+
+
   def bands ( self, ibrav=None, band_path=None, high_sym_points=None, spin_orbit=False, fname='bands', nk=500 ):
     '''
     Compute the electronic band structure
@@ -577,6 +780,8 @@ class PAOFLOW:
         None
 
     '''
+    self.cache_stage('adhoc_spin_orbit', locals(), load=False)
+
     from .defs.do_spin_orbit import do_spin_orbit_H
 
     arry,attr = self.data_controller.data_dicts()
@@ -613,6 +818,8 @@ class PAOFLOW:
 mo    '''
     from .defs.do_wave_function_site_projection import wave_function_site_projection
 
+    self.full_grid_required('wave_function_projection')
+
     try:
       wave_function_site_projection(self.data_controller)
     except Exception as e:
@@ -636,12 +843,16 @@ mo    '''
     Returns:
         None
     '''
+    self.cache_stage('doubling_Hamiltonian', locals(), load=False)
+
     from .defs.do_doubling import doubling_HRs
     
     arrays,attr = self.data_controller.data_dicts()
     attr['nx'],attr['ny'],attr['nz'] = nx,ny,nz
     
     try:
+      # Node-shared HRs are freed collectively, only rank 0 builds the doubled Hamiltonian
+      self.data_controller.release_array('HRs', keep=True)
       doubling_HRs(self.data_controller)
     except Exception as e:
       self.report_exception('doubling_Hamiltonian')
@@ -664,9 +875,13 @@ mo    '''
     Returns:
         None
     '''
+    self.cache_stage('cutting_Hamiltonian', locals(), load=False)
+
     arry,attr = self.data_controller.data_dicts()
 
     try:
+      # Node-shared HRs are read-only, cut a private copy
+      self.data_controller.release_array('HRs', keep=True)
       if x:
         for i in range(attr['nk1']-1,0,-1):
           arry['HRs'] = np.delete(arry['HRs'],i,2)
@@ -679,6 +894,9 @@ mo    '''
 
       _,_,attr['nk1'],attr['nk2'],attr['nk3'],_ = arry['HRs'].shape
       attr['nkpnts'] = attr['nk1']*attr['nk2']*attr['nk3']
+
+      if 'HRs' in self.data_controller.shared_keys:
+        self.data_controller.broadcast_single_array('HRs')
     except Exception as e:
       self.report_exception('cutting_Hamiltonian')
       if attr['abort_on_exception']:
@@ -819,9 +1037,11 @@ mo    '''
     Returns:
         None
     '''
+    if self.cache_stage('interpolated_hamiltonian', locals()):
+      return
+
     from .defs.get_K_grid_fft import get_K_grid_fft
     from .defs.do_double_grid import do_double_grid
-    from .defs.communication import gather_scatter
     from .defs.do_Efermi import E_Fermi
 
     arrays,attr = self.data_controller.data_dicts()
@@ -841,22 +1061,10 @@ mo    '''
 
       attr['nfft1'],attr['nfft2'],attr['nfft3'] = nfft1,nfft2,nfft3
 
-      # Adjust 'npool' if arrays exceed MPI maximum
-      int_max = 2147483647
-      temp_pool = int(np.ceil((float(nawf**2*nfft1*nfft2*nfft3*3*attr['nspin'])/float(int_max))))
-      if temp_pool > attr['npool']:
-        if self.rank == 0:
-          print("Warning: %s too low. Setting npool to %s"%(attr['npool'],temp_pool))
-        attr['npool'] = temp_pool
-
-      # Fourier interpolation on extended grid (zero padding)
+      # Fourier interpolation on extended grid (zero padding), scattered on k points
       do_double_grid(self.data_controller)
 
-      snawf,_,_,_,nspin = arrays['Hksp'].shape
-      arrays['Hksp'] = np.reshape(arrays['Hksp'], (snawf,attr['nkpnts'],nspin))
-      arrays['Hksp'] = gather_scatter(arrays['Hksp'], 1, attr['npool'])
-
-      snktot = arrays['Hksp'].shape[1]
+      snktot,nspin = arrays['Hksp'].shape[1:]
       if reshift_Ef:
         Hksp = arrays['Hksp'].reshape((nawf,nawf,snktot,nspin))
         Ef = E_Fermi(Hksp, self.data_controller, parallel=True)
@@ -880,32 +1088,45 @@ mo    '''
       self.report_exception('interpolated_hamiltonian')
       if attr['abort_on_exception']:
         raise e
+    else:
+      # A failed stage is not cached
+      self.cache_store()
 
     self.report_module_time('R -> k with Zero Padding')
 
 
 
-  def pao_eigh ( self, bval=0 ):
+  def pao_eigh ( self, bval=0, eigh_chunk=None, ibz=False, time_reversal=None ):
     '''
     Calculate the Eigen values and vectors of k-space Hamiltonian 'Hksp'
     Populates DataController with 'E_k' and 'v_k'
 
     Arguments:
         bval (int): Top valence band number (nelec/2) to correctly shift Eigenvalues
+        eigh_chunk (int): Number of k-points diagonalized in each batched LAPACK call. Smaller values reduce the memory overhead (0 diagonalizes all k-points at once)
+        ibz (bool): Diagonalize only the irreducible k-points of the grid. The k-space arrays computed afterwards (E_k, v_k, momenta, smearing) hold the irreducible wedge, and DoS, transport and dielectric tensors are recovered with the multiplicities and point group rotations. Other observables require the full grid
+        time_reversal (bool): Use time reversal (k -> -k) to reduce the grid with ibz=True. By default it is used unless the DFT system is magnetic with spin-orbit coupling. Inputs without DFT symmetry information (e.g. models) must set it explicitly, False for Hamiltonians breaking time reversal symmetry
 
     Returns:
         None
     '''
+    if self.cache_stage('pao_eigh', locals()):
+      return
+
     from .defs.do_eigh import do_pao_eigh
     from .defs.communication import gather_scatter,scatter_full,gather_full
 
     arrays,attr = self.data_controller.data_dicts()
 
     if 'bval' not in attr: attr['bval'] = bval
+    if eigh_chunk is not None: attr['eigh_chunk'] = eigh_chunk
+
+    if ibz and time_reversal is None and 'sym_rot' not in arrays:
+      raise ValueError('No symmetry information to reduce the k-point grid. Call pao_eigh with time_reversal=True or False.')
 
     # HRs and Hks are replaced with Hksp
     if 'HRs' in arrays:
-      del arrays['HRs']
+      self.data_controller.release_array('HRs')
 
     try:
       if 'Hksp' not in arrays:
@@ -918,7 +1139,21 @@ mo    '''
         arrays['Hksp'] = scatter_full(arrays['Hks'], attr['npool'])
         del arrays['Hks']
 
-      do_pao_eigh(self.data_controller)
+      if ibz:
+        from .defs.ibz import reduce_to_ibz,ibz_rows
+        reduce_to_ibz(self.data_controller, time_reversal)
+
+        # Hksp keeps the full grid, which the gradient is computed from
+        Hksp = arrays['Hksp']
+        arrays['Hksp'] = ibz_rows(self.data_controller, Hksp)
+        do_pao_eigh(self.data_controller)
+        arrays['Hksp'] = Hksp
+      else:
+        # A previous reduction to the irreducible wedge no longer applies
+        attr['ibz'] = False
+        for k in ['ibz_ind','ibz_mult','ibz_rot']:
+          arrays.pop(k, None)
+        do_pao_eigh(self.data_controller)
 
       ### PARALLELIZATION
       ## DEV: Sample RunTime Here
@@ -935,6 +1170,9 @@ mo    '''
       self.report_exception('pao_eigh')
       if attr['abort_on_exception']:
         raise e
+    else:
+      # A failed stage is not cached
+      self.cache_store()
 
     self.report_module_time('Eigenvalues')
 
@@ -952,6 +1190,9 @@ mo    '''
     Returns:
       None
     '''
+    if self.cache_stage('gradient_and_momenta', locals()):
+      return
+
     from .defs.do_gradient import do_gradient
     from .defs.do_momentum import do_momentum
     from .defs.communication import gather_scatter
@@ -959,6 +1200,12 @@ mo    '''
 
     arrays,attr = self.data_controller.data_dicts()
 
+    if band_curvature:
+      self.full_grid_required('band_curvature')
+
+    # A failed stage is not cached
+    complete = True
+
     try:
       snktot,nawf,_,nspin = arrays['Hksp'].shape
 
@@ -972,17 +1219,17 @@ mo    '''
       snawf,_,nspin = arrays['Hksp'].shape
       arrays['Hksp'] = np.reshape(arrays['Hksp'], (snawf,attr['nk1'],attr['nk2'],attr['nk3'],nspin))
 
+      ### PARALLELIZATION
+      # dHksp is gathered on nawf*nawf and scattered on k points as it is computed
       do_gradient(self.data_controller)
 
       if not band_curvature:
         # No more need for k-space Hamiltonian
         del arrays['Hksp']
 
-      ### PARALLELIZATION
-      #gather dHksp on nawf*nawf and scatter on k points
-      arrays['dHksp'] = np.reshape(arrays['dHksp'], (snawf,attr['nkpnts'],3,nspin))
-      arrays['dHksp'] = np.moveaxis(gather_scatter(arrays['dHksp'],1,attr['npool']), 0, 2)
-      arrays['dHksp'] = np.reshape(arrays['dHksp'], (snktot,3,nawf,nawf,nspin), order="C")
+      # dHksp holds the irreducible k-points only in IBZ mode
+      arrays['dHksp'] = np.moveaxis(arrays['dHksp'], 0, 2)
+      arrays['dHksp'] = np.reshape(arrays['dHksp'], (arrays['dHksp'].shape[0],3,nawf,nawf,nspin), order="C")
 
       if band_curvature:
         from .defs.do_band_curvature import do_band_curvature
@@ -991,6 +1238,7 @@ mo    '''
         del arrays['Hksp']
       
     except Exception as e:
+      complete = False
       self.report_exception('gradient_and_momenta')
       if attr['abort_on_exception']:
         raise e
@@ -1000,6 +1248,8 @@ mo    '''
     ### DEV: Proposed to remove this and calculate pksp or velkp when required
     # Compute the momentum operator p_n,m(k) (and kinetic energy operator)
     do_momentum(self.data_controller)
+    if complete:
+      self.cache_store()
     self.report_module_time('Momenta')
 
 
@@ -1015,6 +1265,9 @@ mo    '''
     Returns:
         None
     '''
+    if self.cache_stage('adaptive_smearing', locals()):
+      return
+
     from .defs.do_adaptive_smearing import do_adaptive_smearing
 
     attr = self.data_controller.data_attributes
@@ -1028,11 +1281,14 @@ mo    '''
       self.report_exception('adaptive_smearing')
       if attr['abort_on_exception']:
         raise e
+    else:
+      # A failed stage is not cached
+      self.cache_store()
     self.report_module_time('Adaptive Smearing')
 
 
 
-  def dos ( self, do_dos=True, do_pdos=True, delta=0.01, emin=-10., emax=2., ne=1000 ):
+  def dos ( self, do_dos=True, do_pdos=True, delta=0.01, emin=-10., emax=2., ne=1000, pdos_columns=False ):
     '''
     Calculate the Density of States and Projected Density of States
       If Adaptive Smearing has been performed, the Adaptive DoS will be calculated
@@ -1044,6 +1300,7 @@ mo    '''
         emin (float): The minimum energy in the range to be computed
         emax (float): The maximum energy in the range to be computed
         ne (int): The number of points to place in the range [emin,emax]
+        pdos_columns (bool): Write the PDoS of all orbitals to a single file (pdos_<spin>.dat) with one column per orbital, instead of one file per orbital (<orbital>_pdos_<spin>.dat)
 
     Returns:
         None
@@ -1051,6 +1308,13 @@ mo    '''
     arrays,attr = self.data_controller.data_dicts()
 
     if 'smearing' not in attr: attr['smearing'] = None
+    attr['pdos_columns'] = pdos_columns
+
+    # Orbital projections are not invariant under the point group
+    if do_pdos and attr.get('ibz', False):
+      if self.rank == 0:
+        print('PDoS requires the full k-point grid, skipped for the irreducible wedge.')
+      do_pdos = False
 
     try:
       if attr['smearing'] is None:
@@ -1094,6 +1358,8 @@ mo    '''
     '''
     from .defs.do_real_space import do_density
 
+    self.full_grid_required('density')
+
     do_density(self.data_controller, nr1,nr2,nr3)
     
     self.report_module_time('Density')
@@ -1127,6 +1393,8 @@ mo    '''
     '''
     from .defs.do_fermisurf import do_fermisurf
 
+    self.full_grid_required('fermi_surface')
+
     attr = self.data_controller.data_attributes
 
     if 'fermi_up' not in attr: attr['fermi_up'] = fermi_up
@@ -1156,6 +1424,8 @@ mo    '''
     '''
     from .defs.do_spin_texture import do_spin_texture
 
+    self.full_grid_required('spin_texture')
+
     arry,attr = self.data_controller.data_dicts()
 
     if 'fermi_up' not in attr: attr['fermi_up'] = fermi_up
@@ -1180,7 +1450,7 @@ mo    '''
 
 
 
-  def spin_Hall ( self, twoD=False, do_ac=False, emin=-1., emax=1., fermi_up=1., fermi_dw=-1., s_tensor=None ):
+  def spin_Hall ( self, twoD=False, do_ac=False, emin=-1., emax=1., fermi_up=1., fermi_dw=-1., s_tensor=None, ne=500 ):
     '''
     Calculate the Spin Hall Conductivity
       Currently this module does not possess the "spin_orbit" capability of do_topology, because I(Frank) do not know what this modification entails.
@@ -1191,6 +1461,7 @@ mo    '''
         do_ac (bool): True to calculate the Spic Circular Dichroism
         emin (float): The minimum energy in the range
         emax (float): The maximum energy in the range
+        ne (int): The number of energy increments in [emin,emax]
         fermi_up (float): The upper limit of the occupied energy range
         fermi_dw (float): The lower limit of the occupied energy range
         s_tensor (list): List of tensor elements to calculate (e.g. To calculate xxx and zxy use [[0,0,0],[0,1,2]])
@@ -1200,9 +1471,11 @@ mo    '''
     '''
     from .defs.do_Hall import do_spin_Hall
 
+    self.full_grid_required('spin_Hall')
+
     arrays,attr = self.data_controller.data_dicts()
 
-    attr['eminH'],attr['emaxH'] = emin,emax
+    attr['eminH'],attr['emaxH'],attr['neH'] = emin,emax,ne
 
     if s_tensor is not None: arrays['s_tensor'] = np.array(s_tensor)
     if 'fermi_up' not in attr: attr['fermi_up'] = fermi_up
@@ -1240,6 +1513,8 @@ mo    '''
     '''
     from .defs.do_rashba_edelstein import do_rashba_edelstein
 
+    self.full_grid_required('rashba_edelstein')
+
     arrays,attr = self.data_controller.data_dicts()
 
     ene = np.linspace(emin, emax, ne)
@@ -1254,7 +1529,7 @@ mo    '''
     self.report_module_time('Rashba_Edelstein')
 
 
-  def anomalous_Hall ( self, do_ac=False, emin=-1., emax=1., fermi_up=1., fermi_dw=-1., a_tensor=None ):
+  def anomalous_Hall ( self, do_ac=False, emin=-1., emax=1., fermi_up=1., fermi_dw=-1., a_tensor=None, ne=500 ):
     '''
     Calculate the Anomalous Hall Conductivity
 
@@ -1262,6 +1537,7 @@ mo    '''
         do_ac (bool): True to calculate the Magnetic Circular Dichroism
         emin (float): The minimum energy in the range
         emax (float): The maximum energy in the range
+        ne (int): The number of energy increments in [emin,emax]
         fermi_up (float): The upper limit of the occupied energy range
         fermi_dw (float): The lower limit of the occupied energy range
         a_tensor (list): List of tensor elements to calculate (e.g. To calculate xx and yz use [[0,0],[1,2]])
@@ -1271,10 +1547,13 @@ mo    '''
     '''
     from .defs.do_Hall import do_anomalous_Hall
 
+    self.full_grid_required('anomalous_Hall')
+
     arrays,attr = self.data_controller.data_dicts()
 
     attr['eminH'] = emin
     attr['emaxH'] = emax
+    attr['neH'] = ne
 
     if a_tensor is not None: arrays['a_tensor'] = np.array(a_tensor)
     if 'fermi_up' not in attr: attr['fermi_up'] = fermi_up
@@ -1308,6 +1587,8 @@ mo    '''
     '''
     from .defs.do_effective_mass import do_effective_mass
 
+    self.full_grid_required('effective_mass')
+
     arrays,attr = self.data_controller.data_dicts()
 
     ene = np.linspace(emin, emax, ne)
@@ -1387,6 +1668,9 @@ mo    '''
     '''
     from .defs.do_transport import do_transport
 
+    if do_hall:
+      self.full_grid_required('Hall coefficient')
+
     arrays,attr = self.data_controller.data_dicts()
     if 'tau_dict' not in attr: attr['tau_dict'] = tau_dict
 
@@ -1411,9 +1695,11 @@ mo    '''
 
 
 
-  def dielectric_tensor ( self, metal=False, temp=None, delta=0.01, emin=0., emax=10., ne=500, d_tensor=None ):
+  def dielectric_tensor ( self, metal=False, temp=None, delta=0.01, emin=0., emax=10., ne=500, d_tensor=None, kk_method='simps' ):
     '''
     Calculate the Dielectric Tensor
+      The routine is under construction and currently returns without computing anything.
+      The engine in defs/do_epsilon.py can be run directly (see examples/benchmarks/bench_epsilon.py)
 
     Arguments:
         metal (bool): True if system is metallic
@@ -1423,6 +1709,7 @@ mo    '''
         emax (float): The maximum value of energy
         ne (float): Number of energy values between emin and emax
         d_tensor (list): List of tensor elements to calculate (e.g. To calculate xx and yz use [[0,0],[1,2]])
+        kk_method (str): Kramers-Kronig integration for Re(epsilon), 'simps' (O(ne^2) Simpson integrals) or 'fft' (O(ne log ne) Maclaurin rule with FFT convolutions)
 
     Returns:
         None
@@ -1438,6 +1725,7 @@ mo    '''
     if 'delta' not in attr: attr['delta'] = delta
     if 'metal' not in attr: attr['metal'] = metal
     if d_tensor is not None: arrays['d_tensor'] = np.array(d_tensor)
+    attr['kk_method'] = kk_method
 
     #-----------------------------------------------
     # Compute dielectric tensor (Re and Im epsilon)
@@ -1494,6 +1782,8 @@ mo    '''
     from .defs.do_ipr import inverse_participation_ratio
     from os.path import join
 
+    self.full_grid_required('ipr')
+
     arry, attr = self.data_controller.data_dicts()
 
     try:
@@ -24,6 +24,9 @@ def add_ext_field ( data_controller ):
   arrays = data_controller.data_arrays
   attributes = data_controller.data_attributes
 
+  # Node-shared HRs are read-only, modify a private copy
+  data_controller.release_array('HRs', keep=True)
+
   nawf,_,nk1,nk2,nk3,nspin = arrays['HRs'].shape
   arrays['HRs'] = np.reshape(arrays['HRs'], (nawf,nawf,nk1*nk2*nk3,nspin), order='C')
 
@@ -53,3 +56,6 @@ def add_ext_field ( data_controller ):
       arrays['HRs'][n,n,0,:] -= arrays['HubbardU'][n]/2.0
 
   arrays['HRs'] = np.reshape(arrays['HRs'], (nawf,nawf,nk1,nk2,nk3,nspin), order='C')
+
+  if 'HRs' in data_controller.shared_keys:
+    data_controller.broadcast_single_array('HRs')
@@ -0,0 +1,121 @@
+#
+# PAOFLOW
+#
+# Copyright 2016-2024 - Marco BUONGIORNO NARDELLI (mbn@unt.edu)
+#
+# Reference:
+#
+# F.T. Cerasoli, A.R. Supka, A. Jayaraj, I. Siloi, M. Costa, J. Slawinska, S. Curtarolo, M. Fornari, D. Ceresoli, and M. Buongiorno Nardelli,
+# Advanced modeling of materials with PAOFLOW 2.0: New features and software design, Comp. Mat. Sci. 200, 110828 (2021).
+#
+# M. Buongiorno Nardelli, F. T. Cerasoli, M. Costa, S Curtarolo,R. De Gennaro, M. Fornari, L. Liyanage, A. Supka and H. Wang,
+# PAOFLOW: A utility to construct and operate on ab initio Hamiltonians from the Projections of electronic wavefunctions on
+# Atomic Orbital bases, including characterization of topological materials, Comp. Mat. Sci. vol. 143, 462 (2018).
+#
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+
+# Multi-axis FFTs of whole stacks of arrays, e.g. every orbital pair of a pool at once,
+# with a selectable backend:
+#   'numpy'  - numpy.fft, single threaded
+#   'scipy'  - scipy.fft, threaded over the stack with 'workers'
+#   'pyfftw' - FFTW through pyFFTW's numpy interface, with cached plans. Wisdom can be
+#              kept between runs with load_wisdom and save_wisdom
+
+import numpy as np
+
+fft_backends = ['numpy', 'scipy', 'pyfftw']
+
+def default_fft_threads ( nranks ):
+  # Cores available to each of the ranks sharing a node, at least 1
+  from os import cpu_count
+  return max(1, (cpu_count() or 1)//max(1,nranks))
+
+
+def check_fft_backend ( backend ):
+  '''
+  Validate an FFT backend, falling back to 'scipy' when pyFFTW is not installed
+
+  Arguments:
+      backend (str): 'numpy', 'scipy' or 'pyfftw'
+
+  Returns:
+      backend (str): The backend which will be used
+  '''
+  if backend not in fft_backends:
+    raise ValueError('FFT backend %s not supported.\nFFT backends are %s'%(str(backend),', '.join(fft_backends)))
+
+  if backend == 'pyfftw':
+    try:
+      import pyfftw
+    except ImportError:
+      backend = 'scipy'
+  return backend
+
+
+def batched_fftn ( arr, axes=(1,2,3), inverse=False, backend='scipy', workers=1, overwrite=False ):
+  '''
+  FFT over 'axes' of every array in a stack, in a single (threaded) call
+
+  Arguments:
+      arr (ndarray): Complex stack of arrays
+      axes (tuple): Axes to transform, the other axes are batched
+      inverse (bool): True for the inverse transform, normalized by 1/N as numpy.fft.ifftn
+      backend (str): 'numpy', 'scipy' or 'pyfftw'
+      workers (int): Number of threads (ignored by 'numpy')
+      overwrite (bool): If True the content of 'arr' may be destroyed
+
+  Returns:
+      farr (ndarray): Transformed array, same shape as 'arr'
+  '''
+  if backend == 'numpy':
+    return (np.fft.ifftn if inverse else np.fft.fftn)(arr, axes=axes)
+
+  if backend == 'pyfftw':
+    from pyfftw.interfaces import cache,numpy_fft
+    # Plans are kept between calls on blocks of the same shape
+    cache.enable()
+    func = numpy_fft.ifftn if inverse else numpy_fft.fftn
+    return func(arr, axes=axes, threads=workers, overwrite_input=overwrite, planner_effort='FFTW_MEASURE')
+
+  import scipy.fft as sfft
+  func = sfft.ifftn if inverse else sfft.fftn
+  return func(arr, axes=axes, workers=workers, overwrite_x=overwrite)
+
+
+def load_wisdom ( fname ):
+  '''
+  Import FFTW wisdom saved by save_wisdom, if the file exists
+
+  Arguments:
+      fname (str): Wisdom file
+
+  Returns:
+      None
+  '''
+  from os.path import exists
+  from pickle import load
+  import pyfftw
+
+  if exists(fname):
+    with open(fname, 'rb') as f:
+      pyfftw.import_wisdom(load(f))
+
+
+def save_wisdom ( fname ):
+  '''
+  Export the FFTW wisdom gathered while planning, so later runs skip the measurements
+
+  Arguments:
+      fname (str): Wisdom file
+
+  Returns:
+      None
+  '''
+  from pickle import dump
+  import pyfftw
+
+  with open(fname, 'wb') as f:
+    dump(pyfftw.export_wisdom(), f)
@@ -0,0 +1,245 @@
+#
+# PAOFLOW
+#
+# Copyright 2016-2024 - Marco BUONGIORNO NARDELLI (mbn@unt.edu)
+#
+# Reference:
+#
+# F.T. Cerasoli, A.R. Supka, A. Jayaraj, I. Siloi, M. Costa, J. Slawinska, S. Curtarolo, M. Fornari, D. Ceresoli, and M. Buongiorno Nardelli,
+# Advanced modeling of materials with PAOFLOW 2.0: New features and software design, Comp. Mat. Sci. 200, 110828 (2021).
+#
+# M. Buongiorno Nardelli, F. T. Cerasoli, M. Costa, S Curtarolo,R. De Gennaro, M. Fornari, L. Liyanage, A. Supka and H. Wang,
+# PAOFLOW: A utility to construct and operate on ab initio Hamiltonians from the Projections of electronic wavefunctions on
+# Atomic Orbital bases, including characterization of topological materials, Comp. Mat. Sci. vol. 143, 462 (2018).
+#
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+
+# Checkpoint layout (one directory per checkpoint):
+#   manifest.json     - Format version, number of ranks and pools, and for every array
+#                       its file, dtype, global shape, layout and the global first-axis
+#                       index ranges held by each rank
+#   attributes.pkl    - The attributes dictionary
+#   objects_<r>.pkl   - Entries of rank r which are not numeric arrays
+#   array_<i>.npy     - One raw contiguous .npy block per array, in global order
+#   array_<i>_<r>.npy - Block of rank r of the arrays with the 'rank' layout
+#
+# Array layouts:
+#   'distributed' - k-point axis distributed by scatter_full. Every rank writes its own part
+#   'replicated'  - Identical on every rank, written by rank 0
+#   'root'        - Only present on rank 0
+#   'rank'        - Different on each rank, but not distributed as by scatter_full (e.g. the
+#                   orbital distributed Hksp kept for the band curvature). Every rank writes
+#                   its own block, which can only be read back with the same ranks and pools
+
+import numpy as np
+
+checkpoint_version = 1
+
+# k-point axis, counted from the last one, of the k-distributed arrays. Their
+# distribution cannot be read from the shapes when every rank holds as many k-points
+kspace_axes = {'E_k':-3, 'v_k':-4, 'Hksp':-4, 'dHksp':-5, 'pksp':-5, 'deltakp':-3,
+               'deltakp2':-4, 'd2Ed2k':-3, 'scattering_tau':-3, 'ibz_mult':-1}
+
+def index_ranges ( ind ):
+  # Global index ranges [start,stop) of a sorted index list
+  from .communication import index_runs
+  starts,lengths = index_runs(np.asarray(ind))
+  return [[int(s),int(s+l)] for s,l in zip(starts,lengths)]
+
+
+def array_layout ( key, shapes, npool, nkpnts ):
+  '''
+  Determine the layout of an array from its shape on every rank
+
+  Arguments:
+      key (str): Name of the array
+      shapes (list): Shape on each rank, None where the array is absent
+      npool (int): Number of pools used to distribute k-space arrays
+      nkpnts (list): Numbers of k-points of the full grid and, in IBZ mode, of the irreducible wedge
+
+  Returns:
+      layout (str): 'distributed', 'replicated', 'root' or 'rank'
+      gshape (tuple): Global shape of the array
+      axis (int): Distributed axis, None if the array is not distributed
+  '''
+  from .communication import scatter_indices
+
+  shape0 = tuple(shapes[0])
+  if any(s is None for s in shapes[1:]):
+    return 'root', shape0, None
+  if any(len(s) != len(shape0) for s in shapes):
+    return 'rank', shape0, None
+
+  # Known k-space arrays are distributed over the full grid, other arrays
+  # are taken as distributed when a single axis differs between the ranks
+  diff = [a for a in range(len(shape0)) if any(s[a] != shape0[a] for s in shapes)]
+  if key in kspace_axes and len(shape0) >= -kspace_axes[key]:
+    axes = [len(shape0)+kspace_axes[key]]
+    if any(a != axes[0] for a in diff) or sum(s[axes[0]] for s in shapes) not in nkpnts:
+      axes = diff
+  else:
+    axes = diff
+
+  if len(axes) == 1:
+    a = axes[0]
+    counts = [s[a] for s in shapes]
+    if counts == [i.size for i in scatter_indices(sum(counts), npool)]:
+      return 'distributed', shape0[:a]+(sum(counts),)+shape0[a+1:], a
+
+  # Shapes differing in a way scatter_full does not produce are rank-local
+  return ('rank' if diff else 'replicated'), shape0, None
+
+
+def content_digest ( arr ):
+  # Digest of the contents of an array, to tell replicated arrays from rank-local ones
+  from hashlib import sha256
+  return sha256(np.ascontiguousarray(arr).view(np.uint8)).hexdigest()
+
+
+def write_checkpoint ( data_controller, path ):
+  '''
+  Write the DataController's arrays and attributes to the checkpoint directory 'path'.
+  Every rank writes its part of the k-distributed arrays in parallel, at its global offset.
+
+  Arguments:
+      data_controller (DataController): The DataController
+      path (str): Checkpoint directory
+
+  Returns:
+      None
+  '''
+  import json
+  from os import makedirs
+  from os.path import join
+  from pickle import dump,HIGHEST_PROTOCOL
+  from numpy.lib.format import open_memmap
+  from .communication import scatter_indices,mpi_bufferable
+
+  comm,rank,size = data_controller.comm,data_controller.rank,data_controller.size
+  arrays,attributes = data_controller.data_dicts()
+  npool = attributes.get('npool', 1)
+
+  if rank == 0:
+    makedirs(path, exist_ok=True)
+  comm.Barrier()
+
+  # Numeric arrays go to raw .npy blocks, everything else is pickled per rank
+  keys = sorted(k for k,v in arrays.items() if mpi_bufferable(v))
+  objects = {k:v for k,v in arrays.items() if k not in keys}
+  with open(join(path,'objects_%d.pkl'%rank), 'wb') as f:
+    dump(objects, f, HIGHEST_PROTOCOL)
+
+  shapes = comm.allgather({k:arrays[k].shape for k in keys})
+
+  manifest = {'version':checkpoint_version, 'mpisize':size, 'npool':npool, 'arrays':{}}
+  # k-distributed arrays hold the full grid or, in IBZ mode, the irreducible wedge
+  nkpnts = [attributes.get('nkpnts'), attributes.get('nkibz')]
+  for i,k in enumerate(sorted(shapes[0])):
+    layout,gshape,axis = array_layout(k, [s.get(k) for s in shapes], npool, nkpnts)
+    # Equal shapes do not make an array replicated, compare the contents of the ranks
+    if layout == 'replicated' and size > 1:
+      if len(set(comm.allgather(content_digest(arrays[k])))) > 1:
+        layout = 'rank'
+    entry = {'file':'array_%d.npy'%i, 'dtype':arrays[k].dtype.str if rank==0 else None, 'shape':list(gshape), 'layout':layout}
+    if layout == 'distributed':
+      entry['axis'] = axis
+      entry['ranges'] = [index_ranges(ind) for ind in scatter_indices(gshape[axis], npool)]
+    manifest['arrays'][k] = entry
+
+    fname = join(path, entry['file'])
+    if layout == 'rank':
+      np.save(fname.replace('.npy','_%d.npy'%rank), arrays[k])
+    elif layout == 'distributed':
+      # Rank 0 writes the header, then every rank fills its own part
+      if rank == 0:
+        mm = open_memmap(fname, mode='w+', dtype=arrays[k].dtype, shape=gshape)
+        del mm
+      comm.Barrier()
+      if arrays[k].size > 0:
+        mm = open_memmap(fname, mode='r+')
+        offset = 0
+        for s,e in entry['ranges'][rank]:
+          mm[(slice(None),)*axis+(slice(s,e),)] = arrays[k][(slice(None),)*axis+(slice(offset,offset+e-s),)]
+          offset += e-s
+        mm.flush()
+        del mm
+    elif rank == 0:
+      np.save(fname, arrays[k])
+
+  if rank == 0:
+    with open(join(path,'attributes.pkl'), 'wb') as f:
+      dump(attributes, f, HIGHEST_PROTOCOL)
+    with open(join(path,'manifest.json'), 'w') as f:
+      json.dump(manifest, f, indent=1)
+  comm.Barrier()
+
+
+def read_checkpoint ( data_controller, path ):
+  '''
+  Populate the DataController from the checkpoint directory 'path'. Arrays are memory
+  mapped copy-on-write, so they are read lazily and can still be modified in memory.
+  k-distributed arrays are re-scattered when the number of ranks differs from the run
+  that wrote the checkpoint.
+
+  Arguments:
+      data_controller (DataController): The DataController
+      path (str): Checkpoint directory
+
+  Returns:
+      None
+  '''
+  import json
+  from os.path import join
+  from pickle import load
+  from .communication import scatter_indices,index_runs
+
+  rank,size = data_controller.rank,data_controller.size
+
+  with open(join(path,'manifest.json'), 'r') as f:
+    manifest = json.load(f)
+  if manifest['version'] > checkpoint_version:
+    raise ValueError('Checkpoint format version %d is not supported.'%manifest['version'])
+
+  with open(join(path,'attributes.pkl'), 'rb') as f:
+    attributes = load(f)
+  npool = attributes.get('npool', 1)
+  same_layout = size == manifest['mpisize'] and npool == manifest['npool']
+
+  rank_local = sorted(k for k,entry in manifest['arrays'].items() if entry['layout'] == 'rank')
+  if rank_local and not same_layout:
+    raise ValueError('Checkpoint arrays %s are distributed in an unknown way. Restart with %d ranks and %d pools.'%(', '.join(rank_local),manifest['mpisize'],manifest['npool']))
+
+  # Per rank objects can only be reused on the same layout, otherwise rank 0's are taken
+  fname = join(path, 'objects_%d.pkl'%(rank if same_layout else 0))
+  with open(fname, 'rb') as f:
+    arrays = load(f)
+
+  for k,entry in manifest['arrays'].items():
+    fname = join(path, entry['file'])
+    if entry['layout'] == 'root' and rank != 0:
+      continue
+    if entry['layout'] == 'rank':
+      fname = fname.replace('.npy','_%d.npy'%rank)
+    mm = np.load(fname, mmap_mode='c')
+    if entry['layout'] != 'distributed':
+      arrays[k] = mm
+      continue
+    axis = entry['axis']
+    starts,lengths = index_runs(scatter_indices(entry['shape'][axis], npool, rank))
+    parts = [mm[(slice(None),)*axis+(slice(s,s+l),)] for s,l in zip(starts,lengths)]
+    if len(parts) == 1:
+      arrays[k] = parts[0]
+    else:
+      arrays[k] = np.concatenate(parts, axis=axis) if parts else mm[(slice(None),)*axis+(slice(0,0),)]
+
+  # The degenerate subspaces are k-distributed, rebuild them for the new layout
+  if not same_layout and 'degen' in arrays and 'E_k' in arrays:
+    from .do_eigh import get_degeneracies
+    arrays['degen'] = get_degeneracies(arrays['E_k'], attributes['bnd'])
+
+  attributes['mpisize'] = size
+  data_controller.data_arrays = arrays
+  data_controller.data_attributes = attributes
@@ -25,6 +25,9 @@ comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 size = comm.Get_size()
 
+# Largest count accepted by a single MPI call
+int_max = 2**31-1
+
 def load_balancing ( size, rank, n ):
     # Load balancing
     splitsize = float(n)/float(size)
@@ -49,6 +52,32 @@ def load_sizes ( size, n, dim):
 
 
 
+def contiguous_type ( mpitype, n ):
+    '''
+    Committed MPI datatype of n consecutive elements of 'mpitype', built so that
+    no count passed to MPI exceeds int_max. Free it after use.
+
+    Arguments:
+        mpitype (MPI.Datatype): Element datatype
+        n (int): Number of elements
+
+    Returns:
+        dtype (MPI.Datatype): The committed datatype
+    '''
+    if n <= int_max:
+        return mpitype.Create_contiguous(n).Commit()
+
+    q,r = divmod(n, int_max)
+    chunk = mpitype.Create_contiguous(int_max)
+    body = chunk.Create_contiguous(q)
+    tail = mpitype.Create_contiguous(r)
+    _,extent = mpitype.Get_extent()
+    dtype = MPI.Datatype.Create_struct([1,1], [0,q*int_max*extent], [body,tail]).Commit()
+    for t in (chunk,body,tail):
+        t.Free()
+    return dtype
+
+
 # Scatters first dimension of an array of arbitrary length
 def scatter_array ( arr, sroot=0 ):
 
@@ -85,11 +114,13 @@ def scatter_array ( arr, sroot=0 ):
     # Initialize aux array
     arraux = np.empty(auxshape, dtype=pydtype)
 
-    # Get the datatype for the MPI transfer
-    mpidtype = MPI._typedict[np.dtype(pydtype).char]
+    # Get the datatype for the MPI transfer, one element per row so that counts stay below int_max
+    rowtype = contiguous_type(MPI._typedict[np.dtype(pydtype).char], int(np.prod(auxshape[1:])))
+    lrows = load_sizes(size, int(lsizes[:,2].sum()), 1)
 
     # Scatter the data according to load_sizes
-    comm.Scatterv([arr, lsizes[:,0], lsizes[:,1], mpidtype], [arraux, mpidtype], root=sroot)
+    comm.Scatterv([arr, lrows[:,0], lrows[:,1], rowtype], [arraux, auxshape[0], rowtype], root=sroot)
+    rowtype.Free()
 
     return arraux
 
@@ -104,11 +135,13 @@ def gather_array ( arr, arraux, sroot=0 ):
     # Broadcast the data offsets
     comm.Bcast([lsizes, MPI.INT], root=sroot)
 
-    # Get the datatype for the MPI transfer
-    mpidtype = MPI._typedict[np.dtype(arraux.dtype).char]
+    # Get the datatype for the MPI transfer, one element per row so that counts stay below int_max
+    rowtype = contiguous_type(MPI._typedict[np.dtype(arraux.dtype).char], int(np.prod(arraux.shape[1:])))
+    lrows = load_sizes(size, int(lsizes[:,2].sum()), 1)
 
     # Gather the data according to load_sizes
-    comm.Gatherv([arraux, mpidtype], [arr, lsizes[:,0], lsizes[:,1], mpidtype], root=sroot)
+    comm.Gatherv([arraux, arraux.shape[0], rowtype], [arr, lrows[:,0], lrows[:,1], rowtype], root=sroot)
+    rowtype.Free()
 
 
 def scatter_full(arr,npool,sroot=0):
@@ -201,74 +234,282 @@ def gather_full(arr,npool,sroot=0):
         return temp
 
 
-def gather_scatter(arr,scatter_axis,npool):
-    #scatter indices for scatter_axis to each proc
-    axis_ind = np.array(list(range(arr.shape[scatter_axis])),dtype=int)
-    axis_ind = scatter_full(axis_ind,npool)
-
-    #broadcast indices that for scattered array to proc with rank 'r'
-    size_r = np.zeros((size),dtype=int,order='C')
-    scatter_ind = np.zeros((arr.shape[scatter_axis]),dtype=int,order='C')
-    
-    if rank==0:
-        gather_array(size_r,np.array(axis_ind.size,dtype=int))
-        gather_array(scatter_ind,np.array(axis_ind,dtype=int))
-    else:
-        gather_array(None,np.array(axis_ind.size,dtype=int))
-        gather_array(None,np.array(axis_ind,dtype=int))
+def scatter_indices ( n, npool, r=None ):
+    # Global indices of the first axis held by rank 'r' (every rank if None)
+    # after scatter_full(arr,npool), in their local order
+    nchunks = n//size
+    inds = []
+    for p in (range(size) if r is None else [r]):
+        ind = []
+        for pool in range(npool if nchunks!=0 else 0):
+            chunk_s,chunk_e = load_balancing(npool,pool,nchunks)
+            ind.append(chunk_s*size + p*(chunk_e-chunk_s) + np.arange(chunk_e-chunk_s))
+        ts,te = load_balancing(size,p,n%size)
+        ind.append(nchunks*size + np.arange(ts,te))
+        inds.append(np.concatenate(ind).astype(int))
+    return inds if r is None else inds[0]
+
+
+def index_runs ( ind ):
+    # Starts and lengths of the runs of consecutive integers in ind
+    brk = np.nonzero(np.diff(ind) != 1)[0]+1
+    return ind[np.r_[0,brk]] if ind.size else ind, np.diff(np.r_[0,brk,ind.size]) if ind.size else ind
+
+
+def gather_scatter(arr,scatter_axis,npool,func=None):
+    '''
+    Distributed transpose. The first axis of 'arr', distributed as by scatter_full,
+    is gathered on every rank while 'scatter_axis' is distributed in its place.
+    Ranks exchange their blocks directly with non-blocking Alltoallw calls, one per
+    pool of rows, so nothing is funneled through a single rank. MPI derived
+    datatypes pick the columns of each destination, so no send buffer is packed.
+
+    Arguments:
+        arr (ndarray): Local block, first axis distributed over the ranks
+        scatter_axis (int): Axis to distribute (of func's output, if given)
+        npool (int): Number of pools of rows, i.e. of Alltoallw rounds
+        func (callable): Optional function applied to each pool of local rows before
+                         it is sent, e.g. FFTs. The next pool is computed while the
+                         previous one is in flight. It must preserve the first axis
+
+    Returns:
+        temp (ndarray): Array with the full first axis and the local part of scatter_axis
+    '''
+    counts = comm.allgather(arr.shape[0])
+    nrows = sum(counts)
+    nchunks = nrows//size
+    rem = [load_balancing(size,r,nrows%size) for r in range(size)]
+    if any(counts[r] != nchunks+te-ts for r,(ts,te) in enumerate(rem)):
+        raise ValueError('gather_scatter: first axis is not distributed as by scatter_full')
+
+    # Rounds follow the pools of scatter_full, plus one for the remainder rows,
+    # so that the rows received in each round are contiguous in the output
+    rounds = [load_balancing(npool,pool,nchunks) for pool in range(npool if nchunks!=0 else 0)]
+    if nrows%size != 0:
+        rounds.append((nchunks,None))
+
+    temp = None
+    pending = None
+    for chunk_s,chunk_e in rounds:
+        if chunk_e is None:
+            mrows = np.array([te-ts for ts,te in rem])
+            rstart = nchunks*size + np.array([ts for ts,te in rem])
+        else:
+            mrows = np.full(size, chunk_e-chunk_s)
+            rstart = chunk_s*size + np.arange(size)*(chunk_e-chunk_s)
+        rows = arr[chunk_s:chunk_s+mrows[rank]]
+        block = np.ascontiguousarray(rows if func is None else func(rows))
+
+        if temp is None:
+            # Output layout, known once the first block is computed
+            shape = list(block.shape)
+            ncol = shape[scatter_axis]
+            cols = scatter_indices(ncol, npool)
+            shape[0],shape[scatter_axis] = nrows,cols[rank].size
+            temp = np.empty(shape, dtype=block.dtype)
+            rowsize = int(np.prod(shape[1:]))
+            outer = int(np.prod(shape[1:scatter_axis]))
+            inner = int(np.prod(shape[scatter_axis+1:]))
+
+            # One row of the columns sent to each rank, and one output row.
+            # Counts are then numbers of rows, which keeps them below int_max
+            mpitype = MPI._typedict[block.dtype.char]
+            rowtype = contiguous_type(mpitype, rowsize)
+            coltypes = []
+            for r in range(size):
+                starts,lengths = index_runs(cols[r])
+                runs = [contiguous_type(mpitype, int(l)*inner) for l in lengths]
+                itype = MPI.Datatype.Create_struct([1]*len(runs), (starts*inner*block.itemsize).tolist(), runs)
+                coltypes.append(itype.Create_resized(0, ncol*inner*block.itemsize))
+                for t in runs+[itype]:
+                    t.Free()
+
+        stypes = [t.Create_contiguous(block.shape[0]*outer).Commit() for t in coltypes]
+        rdispls = (rstart*rowsize*block.itemsize).tolist()
+        req = comm.Ialltoallw([block, [1]*size, [0]*size, stypes],
+                              [temp, mrows.tolist(), rdispls, [rowtype]*size])
+
+        if pending is not None:
+            _wait_transpose(*pending)
+        # Keep the send buffer and datatypes alive until the transfer is complete
+        pending = (req, block, stypes)
+
+    if pending is not None:
+        _wait_transpose(*pending)
+        for t in coltypes+[rowtype]:
+            t.Free()
 
-    axis_ind = None
+    return temp
 
-    comm.Bcast(size_r)
-    comm.Bcast(scatter_ind)
 
-    #start and end points of indices of scatter axis for each proc
-    end   = np.cumsum(size_r)
-    start = end - size_r
-    size_r = None
-    
-    for r in range(size):
-        comm.Barrier()
-        #gather array from each proc with indices for each proc on scatter_axis
-        if r == rank:
-            temp = gather_full(np.take(arr,scatter_ind[start[r]:end[r]],axis=scatter_axis),npool,sroot=r)
+def _wait_transpose ( req, block, stypes ):
+    req.Wait()
+    for t in stypes:
+        t.Free()
+
+
+def fetch_rows ( arr, npool, ind ):
+    '''
+    Rows of an array whose first axis is distributed as by scatter_full, by global index.
+    Each rank requests its rows directly from their owners with two Alltoallv calls,
+    so the full array is never assembled. Every rank must call it, possibly with an
+    empty 'ind'.
+
+    Arguments:
+        arr (ndarray): Local block, first axis distributed over the ranks
+        npool (int): Number of pools used to distribute 'arr'
+        ind (ndarray): Global indices of the rows to fetch
+
+    Returns:
+        rows (ndarray): The rows 'ind' of the distributed array, in the order of 'ind'
+    '''
+    nrows = comm.allreduce(arr.shape[0])
+    owner = np.empty(nrows, dtype=int)
+    local = np.empty(nrows, dtype=int)
+    for r,inds in enumerate(scatter_indices(nrows, npool)):
+        owner[inds] = r
+        local[inds] = np.arange(inds.size)
+
+    # Each distinct row is requested once, grouped by owner
+    uniq,inv = np.unique(np.asarray(ind, dtype=int), return_inverse=True)
+    order = np.argsort(owner[uniq], kind='stable')
+    scounts = np.bincount(owner[uniq], minlength=size)
+    rcounts = np.array(comm.alltoall(scounts.tolist()))
+    sdispls = np.r_[0,np.cumsum(scounts)[:-1]]
+    rdispls = np.r_[0,np.cumsum(rcounts)[:-1]]
+
+    req = np.ascontiguousarray(local[uniq[order]], dtype=np.int64)
+    sreq = np.empty(rcounts.sum(), dtype=np.int64)
+    comm.Alltoallv([req, scounts, sdispls, MPI.INT64_T], [sreq, rcounts, rdispls, MPI.INT64_T])
+
+    # Rows are sent as single datatype elements, so counts stay below int_max
+    reply = np.ascontiguousarray(arr[sreq])
+    rows = np.empty((uniq.size,)+arr.shape[1:], dtype=arr.dtype)
+    rowtype = contiguous_type(MPI._typedict[arr.dtype.char], int(np.prod(arr.shape[1:])))
+    comm.Alltoallv([reply, rcounts, rdispls, rowtype], [rows, scounts, sdispls, rowtype])
+    rowtype.Free()
+
+    out = np.empty_like(rows)
+    out[order] = rows
+    return out[inv]
+
+
+def mpi_bufferable ( arr ):
+    # True if arr can be transferred as a raw MPI buffer
+    return isinstance(arr, np.ndarray) and arr.dtype.kind in 'biufc' and arr.dtype.char in MPI._typedict
+
+
+def bcast_array ( arr, root=0, comm=comm, out=None, chunk_bytes=2**28 ):
+    '''
+    Broadcast a NumPy array with buffer based Bcast, in chunks of at most chunk_bytes
+    so that no single call exceeds the MPI int count limit.
+
+    Arguments:
+        arr (ndarray): Array to broadcast (only referenced on root)
+        root (int): Rank of the source array
+        comm (MPI.Comm): Communicator
+        out (ndarray): Optional contiguous receive buffer on the other ranks
+        chunk_bytes (int): Maximum size of a single Bcast
+
+    Returns:
+        arr (ndarray): The broadcasted array on every rank
+    '''
+    crank = comm.Get_rank()
+    shape,dtype = comm.bcast(((arr.shape,arr.dtype) if crank==root else None), root=root)
+
+    if crank == root:
+        buf = np.ascontiguousarray(arr)
+        if out is not None:
+            out[...] = buf
+            buf = out
+    else:
+        buf = np.empty(shape, dtype=dtype) if out is None else out
+
+    flat = buf.reshape(-1)
+    step = max(1, min(int_max, chunk_bytes//dtype.itemsize))
+    for s in range(0, flat.size, step):
+        comm.Bcast(flat[s:s+step], root=root)
+
+    return buf
+
+
+def bcast_dict ( data, root=0, comm=comm, root_only=(), shared=() ):
+    '''
+    Broadcast a dictionary. NumPy arrays are sent with buffer based Bcast,
+    everything else is pickled together in a single bcast.
+
+    Arguments:
+        data (dict): Dictionary to broadcast (only referenced on root)
+        root (int): Rank of the source dictionary
+        comm (MPI.Comm): Communicator
+        root_only (list): Keys of arrays that are not broadcast (they stay on root only)
+        shared (list): Keys of read-only arrays placed once per node in an MPI shared memory window
+
+    Returns:
+        data (dict): The broadcasted dictionary
+        windows (dict): MPI windows backing the shared arrays, by key
+    '''
+    crank = comm.Get_rank()
+
+    small = keys = None
+    if crank == root:
+        keys = [k for k,v in data.items() if mpi_bufferable(v) and k not in root_only]
+        small = {k:v for k,v in data.items() if k not in keys and k not in root_only}
+    small,keys = comm.bcast((small,keys), root=root)
+
+    out = data if crank == root else small
+    windows = {}
+    for k in keys:
+        arr = data[k] if crank == root else None
+        if k in shared:
+            out[k],windows[k] = shared_array(arr, root=root, comm=comm)
         else:
-            gather_full(np.take(arr,scatter_ind[start[r]:end[r]],axis=scatter_axis),npool,sroot=r)
+            out[k] = bcast_array(arr, root=root, comm=comm)
 
-    start = end = scatter_ind = None
+    return out, windows
 
-    return temp
 
+def shared_array ( arr, root=0, comm=comm ):
+    '''
+    Copy of the array on root, allocated once per node in an MPI shared memory window.
+    Every rank receives a read-only view of its node's copy.
 
-def gen_window(array,root=0):
-    # creates a shared memory copy of array on
-    # rank == root that all procs can access
+    Arguments:
+        arr (ndarray): Array to share (only referenced on root)
+        root (int): Rank of the source array
+        comm (MPI.Comm): Communicator
 
-    if rank==root:
-        array_shape=array.shape
-        pydtype = array.dtype
-    else:
-        array_shape=None
-        pydtype=None
+    Returns:
+        win_array (ndarray): Read-only view of the node-local copy
+        win (MPI.Win): The window holding the memory, release with win.Free()
+    '''
+    crank = comm.Get_rank()
+    shape,dtype = comm.bcast(((arr.shape,arr.dtype) if crank==root else None), root=root)
 
-    array_shape=comm.bcast(array_shape)
-    pydtype=comm.bcast(pydtype)
+    # Root leads its node, the leaders of all nodes exchange the data
+    key = 0 if crank==root else crank+1
+    node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=key)
+    leader = node.Get_rank() == 0
+    leaders = comm.Split((0 if leader else MPI.UNDEFINED), key=key)
 
-    size=np.prod(array_shape)
+    itemsize = np.dtype(dtype).itemsize
+    nbytes = int(np.prod(shape))*itemsize if leader else 0
+    win = MPI.Win.Allocate_shared(nbytes, itemsize, comm=node)
+    buf,_ = win.Shared_query(0)
+    win_array = np.ndarray(buffer=buf, dtype=dtype, shape=shape)
 
-    itemsize = MPI._typedict[np.dtype(pydtype).char].Get_size()
-    if rank == root:
-        nbytes = size * itemsize
-    else:
-        nbytes = 0
+    if leader:
+        bcast_array(arr, root=0, comm=leaders, out=win_array)
+        leaders.Free()
+    node.Barrier()
+    node.Free()
 
-    win = MPI.Win.Allocate_shared(nbytes, itemsize, comm=comm)
-    buf, itemsize = win.Shared_query(0)
-    win_array = np.ndarray(buffer=buf, dtype=pydtype, shape=array_shape,)
+    win_array.setflags(write=False)
+    return win_array, win
 
-    if rank==root:
-        win_array[:]=array
 
-    comm.Barrier()
-    
-    return win_array
+def gen_window(array,root=0):
+    # creates a shared memory copy of array on
+    # rank == root that all procs on the node can access.
+    # The window must be released with win.Free() on every rank
+    return shared_array(array, root=root)
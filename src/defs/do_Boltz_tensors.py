@@ -20,6 +20,7 @@
 import numpy as np
 from scipy import signal
 from mpi4py import MPI
+from .ibz import k_weights,symmetrize_tensor
 
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
@@ -30,42 +31,30 @@ def do_Boltz_tensors ( data_controller, smearing, temp, ene, velkp, ispin, chann
   arrays,attributes = data_controller.data_dicts()
 
   esize = ene.size
-  arrays['scattering_tau'] = get_tau(data_controller, temp, channels, weights)
+  if np.ndim(temp) == 0:
+    arrays['scattering_tau'] = get_tau(data_controller, temp, channels, weights)
+  else:
+    # One relaxation time per temperature (nt,snktot,bnd,nspin)
+    arrays['scattering_tau'] = np.array([get_tau(data_controller, t, channels, weights) for t in temp])
 
 #### Forced t_tensor to have all components
   t_tensor = np.array([[0,0],[1,1],[2,2],[0,1],[0,2],[1,2]], dtype=int)
 
-  # Quick call function for L_loop (None is smearing type)
-  fLloop = lambda spol : L_loop(data_controller, temp, smearing, ene, velkp, t_tensor, spol, ispin)
-
-  # Quick call function for Zeros on rank Zero
-  zoz = lambda r: (np.zeros((3,3,esize), dtype=float) if r==0 else None)
-
-  L0 = zoz(rank)
-  L0aux = fLloop(0)
-  comm.Reduce(L0aux, L0, op=MPI.SUM)
-  L0aux = None
+  # L0, L1 and L2 (for every temperature) share the smearing kernel and are reduced together
+  Laux = L_loop(data_controller, temp, smearing, ene, velkp, t_tensor, (0,1,2), ispin)
+  L = (np.zeros(Laux.shape, dtype=float) if rank==0 else None)
+  comm.Reduce(Laux, L, op=MPI.SUM)
+  Laux = None
 
   if rank == 0:
     # Assign lower triangular to upper triangular
-    sym = lambda L : (L[0,1], L[0,2], L[1,2])
-    L0[1,0],L0[2,0],L0[2,1] = sym(L0)
+    L[...,1,0,:],L[...,2,0,:],L[...,2,1,:] = L[...,0,1,:],L[...,0,2,:],L[...,1,2,:]
+    # Sums over the irreducible wedge are averaged over the point group
+    if attributes.get('ibz', False):
+      L = symmetrize_tensor(L, arrays['ibz_rot'], axis=L.ndim-3)
 
-  L1 = zoz(rank)
-  L1aux = fLloop(1)
-  comm.Reduce(L1aux, L1, op=MPI.SUM)
-  L1aux = None
-
-  L2 = zoz(rank)
-  L2aux = fLloop(2)
-  comm.Reduce(L2aux, L2, op=MPI.SUM)
-  L2aux = None
-
-  if rank == 0:
-    L1[1,0],L1[2,0],L1[2,1] = sym(L1)
-    L2[1,0],L2[2,0],L2[2,1] = sym(L2)
-
-  return (L0, L1, L2) if rank==0 else (None, None, None)
+  # Tensors are (3,3,esize) for a single temperature, (nt,3,3,esize) otherwise
+  return tuple(np.moveaxis(L,-4,0)) if rank==0 else (None, None, None)
 
 
 def do_Boltz_tensors_hall ( data_controller, smearing, temp, ene, velkp, ispin, channels, weights):
@@ -146,7 +135,32 @@ def get_tau ( data_controller, temp, channels, weights ):
 
 
 
-def L_loop ( data_controller, temp, smearing, ene, velkp, t_tensor, alpha, ispin ):
+def L_loop ( data_controller, temp, smearing, ene, velkp, t_tensor, alpha, ispin, cutoff=None, block_size=2**22 ):
+  '''
+  Compute the transport integrals
+  L_alpha[i,j](mu) = sum_{k,n} tau*v_i*v_j*(E-mu)^alpha*K(E-mu)
+  for every alpha and temperature requested, with the smearing kernel K evaluated once per band.
+  States whose energy lies farther than the kernel's support from the chemical
+  potential grid are skipped, and the remaining ones are sorted by energy so
+  that each block of states only touches its own energy window. For the Fermi
+  window the support is measured from the state nearest to each chemical
+  potential, so that the exponential tails inside band gaps are kept.
+
+  Arguments:
+    data_controller (DataController): The DataController
+    temp (float or ndarray): Temperature(s) in eV. For several temperatures arrays['scattering_tau'] holds one tau per temperature
+    smearing (str): None (Fermi window), 'gauss' or 'm-p' (adaptive smearing)
+    ene (ndarray): Uniform chemical potential grid (esize)
+    velkp (ndarray): Band velocities (snktot,3,bnd,nspin)
+    t_tensor (ndarray): Tensor components (i,j) to compute
+    alpha (int or tuple): Order(s) of the integrals
+    ispin (int): Spin index
+    cutoff (float): Support of the kernel, in units of temp beyond the nearest state (Fermi window) or deltakp (default 40 or 7)
+    block_size (int): Maximum number of kernel entries held in memory
+
+  Returns:
+    L (ndarray): (nt,nalpha,3,3,esize), without the nt or nalpha axis for a scalar temp or alpha
+  '''
   from .smearing import gaussian,metpax
   # We assume tau=1 in the constant relaxation time approximation
 
@@ -157,29 +171,90 @@ def L_loop ( data_controller, temp, smearing, ene, velkp, t_tensor, alpha, ispin
   snktot = arrays['E_k'].shape[0]
 
   bnd = attributes['bnd']
-  kq_wght = 1./attributes['nkpnts']
+  kq_wght = k_weights(data_controller)
   if smearing is not None and smearing != 'gauss' and smearing != 'm-p':
     print('%s Smearing Not Implemented.'%smearing)
     comm.Abort()
 
-  L = np.zeros((3,3,esize), dtype=float)
-
+  if cutoff is None:
+    cutoff = 40. if smearing is None else 7.
+
+  alphas = np.atleast_1d(alpha)
+  temps = np.atleast_1d(temp)
+  nt = temps.size
+  ii,jj = t_tensor[:,0],t_tensor[:,1]
+  L = np.zeros((nt,alphas.size,3,3,esize), dtype=float)
+
+  tau = arrays['scattering_tau']
+  if tau.ndim == 3:
+    tau = tau[None]
+
+  if smearing is None:
+    # Distance from each chemical potential to the nearest state, so that mu
+    # inside a gap still collects the tails of the closest band edges
+    Eall = np.sort(arrays['E_k'][:,:bnd,ispin], axis=None)
+    ie = np.searchsorted(Eall, ene)
+    gap = np.zeros(esize)
+    if Eall.size > 0:
+      gap = np.minimum(np.abs(ene-Eall[np.maximum(ie-1,0)]), np.abs(Eall[np.minimum(ie,Eall.size-1)]-ene))
+    reach_lo = np.maximum.accumulate(ene-gap)
+    reach_hi = np.maximum.accumulate(ene+gap)
+    wmax = cutoff*np.amax(temps)
+
+  kblock = max(1, block_size//(esize*alphas.size))
   for n in range(bnd):
-    Eaux = np.reshape(np.repeat(arrays['E_k'][:,n,ispin],esize), (snktot,esize))
-    delk = (np.reshape(np.repeat(arrays['deltakp'][:,n,ispin],esize), (snktot,esize)) if smearing!=None else None)
-    EtoAlpha = np.power(Eaux[:,:]-ene, alpha)
+    E = arrays['E_k'][:,n,ispin]
+
+    # States within reach of the chemical potential grid, sorted by energy
     if smearing is None:
-      Eaux -= ene
-      smearA = 1/(4*temp*(np.cosh(Eaux/(2*temp))**2))
+      sel = np.nonzero((E >= reach_lo[0]-wmax) & (E <= reach_hi[-1]+wmax))[0]
     else:
-      if smearing == 'gauss':
-        smearA = gaussian(Eaux, ene, delk)
-      elif smearing == 'm-p':
-        smearA = metpax(Eaux, ene, delk)
-    for l in range(t_tensor.shape[0]):
-      i = t_tensor[l][0]
-      j = t_tensor[l][1]
-      L[i,j,:] += np.sum(kq_wght*arrays['scattering_tau'][:,n,ispin]*velkp[:,i,n,ispin]*velkp[:,j,n,ispin]*(smearA*EtoAlpha).T, axis=1)
+      delk = arrays['deltakp'][:,n,ispin]
+      width = cutoff*delk
+      sel = np.nonzero((E+width >= ene[0]) & (E-width <= ene[-1]))[0]
+    if sel.size == 0:
+      continue
+    sel = sel[np.argsort(E[sel])]
+
+    # Velocity products for all tensor components and temperatures (nt,nsel,ncomp)
+    vv = kq_wght[sel,None]*tau[:,sel,n,ispin,None]*(velkp[sel[:,None],ii,n,ispin]*velkp[sel[:,None],jj,n,ispin])[None]
+    vv = np.broadcast_to(vv, (nt,)+vv.shape[1:])
+
+    for ini_k in range(0, sel.size, kblock):
+      ks = sel[ini_k:ini_k+kblock]
+      Eb = E[ks]
+      if smearing is None:
+        lo = np.searchsorted(reach_hi+wmax, np.amin(Eb))
+        hi = np.searchsorted(reach_lo-wmax, np.amax(Eb), side='right')
+      else:
+        wb = width[ks]
+        lo = np.searchsorted(ene, np.amin(Eb-wb))
+        hi = np.searchsorted(ene, np.amax(Eb+wb), side='right')
+      if hi <= lo:
+        continue
+
+      Eaux = Eb[:,None] - ene[None,lo:hi]
+      vb = vv[:,ini_k:ini_k+kblock]
+      if smearing is None:
+        # Fermi window, one kernel per temperature on its own (narrower) energy window
+        for it,T in enumerate(temps):
+          lt = np.searchsorted(reach_hi+cutoff*T, np.amin(Eb))
+          ht = np.searchsorted(reach_lo-cutoff*T, np.amax(Eb), side='right')
+          if ht <= lt:
+            continue
+          Et = Eaux[:,lt-lo:ht-lo]
+          # 1/(4T*cosh^2(x/2T)) written without overflow for |x| >> T
+          ex = np.exp(-np.abs(Et)/T)
+          smearA = ex/(T*(1+ex)**2)
+          for ia,a in enumerate(alphas):
+            L[it,ia,ii,jj,lt:ht] += vb[it].T @ (smearA*Et**a if a else smearA)
+      else:
+        if smearing == 'gauss':
+          smearA = gaussian(Eb[:,None], ene[None,lo:hi], delk[ks,None])
+        elif smearing == 'm-p':
+          smearA = metpax(Eb[:,None], ene[None,lo:hi], delk[ks,None])
+        EtoAlpha = np.power(Eaux[None], alphas[:,None,None])
+        L[:,:,ii,jj,lo:hi] += np.einsum('tkc,ake->tace', vb, smearA[None]*EtoAlpha, optimize=True)
   '''
   # noise reduction using a running average (correlation function)
   # Only possible for sigma vs chemical potential
@@ -190,7 +265,9 @@ def L_loop ( data_controller, temp, smearing, ene, velkp, t_tensor, alpha, ispin
     j = t_tensor[l][1]
     L[i,j,:] = signal.correlate(L[i,j,:] , np.ones(win), mode='same', method='fft')/win
   '''
-  return L
+  if np.ndim(alpha) == 0:
+    L = L[:,0]
+  return L[0] if np.ndim(temp) == 0 else L
 
 def L_loop_hall ( data_controller, temp, smearing, ene, velkp, t_tensor, alpha, ispin ):
   from scipy.constants import hbar
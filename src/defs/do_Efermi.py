@@ -20,6 +20,7 @@
 import numpy as np
 from mpi4py import MPI
 from .smearing import intmetpax
+from .do_eigh import batched_eigh
 
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
@@ -37,8 +38,7 @@ def E_Fermi ( Hksp, data_controller, parallel=False ):
   Hksp = Hksp.reshape((nawf,nawf,snktot,nspin), order='C')
 
   for ispin in range(nspin):
-    for ik in range(snktot):
-      eig[:,ik,ispin] = np.linalg.eigvalsh(Hksp[:,:,ik,ispin])
+    eig[:,:,ispin] = batched_eigh(np.moveaxis(Hksp[...,ispin],2,0), chunk=attr['eigh_chunk'], eigvals_only=True, UPLO='L').T
 
   if insulator:
     Efr = np.amax(eig[(nelec-1 if dftSO else nelec//2-1)])
@@ -25,7 +25,6 @@ comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 
 def do_spin_Hall ( data_controller, twoD, do_ac ):
-  from .perturb_split import perturb_split
   from .constants import ELECTRONVOLT_SI,ANGSTROM_AU,H_OVER_TPI,LL
 
   arry,attr = data_controller.data_dicts()
@@ -44,6 +43,7 @@ def do_spin_Hall ( data_controller, twoD, do_ac ):
   if rank == 0 and attr['verbose']:
     print('Writing bxsf files for Spin Berry Curvature')
 
+  rops = rkey = None
   for n in range(s_tensor.shape[0]):
     ipol = s_tensor[n][0]
     jpol = s_tensor[n][1]
@@ -51,15 +51,16 @@ def do_spin_Hall ( data_controller, twoD, do_ac ):
     #----------------------------------------------
     # Compute the spin current operator j^l_n,m(k)
     #----------------------------------------------
-    jdHksp = do_spin_current(data_controller, spol, ipol)
-
-    jksp_is = np.empty_like(jdHksp)
-    pksp_j = np.empty_like(jdHksp)
+    # The spin current is rotated together with the three momenta,
+    # so consecutive elements sharing (spol,ipol) reuse the rotation
+    if rkey != (spol,ipol):
+      rops = None
+      jdHksp = do_spin_current(data_controller, spol, ipol)
+      rops = split_operators(data_controller, jdHksp=jdHksp)
+      rkey = (spol,ipol)
+      jdHksp = None
 
-    for ik in range(jdHksp.shape[0]):
-      for ispin in range(jdHksp.shape[3]):
-        jksp_is[ik,:,:,ispin],pksp_j[ik,:,:,ispin] = perturb_split(jdHksp[ik,:,:,ispin], arry['dHksp'][ik,jpol,:,:,ispin], arry['v_k'][ik,:,:,ispin], arry['degen'][ispin][ik])
-    jdHksp = None
+    jksp_is,pksp_j = rops[:,0],rops[:,jpol+1]
 
     #---------------------------------
     # Compute spin Berry curvature... 
@@ -92,17 +93,7 @@ def do_spin_Hall ( data_controller, twoD, do_ac ):
 
     if do_ac:
 
-      jdHksp = do_spin_current(data_controller, spol, ipol)
-
-      jksp_js = np.empty_like(jdHksp)
-      pksp_i = np.empty_like(jdHksp)
-
-      for ik in range(jdHksp.shape[0]):
-        for ispin in range(jdHksp.shape[3]):
-          jksp_js[ik,:,:,ispin],pksp_i[ik,:,:,ispin] = perturb_split(jdHksp[ik,:,:,ispin], arry['dHksp'][ik,jpol,:,:,ispin], arry['v_k'][ik,:,:,ispin], arry['degen'][ispin][ik])
-      jdHksp = None
-
-      ene,sigxy = do_ac_conductivity(data_controller, jksp_js, pksp_i, ipol, jpol)
+      ene,sigxy = do_ac_conductivity(data_controller, jksp_is, pksp_j, ipol, jpol)
       if rank == 0:
         sigxy *= cgs_conv
 
@@ -118,7 +109,6 @@ def do_spin_Hall ( data_controller, twoD, do_ac ):
 
 
 def do_anomalous_Hall ( data_controller, do_ac ):
-  from .perturb_split import perturb_split
   from .constants import ELECTRONVOLT_SI,ANGSTROM_AU,H_OVER_TPI,LL
 
   arry,attr = data_controller.data_dicts()
@@ -137,18 +127,19 @@ def do_anomalous_Hall ( data_controller, do_ac ):
   if rank == 0 and attr['verbose']:
     print('Writing bxsf files for Berry Curvature')
 
+  rops = rpol = None
   for n in range(a_tensor.shape[0]):
     ipol = a_tensor[n][0]
     jpol = a_tensor[n][1]
 
-    dks = arry['dHksp'].shape
-
-    pksp_i = np.zeros((dks[0],dks[2],dks[3],dks[4]),order="C",dtype=complex)
-    pksp_j = np.zeros_like(pksp_i)
+    # The degeneracies are lifted by the ipol momentum and the three momenta
+    # are rotated together, so elements sharing ipol reuse the rotation
+    if rpol != ipol:
+      rops = None
+      rops = split_operators(data_controller, ref=ipol)
+      rpol = ipol
 
-    for ik in range(dks[0]):
-      for ispin in range(dks[4]):
-        pksp_i[ik,:,:,ispin],pksp_j[ik,:,:,ispin] = perturb_split(arry['dHksp'][ik,ipol,:,:,ispin], arry['dHksp'][ik,jpol,:,:,ispin], arry['v_k'][ik,:,:,ispin], arry['degen'][ispin][ik])
+    pksp_i,pksp_j = rops[:,ipol],rops[:,jpol]
 
     ene,ahc,Om_k = do_Berry_curvature(data_controller, pksp_i, pksp_j)
 
@@ -193,7 +184,6 @@ def do_Berry_curvature ( data_controller, jksp, pksp ):
   # Compute spin Berry curvature
   #----------------------
   from .communication import gather_full
-  from .smearing import intgaussian, intmetpax
 
   arrays,attributes = data_controller.data_dicts()
 
@@ -201,51 +191,85 @@ def do_Berry_curvature ( data_controller, jksp, pksp ):
   fermi_up,fermi_dw = attributes['fermi_up'],attributes['fermi_dw']
   nk1,nk2,nk3 = attributes['nk1'],attributes['nk2'],attributes['nk3']
 
-  # Compute only Omega_z(k)
-  Om_znkaux = np.zeros((snktot,nawf), dtype=float)
+  # Compute only Omega_z(k), for all k-points at once
+  E_k = arrays['E_k'][:,:,0]
+  deltak = arrays['deltakp'][:,:,0] if attributes['smearing'] is not None else None
 
   deltap = 0.05
-  for ik in range(snktot):
-    E_nm = (arrays['E_k'][ik,:,0] - arrays['E_k'][ik,:,0][:,None])**2 + deltap**2
-    E_nm[np.where(E_nm<1.e-4)] = np.inf
-    Om_znkaux[ik] = -2.0*np.sum(np.imag(jksp[ik,:,:,0]*pksp[ik,:,:,0].T)/E_nm, axis=1)
+  E_nm = (E_k[:,None,:] - E_k[:,:,None])**2 + deltap**2
+  E_nm[np.where(E_nm<1.e-4)] = np.inf
+  Om_znk = -2.0*np.sum(np.imag(jksp[:,:,:,0]*np.swapaxes(pksp[:,:,:,0],1,2))/E_nm, axis=2)
   E_nm = None
 
   attributes['emaxH'] = np.amin(np.array([attributes['shift'],attributes['emaxH']]))
-  ### Hardcoded 'de'
-  esize = 500
+  esize = attributes['neH']
   ene = np.linspace(attributes['eminH'], attributes['emaxH'], esize)
 
-  Om_zkaux = np.zeros((snktot,esize), dtype=float)
+  # Energy-resolved sum over the local k-points, reduced on rank 0
+  shc_aux = berry_energy_sum(attributes['smearing'], Om_znk, E_k, deltak, ene)
+  shc = (np.zeros(esize, dtype=float) if rank==0 else None)
+  comm.Reduce(shc_aux, shc, op=MPI.SUM)
+  shc_aux = None
+  if rank == 0:
+    shc /= float(attributes['nkpnts'])
+
+  n0 = 0
+  n = esize-1
+  for i in range(esize-1):
+    if ene[i] <= fermi_dw and ene[i+1] >= fermi_dw:
+      n0 = i
+    if ene[i] <= fermi_up and ene[i+1] >= fermi_up:
+      n = i
 
-  for i in range(esize):
-    if attributes['smearing'] == 'gauss':
-      Om_zkaux[:,i] = np.sum((Om_znkaux[:,:]*intgaussian(arrays['E_k'][:,:,0],ene[i],arrays['deltakp'][:,:,0])), axis=1)
-    elif attributes['smearing'] == 'm-p':
-      Om_zkaux[:,i] = np.sum(Om_znkaux[:,:]*intmetpax(arrays['E_k'][:,:,0],ene[i],arrays['deltakp'][:,:,0]), axis=1)
-    else:
-      Om_zkaux[:,i] = np.sum(Om_znkaux[:,:]*(0.5 * (-np.sign(arrays['E_k'][:,:,0]-ene[i]) + 1)), axis=1)
+  # Omega_z(k) is only required at the two energies bounding the Fermi window
+  Om_zkaux = np.sum(Om_znk[:,:,None]*smeared_occupation(attributes['smearing'], E_k, deltak, ene[[n0,n]]), axis=1)
+  Om_znk = None
 
   Om_zk = gather_full(Om_zkaux, attributes['npool'])
   Om_zkaux = None
 
-  shc = None
-  if rank == 0:
-    shc = np.sum(Om_zk, axis=0)/float(attributes['nkpnts'])
-
-  n0 = 0
-  n = esize-1
   if rank == 0:
-    for i in range(esize-1):
-      if ene[i] <= fermi_dw and ene[i+1] >= fermi_dw:
-        n0 = i
-      if ene[i] <= fermi_up and ene[i+1] >= fermi_up:
-        n = i
-    Om_zk = np.reshape(Om_zk, (nk1,nk2,nk3,esize), order='C')
-    Om_zk = Om_zk[:,:,:,n]-Om_zk[:,:,:,n0]
+    Om_zk = np.reshape(Om_zk, (nk1,nk2,nk3,2), order='C')
+    Om_zk = Om_zk[:,:,:,1]-Om_zk[:,:,:,0]
 
   return(ene, shc, Om_zk)
 
+def smeared_occupation ( smearing, E_k, deltak, ene ):
+  # Occupation of the states E_k (nk,nawf) for each energy in ene, shape (nk,nawf,ene.size)
+  from .smearing import intgaussian, intmetpax
+
+  if smearing == 'gauss':
+    return intgaussian(E_k[:,:,None], ene, deltak[:,:,None])
+  elif smearing == 'm-p':
+    return intmetpax(E_k[:,:,None], ene, deltak[:,:,None])
+  else:
+    return 0.5 * (-np.sign(E_k[:,:,None]-ene) + 1)
+
+def berry_energy_sum ( smearing, Om_znk, E_k, deltak, ene, block_size=2**22 ):
+  '''
+  Sum Omega_n(k) weighted by the occupations over the local k-points and bands, for every energy in ene.
+  Without smearing the occupations are step functions, and the sum is a cumulative sum over the sorted
+  eigenvalues. With smearing the energies are treated in blocks holding at most 'block_size' weights.
+  '''
+
+  if smearing is None:
+    order = np.argsort(E_k, axis=None)
+    E_s = E_k.ravel()[order]
+    Om_cs = np.concatenate(([0.], np.cumsum(Om_znk.ravel()[order])))
+    order = None
+
+    # States below ene count fully, states exactly at ene count one half
+    il = np.searchsorted(E_s, ene, side='left')
+    ir = np.searchsorted(E_s, ene, side='right')
+    return Om_cs[il] + 0.5*(Om_cs[ir]-Om_cs[il])
+
+  esum = np.empty(ene.size, dtype=float)
+  eblock = max(1, block_size//max(1,Om_znk.size))
+  for ie in range(0, ene.size, eblock):
+    occ = smeared_occupation(smearing, E_k, deltak, ene[ie:ie+eblock])
+    esum[ie:ie+eblock] = np.einsum('kn,kne->e', Om_znk, occ)
+  return esum
+
 def do_ac_conductivity ( data_controller, jksp, pksp, ipol, jpol ):
   from .communication import gather_full
   from .smearing import intgaussian, intmetpax
@@ -282,7 +306,7 @@ def do_ac_conductivity ( data_controller, jksp, pksp, ipol, jpol ):
   else:
     return(None, None)
 
-def smear_sigma_loop ( data_controller, ene, pksp_i, pksp_j, ispin, ipol, jpol ):
+def smear_sigma_loop ( data_controller, ene, pksp_i, pksp_j, ispin, ipol, jpol, focc_thr=1.e-12, block_size=2**22 ):
   from .smearing import intgaussian,intmetpax
 
   arry,attr = data_controller.data_dicts()
@@ -291,40 +315,68 @@ def smear_sigma_loop ( data_controller, ene, pksp_i, pksp_j, ispin, ipol, jpol )
   sigxy = np.zeros((esize), dtype=complex)
 
   snktot,nawf,_,nspin = pksp_j.shape
-  f_nm = np.zeros((snktot,nawf,nawf), dtype=float)
-  E_diff_nm = np.zeros((snktot,nawf,nawf), dtype=float)
 
   Ef = 0.0
   eps = 1.0e-16
   delta = 0.05
 
+  E_k = arry['E_k'][:,:nawf,ispin]
   if attr['smearing'] == None:
-    fn = 1.0/(np.exp(arry['E_k'][:,:,ispin]/attr['temp'])+1)
+    fn = 1.0/(np.exp(E_k/attr['temp'])+1)
   elif attr['smearing'] == 'gauss':
-    fn = intgaussian(arry['E_k'][:,:,ispin], Ef, arry['deltakp'][:,:,ispin])
-  elif smearing == 'm-p':
-    fn = intmetpax(arry['E_k'][:,:,ispin], Ef, arry['deltakp'][:,:,ispin]) 
-
-  # Collapsing the sum over k points
-  for n in range(nawf):
-    for m in range(nawf):
-      if m != n:
-        E_diff_nm[:,n,m] = (arry['E_k'][:,n,ispin]-arry['E_k'][:,m,ispin])**2
-        f_nm[:,n,m] = (fn[:,n] - fn[:,m])*np.imag(pksp_j[:,n,m,ispin]*pksp_i[:,m,n,ispin])
+    fn = intgaussian(E_k, Ef, arry['deltakp'][:,:nawf,ispin])
+  elif attr['smearing'] == 'm-p':
+    fn = intmetpax(E_k, Ef, arry['deltakp'][:,:nawf,ispin])
 
+  # Keep only the band pairs n!=m with a non negligible occupation difference
+  f_nm = fn[:,:,None] - fn[:,None,:]
   fn = None
+  ik,n,m = np.nonzero(np.abs(f_nm) > focc_thr)
+  f_nm = f_nm[ik,n,m]*np.imag(pksp_j[ik,n,m,ispin]*pksp_i[ik,m,n,ispin])
+  E_diff_nm = (E_k[ik,n]-E_k[ik,m])**2 + eps
+
+  if attr['smearing'] != None:
+    delta_nm = arry['deltakp2'][ik,n,m,ispin]
+  else:
+    delta_nm = np.full(ik.size, delta)
+  ik = n = m = None
 
-  for e in range(esize):
-    if attr['smearing'] != None:
-      sigxy[e] = np.sum(f_nm[:,:,:]/(E_diff_nm[:,:,:]-(ene[e]+1.j*arry['deltakp2'][:,:nawf,:nawf,ispin])**2+eps))
-    else:
-      sigxy[e] = np.sum(f_nm[:,:,:]/(E_diff_nm[:,:,:]-(ene[e]+1.j*arry['delta'])**2+eps))
+  # Evaluate all frequencies as a product of the (ene,pair) response matrix with f_nm
+  eblock = max(1, block_size//max(1,f_nm.size))
+  for e in range(0, esize, eblock):
+    ene_b = ene[e:e+eblock,None]
+    sigxy[e:e+eblock] = (1./(E_diff_nm[None,:]-(ene_b+1.j*delta_nm[None,:])**2)) @ f_nm
 
-  F_nm = None
-  E_diff_nm = None
+  f_nm = E_diff_nm = delta_nm = None
 
   return np.nan_to_num(sigxy)
 
+def split_operators ( data_controller, jdHksp=None, ref=0 ):
+  '''
+  Rotate the momenta 'dHksp', preceded by the spin current jdHksp if given, into the eigenbasis
+  The degeneracies are lifted by operator 'ref' of the stack (the spin current if given)
+
+  Returns:
+      rops (ndarray): Rotated operators, shape (snktot,nop,nawf,nawf,nspin)
+  '''
+  from .perturb_split import perturb_split_batch
+  from .do_eigh import get_degen_spin
+
+  arry,attr = data_controller.data_dicts()
+
+  snktot,_,nawf,nawf,nspin = arry['dHksp'].shape
+  nop = 3 if jdHksp is None else 4
+
+  rops = np.empty((snktot,nop,nawf,nawf,nspin), dtype=complex)
+  for ispin in range(nspin):
+    ops = arry['dHksp'][...,ispin]
+    if jdHksp is not None:
+      ops = np.concatenate((jdHksp[:,None,:,:,ispin],ops), axis=1)
+    rops[...,ispin] = perturb_split_batch(ops, arry['v_k'][...,ispin], get_degen_spin(arry['degen'],ispin), ref=ref)
+  ops = None
+
+  return rops
+
 def do_spin_current ( data_controller, spol, ipol ):
 
   arry,attr = data_controller.data_dicts()
@@ -336,8 +388,7 @@ def do_spin_current ( data_controller, spol, ipol ):
   jdHksp = np.empty((snktot,nawf,nawf,nspin), dtype=complex)
 
   for ispin in range(nspin):
-    for ik in range(snktot):
-      jdHksp[ik,:,:,ispin] = 0.5*(np.dot(Sj,arry['dHksp'][ik,ipol,:,:,ispin])+np.dot(arry['dHksp'][ik,ipol,:,:,ispin],Sj))
+    jdHksp[...,ispin] = 0.5*(Sj@arry['dHksp'][:,ipol,:,:,ispin]+arry['dHksp'][:,ipol,:,:,ispin]@Sj)
 
   return jdHksp
 
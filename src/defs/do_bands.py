@@ -55,18 +55,18 @@ def band_loop_H ( data_controller, kq_aux ):
 
   arrays,attributes = data_controller.data_dicts()
 
-  nksize = kq_aux.shape[1]
+  if 'sparse_HR_threshold' in attributes:
+    from .sparse_HR import sparse_band_loop_H
+    return sparse_band_loop_H(data_controller, kq_aux)
+
+  from .kspace_hamiltonian import hamiltonian_k
+
   nawf,_,nk1,nk2,nk3,nspin = arrays['HRs'].shape
 
   HRs = np.reshape(arrays['HRs'], (nawf,nawf,nk1*nk2*nk3,nspin), order='C')
-  kdot = np.tensordot(arrays['R'], 2.0j*np.pi*kq_aux, axes=([1],[0]))
-  np.exp(kdot, kdot)
-  Haux = np.zeros((nawf,nawf,nksize,nspin), dtype=complex, order="C")
-
-  for ispin in range(nspin):
-    Haux[...,ispin] = np.tensordot(HRs[...,ispin], kdot, axes=([2],[0]))
+  Haux = hamiltonian_k(HRs, arrays['R'], kq_aux, mem_budget=attributes['hk_mem_budget'])
 
-  return Haux
+  return np.moveaxis(Haux, 0, 2)
 
 
 def do_bands ( data_controller ):
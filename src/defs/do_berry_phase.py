@@ -355,19 +355,18 @@ def band_loop_H ( data_controller, kq_aux ):
 
   arry,attr = data_controller.data_dicts()
 
-  nksize = kq_aux.shape[1]
+  if 'sparse_HR_threshold' in attr:
+    from .sparse_HR import sparse_band_loop_H
+    return sparse_band_loop_H(data_controller, kq_aux)
+
+  from .kspace_hamiltonian import hamiltonian_k
+
   nawf,_,nk1,nk2,nk3,nspin = arry['HRs'].shape
 
   HRs = np.reshape(arry['HRs'], (nawf,nawf,nk1*nk2*nk3,nspin), order='C')
-  kdot = np.tensordot(arry['R'], 2.0j*np.pi*kq_aux, axes=([1],[0]))
-  np.exp(kdot, kdot)
-  Haux = np.zeros((nawf,nawf,nksize,nspin), dtype=complex, order="C")
-
-  for ispin in range(nspin):
-    Haux[:,:,:,ispin] = np.tensordot(HRs[:,:,:,ispin], kdot, axes=([2],[0]))
+  Haux = hamiltonian_k(HRs, arry['R'], kq_aux, mem_budget=attr['hk_mem_budget'])
 
-  kdot  = None
-  return Haux
+  return np.moveaxis(Haux, 0, 2)
 
 def do_berry_bands ( data_controller ):
   from mpi4py import MPI
@@ -47,7 +47,7 @@ def build_Hks ( data_controller ):
 
       #Building the Hamiltonian matrix
       E = np.diag(my_eigs)
-      UU = np.transpose(U[:,:,ik,ispin]) #transpose of U. Now the columns of UU are the eigenvector of length nawf
+      UU = np.transpose(U[:,:,ik,ispin]).copy() #transpose of U. Now the columns of UU are the eigenvector of length nawf
       norms = 1./np.sqrt(np.real(np.sum(np.conj(UU)*UU,axis=0)))
       UU[:,:nawf] = UU[:,:nawf]*norms[:nawf]
 
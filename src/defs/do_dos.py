@@ -19,10 +19,69 @@
 
 import numpy as np
 from mpi4py import MPI
+from .ibz import multiplicity_sum
 
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 
+def smeared_sum ( ene, E, delta, weights=None, kernel=None, cutoff=7., block_size=2**22 ):
+  '''
+  Sum of smearing functions centered at the eigenvalues E, evaluated on a uniform energy grid.
+  Each kernel is truncated to the grid points within cutoff*delta of its eigenvalue,
+  so the cost is proportional to the number of states times the width of the window.
+
+  Arguments:
+    ene (ndarray): Uniform energy grid (ne)
+    E (ndarray): Eigenvalues, any shape
+    delta (float or ndarray): Smearing width, scalar or with the shape of E
+    weights (ndarray): Optional projection weights (E.size,nw) for each state
+    kernel (func): Smearing function with the signature of smearing.gaussian (default gaussian)
+    cutoff (float): Half width of the window, in units of delta
+    block_size (int): Maximum number of kernel entries held in memory
+
+  Returns:
+    dos (ndarray): Sum of kernels (ne), or (nw,ne) sums weighted by each column of weights
+  '''
+  from scipy.sparse import csr_matrix
+  from .smearing import gaussian
+
+  if kernel is None:
+    kernel = gaussian
+
+  ne = ene.size
+  delta = np.ravel(np.broadcast_to(delta, np.shape(E)))
+  E = np.ravel(E)
+  de = ene[1] - ene[0] if ne > 1 else 1.
+
+  nw = 1 if weights is None else weights.shape[1]
+  dos = np.zeros((nw,ne), dtype=float)
+
+  # Window of grid points [lo,hi) around each eigenvalue
+  lo = np.clip(np.ceil((E-cutoff*delta-ene[0])/de), 0, ne).astype(int)
+  hi = np.clip(np.floor((E+cutoff*delta-ene[0])/de)+1, 0, ne).astype(int)
+  states = np.nonzero(hi > lo)[0]
+  if states.size == 0:
+    return dos[0] if weights is None else dos
+
+  width = np.amax(hi[states]-lo[states])
+  sblock = max(1, block_size//width)
+  for ini_s in range(0, states.size, sblock):
+    st = states[ini_s:ini_s+sblock]
+    idx = lo[st,None] + np.arange(width)[None,:]
+    valid = idx < hi[st,None]
+    idx = np.minimum(idx, ne-1)
+    val = np.where(valid, kernel(E[st,None], ene[idx], delta[st,None]), 0.)
+
+    if weights is None:
+      dos[0] += np.bincount(idx.ravel(), weights=val.ravel(), minlength=ne)
+    else:
+      col = np.repeat(np.arange(st.size), width)
+      kmat = csr_matrix((val.ravel(),(idx.ravel(),col)), shape=(ne,st.size))
+      dos += (kmat @ weights[st]).T
+
+  return dos[0] if weights is None else dos
+
+
 def do_dos ( data_controller, emin, emax, ne, delta ):
 
   arry,attr = data_controller.data_dicts()
@@ -38,12 +97,10 @@ def do_dos ( data_controller, emin, emax, ne, delta ):
 
   for ispin in range(attr['nspin']):
 
-    dosaux = np.zeros((ne), order="C")
-
     E_k = arry['E_k'][:,:bnd,ispin]
 
-    for n in range(ne):
-      dosaux[n] = np.sum(np.exp(-((ene[n]-E_k)/delta)**2))
+    # Irreducible k-points are counted with their multiplicities
+    dosaux = multiplicity_sum(data_controller, lambda E:smeared_sum(ene,E,delta), E_k)
 
     dos = np.zeros((ne), dtype=float) if rank == 0 else None
 
@@ -51,7 +108,7 @@ def do_dos ( data_controller, emin, emax, ne, delta ):
     dosaux = None
 
     if rank == 0:
-      dos *= float(bnd)/(float(netot)*np.sqrt(np.pi)*delta)
+      dos *= float(bnd)/float(netot)
       arry['dos'] = dos
     fdos = 'dos_%s.dat'%str(ispin)
     data_controller.write_file_row_col(fdos, ene, dos)
@@ -78,19 +135,18 @@ def do_dos_adaptive ( data_controller, emin, emax, ne ):
 
   for ispin in range(attr['nspin']):
 
-    E_k = arry['E_k'][:,:bnd,ispin].reshape(arry['E_k'].shape[0]*bnd)
-    delta = np.ravel(arry['deltakp'][:,:bnd,ispin], order='C')
+    E_k = arry['E_k'][:,:bnd,ispin]
+    delta = arry['deltakp'][:,:bnd,ispin]
 
     dosaux = np.zeros((ne), dtype=float)
 
-    for n in range(ne):
-      if attr['smearing'] == 'gauss':
-        # adaptive Gaussian smearing
-        dosaux[n] = np.sum(gaussian(ene[n],E_k,delta))
+    if attr['smearing'] == 'gauss':
+      # adaptive Gaussian smearing
+      dosaux = multiplicity_sum(data_controller, lambda E,d:smeared_sum(ene,E,d,kernel=gaussian), E_k, delta)
 
-      elif attr['smearing'] == 'm-p':
-        # adaptive Methfessel and Paxton smearing
-        dosaux[n] = np.sum(metpax(ene[n],E_k,delta))
+    elif attr['smearing'] == 'm-p':
+      # adaptive Methfessel and Paxton smearing
+      dosaux = multiplicity_sum(data_controller, lambda E,d:smeared_sum(ene,E,d,kernel=metpax), E_k, delta)
 
     dos = np.zeros((ne), dtype=float) if rank==0 else None
     comm.Reduce(dosaux, dos, op=MPI.SUM)
@@ -102,4 +158,3 @@ def do_dos_adaptive ( data_controller, emin, emax, ne ):
     fdosdk = 'dosdk_%s.dat'%str(ispin)
     data_controller.write_file_row_col(fdosdk, ene,dos)
     data_controller.broadcast_single_array('dosdk', dtype=float)
-
@@ -21,9 +21,9 @@
 def do_double_grid ( data_controller ):
   import numpy as np
   from mpi4py import MPI
-  from .zero_pad import zero_pad
-  from scipy import fftpack as FFT
-  from .communication import scatter_full
+  from .zero_pad import spectral_pad
+  from .batched_fft import batched_fftn
+  from .communication import scatter_full,gather_scatter
 
   rank = MPI.COMM_WORLD.Get_rank()
 
@@ -39,16 +39,19 @@ def do_double_grid ( data_controller ):
   nk1p = attr['nfft1']
   nk2p = attr['nfft2']
   nk3p = attr['nfft3']
-  nfft1 = nk1p-nk1
-  nfft2 = nk2p-nk2
-  nfft3 = nk3p-nk3
 
-  # Extended R to k (with zero padding)
-  arrays['Hksp']  = np.empty((HRs.shape[0],nk1p,nk2p,nk3p,nspin), dtype=complex)
+  backend,workers = attr.get('fft_backend','scipy'),attr.get('fft_threads',1)
 
-  for ispin in range(nspin):
-    for n in range(HRs.shape[0]):
-      arrays['Hksp'][n,:,:,:,ispin] = FFT.fftn(zero_pad(HRs[n,:,:,:,ispin],nk1,nk2,nk3,nfft1,nfft2,nfft3))
+  # Extended R to k (with zero padding) for a pool of orbital pairs. The spectra of
+  # the whole pool are padded straight into one block, transformed by a single batched FFT
+  def zero_pad_fft ( HR ):
+    Hk = spectral_pad(HR, (nk1p,nk2p,nk3p))
+    Hk = batched_fftn(Hk, axes=(1,2,3), backend=backend, workers=workers, overwrite=True)
+    return np.reshape(Hk, (HR.shape[0],nk1p*nk2p*nk3p,nspin))
+
+  # Hksp is distributed over k-points (nawf**2,snktot,nspin); each pool of
+  # orbitals is transformed while the previous one is being transposed
+  arrays['Hksp'] = gather_scatter(HRs, 1, attr['npool'], func=zero_pad_fft)
 
   attr['nk1'] = nk1p
   attr['nk2'] = nk2p
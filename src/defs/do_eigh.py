@@ -18,60 +18,129 @@
 # or http://www.gnu.org/copyleft/gpl.txt .
 
 import numpy as np
-from scipy import linalg as spl
 from numpy import linalg as npl
 
 
 def get_degeneracies ( E_k, bnd ):
+  '''
+  Find the degenerate subspaces of every k-point in one vectorized pass over E_k
 
-  all_degen = []
+  The subspaces are stored in CSR form. For spin ispin and k-point ik they are the
+  rows bands[offsets[ispin,ik]:offsets[ispin,ik+1]], each row holding the first band
+  and one past the last band of a set of consecutive degenerate bands. Only subspaces
+  lying entirely below 'bnd' are kept.
 
-  E_k_round = np.around(E_k, decimals=5)
-  
-  for ispin in range(E_k_round.shape[2]):
+  Arguments:
+      E_k (ndarray): Eigenvalues sorted in ascending order, shape (nk,nawf,nspin)
+      bnd (int): Number of bands considered
 
-    by_spin = []
-    for ik in range(E_k_round.shape[0]):
-      by_kp = []
-      eV = np.unique(E_k_round[ik,:,ispin][:-1][np.isclose(E_k_round[ik,:,ispin][1:],
-                                                           E_k_round[ik,:,ispin][:-1],
-                                                           atol=1.e-5)])
+  Returns:
+      (offsets, bands): Tuple with the CSR offsets, shape (nspin,nk+1), and the band ranges, shape (ndegen,2)
+  '''
 
-      for i in range(len(eV)):
-        inds = np.where(np.isclose(E_k_round[ik,:,ispin],eV[i],atol=1.e-5))[0]
+  nk,_,nspin = E_k.shape
 
-        if len(inds) > 1 and np.all(inds < bnd):                    
-          by_kp.append(inds)
+  E_k_round = np.around(np.moveaxis(E_k,2,0), decimals=5)
+  close = np.isclose(E_k_round[:,:,1:], E_k_round[:,:,:-1], atol=1.e-5)
 
-      by_spin.append(by_kp)
+  # +1 marks the first band of a degenerate run, -1 the band after its last one
+  edges = np.diff(np.pad(close,((0,0),(0,0),(1,1))).astype(np.int8), axis=2)
+  close = None
 
-    all_degen.append(by_spin)
+  ispin,ik,ll = np.nonzero(edges == 1)
+  ul = np.nonzero(edges == -1)[2] + 1
+  edges = None
 
-  return all_degen
+  keep = ul <= bnd
+  bands = np.ascontiguousarray(np.stack((ll[keep],ul[keep]), axis=1), dtype=int)
 
+  counts = np.bincount(ispin[keep]*nk+ik[keep], minlength=nspin*nk)
+  offsets = np.concatenate(([0], np.cumsum(counts)))
+  offsets = offsets[np.arange(nspin)[:,None]*nk+np.arange(nk+1)[None,:]]
 
-def do_pao_eigh ( data_controller ):
-  from .communication import gather_scatter
-  from numpy.linalg import eigh
-  from mpi4py import MPI
+  return (offsets, bands)
+
+
+def get_degen_spin ( degen, ispin ):
+  '''
+  Return the degenerate subspaces of one spin channel as (offsets, bands), with offsets of shape (nk+1,)
+  '''
+  offsets,bands = degen
+  return (offsets[ispin], bands)
+
+
+def get_degen_k ( degen, ispin, ik ):
+  '''
+  Return the degenerate subspaces of one k-point as an array of [first,last+1) band ranges
+  '''
+  offsets,bands = degen
+  return bands[offsets[ispin,ik]:offsets[ispin,ik+1]]
+
+
+def batched_eigh ( Hks, Sks=None, chunk=None, eigvals_only=False, UPLO='U', E_out=None, v_out=None ):
+  '''
+  Diagonalize a stack of Hermitian matrices with stacked LAPACK calls
+
+  Arguments:
+      Hks (ndarray): Hermitian matrices with shape (nk,nawf,nawf)
+      Sks (ndarray): (optional) Overlap matrices with shape (nk,nawf,nawf) for the generalized problem
+      chunk (int): Maximum number of matrices diagonalized in a single call (None or 0 for all)
+      eigvals_only (bool): If True only the eigenvalues are computed
+      UPLO (str): Triangle of Hks used by LAPACK ('U' or 'L')
+      E_out (ndarray): (optional) Preallocated array for the eigenvalues, shape (nk,nawf)
+      v_out (ndarray): (optional) Preallocated array for the eigenvectors, shape (nk,nawf,nawf)
+
+  Returns:
+      E_k (ndarray): Eigenvalues in ascending order, shape (nk,nawf)
+      v_k (ndarray): Eigenvectors stored in columns, shape (nk,nawf,nawf) (omitted if eigvals_only)
+  '''
+
+  nk,nawf,_ = Hks.shape
+  if chunk is None or chunk <= 0:
+    chunk = max(nk, 1)
+
+  E_k = np.empty((nk,nawf), dtype=float) if E_out is None else E_out
+  v_k = None
+  if not eigvals_only:
+    v_k = np.empty((nk,nawf,nawf), dtype=complex) if v_out is None else v_out
 
-  rank = MPI.COMM_WORLD.Get_rank()
+  for ini_ik in range(0, nk, chunk):
+    end_ik = min(ini_ik+chunk, nk)
+    Haux = Hks[ini_ik:end_ik]
+
+    if Sks is not None:
+      # Reduce H v = E S v to standard form with the Cholesky factor S = L L^H
+      Linv = npl.inv(npl.cholesky(Sks[ini_ik:end_ik]))
+      LinvH = np.conj(np.swapaxes(Linv, 1, 2))
+      Haux = Linv @ Haux @ LinvH
+
+    if eigvals_only:
+      E_k[ini_ik:end_ik] = npl.eigvalsh(Haux, UPLO=UPLO)
+    else:
+      E_k[ini_ik:end_ik],v_k[ini_ik:end_ik] = npl.eigh(Haux, UPLO=UPLO)
+      if Sks is not None:
+        v_k[ini_ik:end_ik] = LinvH @ v_k[ini_ik:end_ik]
+
+  return E_k if eigvals_only else (E_k, v_k)
+
+
+def do_pao_eigh ( data_controller ):
 
   arrays,attributes = data_controller.data_dicts()
 
   snktot,nawf,_,nspin = arrays['Hksp'].shape
+  chunk = attributes['eigh_chunk']
 
   arrays['E_k'] = np.zeros((snktot,nawf,nspin), dtype=float)
   arrays['v_k'] = np.zeros((snktot,nawf,nawf,nspin), dtype=complex)
 
   for ispin in range(nspin):
-    for n in range(snktot):
-      arrays['E_k'][n,:,ispin],arrays['v_k'][n,:,:,ispin] = eigh(arrays['Hksp'][n,:,:,ispin], UPLO='U')
+    batched_eigh(arrays['Hksp'][...,ispin], chunk=chunk, E_out=arrays['E_k'][...,ispin], v_out=arrays['v_k'][...,ispin])
 
   arrays['degen'] = get_degeneracies(arrays['E_k'], attributes['bnd'])
 
 
-def do_eigh_calc ( HRaux, SRaux, kq, R, read_S ):
+def do_eigh_calc ( HRaux, SRaux, kq, R, read_S, chunk=None ):
 
   # Compute bands on a selected mesh in the BZ
 
@@ -81,45 +150,33 @@ def do_eigh_calc ( HRaux, SRaux, kq, R, read_S ):
 
   Hks_int = band_loop_H(HRaux, kq, R)
 
+  Sks_int = None
   if read_S:
-    Sks_int = band_loop_S(SRaux, kq, R)
+    Sks_int = np.moveaxis(band_loop_S(SRaux, kq, R), 2, 0)
 
   E_kp = np.empty((nkpi,nawf,nspin), dtype=float)
   v_kp = np.empty((nkpi,nawf,nawf,nspin), dtype=complex)
 
   for ispin in range(nspin):
-    for ik in range(nkpi):
-      if read_S:
-        E_kp[ik,:,ispin],v_kp[ik,:,:,ispin] = spl.eigh(Hks_int[:,:,ik,ispin],Sks_int[:,:,ik])
-      else:
-        E_kp[ik,:,ispin],v_kp[ik,:,:,ispin] = npl.eigh(Hks_int[:,:,ik,ispin],UPLO='U')
+    E_kp[...,ispin],v_kp[...,ispin] = batched_eigh(np.moveaxis(Hks_int[...,ispin],2,0), Sks=Sks_int, chunk=chunk)
 
   return (E_kp, v_kp)
 
 
 ### R_wght assumed to be 1
 def band_loop_H ( HRaux, kq, R ):
+  from .kspace_hamiltonian import hamiltonian_k
 
-  nkpi = kq.shape[0]
   nawf,_,nk1,nk2,nk3,nspin = HRaux.shape
-  auxh = np.empty((nawf,nawf,nkpi,nspin), dtype=complex)
   HRaux = np.reshape(HRaux, (nawf,nawf,nk1*nk2*nk3,nspin), order='C')
 
-  for ik in range(nkpi):
-    for ispin in range(nspin):
-       auxh[:,:,ik,ispin] = np.sum(HRaux[:,:,:,ispin]*np.exp(2.j*np.pi*kq[ik,:].dot(R[:,:].T)), axis=2)
-
-  return auxh
+  return np.moveaxis(hamiltonian_k(HRaux, R, kq.T), 0, 2)
 
 
 def band_loop_S ( SRaux, kq, R ):
+  from .kspace_hamiltonian import hamiltonian_k
 
-  nkpi = kq.shape[0]
   nawf,_,nk1,nk2,nk3 = SRaux.shape
-  auxs = np.empty((nawf,nawf,nkpi), dtype=complex)
-  SRaux = np.reshape(SRaux, (nawf,nawf,nk1*nk2*nk3), order='C')
-
-  for ik in range(nkpi):
-    auxs[:,:,ik] = np.sum(SRaux[:,:,:]*np.exp(2.j*np.pi*kq[ik,:].dot(R[:,:].T)), axis=2)
+  SRaux = np.reshape(SRaux, (nawf,nawf,nk1*nk2*nk3,1), order='C')
 
-  return auxs
+  return np.moveaxis(hamiltonian_k(SRaux, R, kq.T)[...,0], 0, 2)
@@ -37,52 +37,70 @@ def do_dielectric_tensor ( data_controller, ene ):
   d_tensor = arrays['d_tensor']
 
   for ispin in range(attributes['nspin']):
+
+    # All tensor components are accumulated in a single pass over pksp
+    epsi,epsr,eels,jdos,ieps = do_epsilon(data_controller, ene, ispin, d_tensor)
+
     for n in range(d_tensor.shape[0]):
       ipol = d_tensor[n][0]
       jpol = d_tensor[n][1]
 
-      epsi,epsr,eels,jdos,ieps = do_epsilon(data_controller, ene, ispin, ipol, jpol)
-
       # Write files
       indices = (LL[ipol], LL[jpol], ispin)
-      for ep,es in [(epsi,'epsi'),(epsr,'epsr'),(eels,'eels'),(jdos,'jdos'),(ieps,'ieps')]:
+      for ep,es in [(epsi[n],'epsi'),(epsr[n],'epsr'),(eels[n],'eels'),(jdos,'jdos'),(ieps[n],'ieps')]:
         fn = '%s_%s%s_%d.dat'%((es,)+indices)
         data_controller.write_file_row_col(fn, ene, ep)
 
       if rank == 0:
-        renorm = np.sqrt((2./np.pi)*(ene[3]-ene[2])*np.sum(epsi*ene))
+        renorm = np.sqrt((2./np.pi)*(ene[3]-ene[2])*np.sum(epsi[n]*ene))
         print(ipol,jpol,' plasmon frequency = ',renorm,' eV')
         print(' integration over JDOS = ', (ene[3]-ene[2])*np.sum(jdos))
 
 
-def do_epsilon ( data_controller, ene, ispin, ipol, jpol ):
+def do_epsilon ( data_controller, ene, ispin, d_tensor ):
   from .constants import EPS0, EVTORY, RYTOEV
+  from .ibz import symmetrize_tensor
 
-  # Compute the dielectric tensor
+  # Compute the dielectric tensor components listed in d_tensor
 
   arrays,attributes = data_controller.data_dicts()
 
   esize = ene.size
+  ncomp = d_tensor.shape[0]
   if ene[0] == 0.:
     ene[0] = .00001
 
+  # Sums over the irreducible wedge are averaged over the point group, which needs every component
+  ibz = attributes.get('ibz', False)
+  comps = np.array([[i,j] for i in range(3) for j in range(3)]) if ibz else d_tensor
+
   #=======================
   # EPS
   #=======================
-  epsi_aux,epsr_aux,jdos_aux,count_aux = eps_loop(data_controller, ene, ispin, ipol, jpol)
+  epsi_aux,epsr_aux,jdos_aux,count_aux = eps_loop(data_controller, ene, ispin, comps)
 
   ### TNeeds revision. Each processor is allocating zeros here, when only rank 0 needs it. 
   ### Can be condensed
-  epsi = np.zeros(esize, dtype=float)
+  epsi = np.zeros((comps.shape[0],esize), dtype=float)
   comm.Allreduce(epsi_aux, epsi, op=MPI.SUM)
   epsi_aux = None
 
-  epsr = np.zeros(esize, dtype=float)
+  epsr = np.zeros((comps.shape[0],esize), dtype=float)
   comm.Allreduce(epsr_aux, epsr, op=MPI.SUM)
   epsr_aux = None
 
-  epsr_aux = epsr_kramerskronig(data_controller, ene, epsi)
-  epsr0 = np.zeros(esize, dtype=float)
+  if ibz:
+    rot = arrays['ibz_rot']
+    epsi = symmetrize_tensor(epsi.reshape((3,3,esize)), rot)[d_tensor[:,0],d_tensor[:,1]]
+    epsr = symmetrize_tensor(epsr.reshape((3,3,esize)), rot)[d_tensor[:,0],d_tensor[:,1]]
+
+  epsr_aux = np.zeros((ncomp,esize), dtype=float)
+  for n in range(ncomp):
+    if attributes['kk_method'] == 'fft':
+      epsr_aux[n] = epsr_kramerskronig_fft(data_controller, ene, epsi[n])
+    else:
+      epsr_aux[n] = epsr_kramerskronig(data_controller, ene, epsi[n])
+  epsr0 = np.zeros((ncomp,esize), dtype=float)
   comm.Allreduce(epsr_aux, epsr0, op=MPI.SUM)
   epsr_aux = None
 
@@ -94,26 +112,22 @@ def do_epsilon ( data_controller, ene, ispin, ipol, jpol ):
   comm.Allreduce(count_aux, count, op=MPI.SUM)
   count_aux = None
 
-  ieps = np.zeros(esize, dtype=float)
 
   kq_wght = 1./attributes['nkpnts']
   epsi *= 64.0*np.pi*kq_wght/(attributes['omega'])
   # includes correction for apparent rigid shift of epsr - solved by getting the right e -> 0 limit from KK.
   if not attributes['metal']:
-    epsr =  1. + epsr*64.0*np.pi/(attributes['omega']*attributes['nkpnts']) - (epsr[4]-epsr0[4])*64.0*np.pi/(attributes['omega']*attributes['nkpnts'])
+    epsr =  1. + epsr*64.0*np.pi/(attributes['omega']*attributes['nkpnts']) - (epsr[:,4:5]-epsr0[:,4:5])*64.0*np.pi/(attributes['omega']*attributes['nkpnts'])
   else:
     epsr =  1. + epsr*64.0*np.pi/(attributes['omega']*attributes['nkpnts']) 
   eels = epsi/(epsi**2+epsr**2)
-  for i in range(esize):
-    for j in range(1,esize):
-        ieps[i] += ene[j]*epsi[j]/(ene[i]**2+ene[j]**2)
-  ieps = 1.0 + (2./np.pi)*ieps*(ene[3]-ene[2])
+  ieps = 1.0 + (2./np.pi)*eps_imaginary_axis(ene, epsi)*(ene[3]-ene[2])
   jdos /= (4.*count[0])
 
   return(epsi, epsr, eels, jdos, ieps)
 
 
-def eps_loop ( data_controller, ene, ispin, ipol, jpol):
+def eps_loop ( data_controller, ene, ispin, d_tensor, block_size=2**20 ):
   from .constants import EPS0, EVTORY, RYTOEV, BOHR_RADIUS_ANGS
   from .smearing import intgaussian,gaussian,intmetpax,metpax
 
@@ -129,77 +143,214 @@ def eps_loop ( data_controller, ene, ispin, ipol, jpol):
   delta = attributes['delta']
   snktot = arrays['pksp'].shape[0]
   smearing = attributes['smearing']
+  ipol,jpol = d_tensor[:,0],d_tensor[:,1]
+  ncomp = d_tensor.shape[0]
 
   Ef = 0.
   eps=1.e-8
   kq_wght = 1./attributes['nkpnts']
+  mult = arrays['ibz_mult'] if attributes.get('ibz',False) else None
 
   jdos = np.zeros(esize, dtype=float)
-  epsi = np.zeros(esize, dtype=float)
-  epsr = np.zeros(esize, dtype=float)
+  epsi = np.zeros((ncomp,esize), dtype=float)
+  epsr = np.zeros((ncomp,esize), dtype=float)
+
+  E_k = arrays['E_k'][:,:bnd,ispin]
 
   fn = None
   if smearing == None:
-    fn = 2.*1./(1.+np.exp(arrays['E_k'][:,:bnd,ispin]/temp))
+    fn = 2.*1./(1.+np.exp(E_k/temp))
   elif smearing == 'gauss':
-    fn = 2.*intgaussian(arrays['E_k'][:,:bnd,ispin], Ef, arrays['deltakp'][:,:bnd,ispin])
+    fn = 2.*intgaussian(E_k, Ef, arrays['deltakp'][:,:bnd,ispin])
   elif smearing == 'm-p':
-    fn = 2.*intmetpax(arrays['E_k'][:,:bnd,ispin], Ef, arrays['deltakp'][:,:bnd,ispin])
+    fn = 2.*intmetpax(E_k, Ef, arrays['deltakp'][:,:bnd,ispin])
 
   # apparently there are numerical instabilities if energy levels are not completely occupied or completely empty - needs to be tested for metals
   if not attributes['metal']:
     fn = np.round(fn,0)
   count = np.zeros(1,dtype=float)
 
-  bndmax = bnd
-
-  for ik in range(fn.shape[0]):
-    for iband2 in range(bndmax):
-       for iband1 in range(bndmax):
-          if iband1 != iband2:
-             E_diff_nm = arrays['E_k'][ik,iband2,ispin] - arrays['E_k'][ik,iband1,ispin]
-             f_nm =  fn[ik,iband2]-fn[ik,iband1]
-             if np.abs(f_nm) > 2.e-3 and fn[ik,iband1] > 1.e-4 and fn[ik,iband2] < 2.0:
-                pksp2 = np.real(arrays['pksp'][ik,ipol,iband1,iband2,ispin]*arrays['pksp'][ik,jpol,iband2,iband1,ispin])
-                pksp2 *= attributes['alat']*BOHR_RADIUS_ANGS/(EPS0*RYTOEV)
-                epsi[:] +=  pksp2*delta*ene[:]*fn[ik,iband1]/(((E_diff_nm**2-ene[:]**2)**2+delta**2*ene[:]**2)*(E_diff_nm))
-                epsr[:] +=  pksp2*(E_diff_nm**2-ene[:]**2)*fn[ik,iband1]/(((E_diff_nm**2-ene[:]**2)**2+delta**2*ene[:]**2)*(E_diff_nm))
-                jdos[:] +=  delta*(fn[ik,iband1]-fn[ik,iband2])/(np.pi*((E_diff_nm-ene[:])**2+delta**2))
-                count[0] += (fn[ik,iband1]-fn[ik,iband2])
+  pfac = attributes['alat']*BOHR_RADIUS_ANGS/(EPS0*RYTOEV)
+
+  # Interband transitions iband1 -> iband2, treated in blocks of k-points
+  kblock = max(1, block_size//(bnd*bnd))
+  for ini_ik in range(0, snktot, kblock):
+    end_ik = min(ini_ik+kblock, snktot)
+    fk = fn[ini_ik:end_ik]
+
+    # Allowed transitions, indexed as (ik,iband2,iband1)
+    f_nm = fk[:,:,None] - fk[:,None,:]
+    allowed = (np.abs(f_nm) > 2.e-3) & (fk[:,None,:] > 1.e-4) & (fk[:,:,None] < 2.0)
+    allowed[:,np.arange(bnd),np.arange(bnd)] = False
+    ik,iband2,iband1 = np.nonzero(allowed)
+    allowed = f_nm = None
+    if ik.size == 0:
+      continue
+
+    f_1 = fk[ik,iband1]
+    df_12 = f_1 - fk[ik,iband2]
+    E_diff_nm = E_k[ini_ik+ik,iband2] - E_k[ini_ik+ik,iband1]
+
+    # Momentum products for every requested tensor component
+    pks = arrays['pksp'][ini_ik:end_ik,:,:,:,ispin]
+    pksp2 = np.real(pks[ik[:,None],ipol[None,:],iband1[:,None],iband2[:,None]]*pks[ik[:,None],jpol[None,:],iband2[:,None],iband1[:,None]]).T
+    pksp2 *= pfac*f_1/E_diff_nm
+    if mult is not None:
+      # Irreducible k-points are counted with their multiplicities
+      kw = mult[ini_ik+ik]
+      pksp2 *= kw
+      df_12 = df_12*kw
+    pks = ik = iband1 = iband2 = f_1 = None
+
+    count[0] += np.sum(df_12)
+
+    eblock = max(1, block_size//E_diff_nm.size)
+    for ie in range(0, esize, eblock):
+      ene_b = ene[ie:ie+eblock,None]
+      E2_diff = E_diff_nm[None,:]**2 - ene_b**2
+      denom = 1./(E2_diff**2 + delta**2*ene_b**2)
+      epsi[:,ie:ie+eblock] += (delta*ene_b[:,0])*(pksp2 @ denom.T)
+      epsr[:,ie:ie+eblock] += pksp2 @ (E2_diff*denom).T
+      jdos[ie:ie+eblock] += (delta/((E_diff_nm[None,:]-ene_b)**2+delta**2)) @ df_12 / np.pi
+    E2_diff = denom = pksp2 = E_diff_nm = df_12 = None
 
   if attributes['metal']:
     if rank == 0: print('NOT TESTED - needs different delta for intraband transitions and degauss from QE + check on units!!!')
     degauss=0.05
     fnF = None
     if smearing is None:
-      fnF = np.empty((snktot,bnd), dtype=float)
-      for n in range(bnd):
-        for i in range(snktot):
-          try:
-            fnF[i,n] = .5/(1.+np.cosh(arrays['E_k'][i,n,ispin]/temp))
-          except:
-            fnF[i,n] = 1e8
+      with np.errstate(over='ignore'):
+        fnF = .5/(1.+np.cosh(E_k/temp))
+      fnF[np.isinf(np.cosh(E_k/temp))] = 1e8
       fnF /= temp
     elif smearing == 'gauss':
  ## Why .03* here?
-      fnF = gaussian(arrays['E_k'][:,:bnd,ispin], Ef, .03*arrays['deltakp'][:,:bnd,ispin])
+      fnF = gaussian(E_k, Ef, .03*arrays['deltakp'][:,:bnd,ispin])
     elif smearing == 'm-p':
-      fnF = metpax(arrays['E_k'][:,:bnd,ispin], Ef, arrays['deltakp'][:,:bnd,ispin])
-
-    for ik in range(fn.shape[0]):
-      for iband1 in range(bndmax):
-        pksp2 = np.real(arrays['pksp'][ik,ipol,iband1,iband1,ispin]*arrays['pksp'][ik,jpol,iband1,iband1,ispin])
-        pksp2 *= attributes['alat']*BOHR_RADIUS_ANGS/(EPS0*RYTOEV**3)
-        epsi[:] +=  pksp2*delta*ene[:]*fnF[ik,iband1]/((ene[:]**4+delta**2*ene[:]**2)*degauss)
-        epsr[:] -=  pksp2*fnF[ik,iband1]*ene[:]**2/((ene[:]**4+delta**2*ene[:]**2)*degauss)
+      fnF = metpax(E_k, Ef, arrays['deltakp'][:,:bnd,ispin])
+
+    # Intraband terms only differ by the sum over k-points and bands of pksp2*fnF
+    if mult is not None:
+      # Irreducible k-points are counted with their multiplicities
+      fnF = fnF*mult[:,None]
+    diag = np.arange(bnd)
+    pksF = np.empty(ncomp, dtype=float)
+    for n in range(ncomp):
+      pks_i = arrays['pksp'][:,ipol[n],diag,diag,ispin]
+      pks_j = arrays['pksp'][:,jpol[n],diag,diag,ispin]
+      pksF[n] = np.sum(np.real(pks_i*pks_j)*fnF)
+    pksF *= attributes['alat']*BOHR_RADIUS_ANGS/(EPS0*RYTOEV**3)
+    pks_i = pks_j = None
+
+    epsi +=  pksF[:,None]*delta*ene/((ene**4+delta**2*ene**2)*degauss)
+    epsr -=  pksF[:,None]*ene**2/((ene**4+delta**2*ene**2)*degauss)
 
   np.seterr(over=orig_over_err)
   return(epsi, epsr, jdos, count)
 
 
+def eps_imaginary_axis ( ene, epsi, block_size=2**20 ):
+  '''
+  Transform Im(epsilon) to the imaginary frequency axis,
+  sum_j ene[j]*epsi[j]/(ene[i]**2+ene[j]**2) for j >= 1
+
+  Arguments:
+    ene (ndarray): Energy grid (ne)
+    epsi (ndarray): Imaginary part of epsilon, (ncomp,ne) or (ne)
+    block_size (int): Maximum number of elements of the kernel held in memory
+
+  Returns:
+    ieps (ndarray): Unnormalized transform, same shape as epsi
+  '''
+
+  esize = ene.size
+  ene2 = ene**2
+  weps = ene[1:]*epsi[...,1:]
+
+  ieps = np.empty(epsi.shape, dtype=float)
+  iblock = max(1, block_size//esize)
+  for ie in range(0, esize, iblock):
+    kern = 1./(ene2[ie:ie+iblock,None]+ene2[None,1:])
+    ieps[...,ie:ie+iblock] = weps @ kern.T
+
+  return ieps
+
+
+def fft_convolve ( a, b ):
+  '''
+  Full linear convolution of two real 1D arrays through zero padded FFTs
+  '''
+
+  n = a.size + b.size - 1
+  nfft = 1 << (n-1).bit_length()
+  return np.fft.irfft(np.fft.rfft(a,nfft)*np.fft.rfft(b,nfft), nfft)[:n]
+
+
+def epsr_kramerskronig_fft ( data_controller, ene, epsi ):
+  '''
+  O(ne log ne) Kramers-Kronig transform of Im(epsilon) on a uniform energy grid.
+  The principal value is evaluated with Maclaurin's rule (only points j with
+  j-i odd, with double weight) and the kernel is split as
+  1/(x_j^2-x_i^2) = (1/(x_j-x_i) - 1/(x_j+x_i))/(2 x_i)
+  whose two terms are a Toeplitz and a Hankel product, evaluated with FFTs.
+
+  Arguments:
+    data_controller (DataController): The DataController
+    ene (ndarray): Uniform energy grid (ne)
+    epsi (ndarray): Imaginary part of epsilon (ne)
+
+  Returns:
+    epsr (ndarray): Real part of epsilon on the energies of this rank's load balancing slice, zero elsewhere
+  '''
+  from .smearing import intmetpax
+  from .communication import load_balancing
+
+  arrays,attributes = data_controller.data_dicts()
+
+  esize = ene.size
+  de = ene[2] - ene[1]
+
+  epsr = np.zeros(esize, dtype=float)
+
+  # Same energy range as the Simpson integration
+  ini_ie,end_ie = load_balancing(comm.Get_size(), rank, esize)
+  ini_ie,end_ie = max(ini_ie,3),min(end_ie,esize-1)
+  if end_ie <= ini_ie:
+    return epsr
+
+  # Work on ene[1:], where the grid is uniform: x_j = x_0 + j*de
+  nsize = esize - 1
+  f_ene = intmetpax(ene, attributes['shift'], 1.)
+  u = ene[1:]*de*epsi[1:]*f_ene[1:]
+  x0 = ene[1]
+
+  # Toeplitz term, sum_j u_j/((j-i)*de) for odd j-i (kernel indexed by i-j)
+  m = np.arange(-(nsize-1), nsize)
+  kt = np.zeros(m.size, dtype=float)
+  odd = (m%2 == 1)
+  kt[odd] = -1./(m[odd]*de)
+  toep = fft_convolve(u, kt)[nsize-1:2*nsize-1]
+
+  # Hankel term, sum_j u_j/(2*x_0+(i+j)*de) for odd i+j
+  s = np.arange(2*nsize-1)
+  kh = np.zeros(s.size, dtype=float)
+  kh[1::2] = 1./(2.*x0 + s[1::2]*de)
+  hank = fft_convolve(u[::-1], kh)[nsize-1:2*nsize-1]
+
+  epsr[1:] = 2.*(toep - hank)/(np.pi*ene[1:])
+
+  epsr[:ini_ie] = 0.
+  epsr[end_ie:] = 0.
+
+  return epsr
+
+
 def epsr_kramerskronig ( data_controller, ene, epsi ):
   from .smearing import intmetpax
-  from scipy.integrate import simps
+  try:
+    from scipy.integrate import simps
+  except ImportError:
+    from scipy.integrate import simpson as simps
   from .communication import load_balancing
 
   arrays,attributes = data_controller.data_dicts()
@@ -213,7 +364,7 @@ def epsr_kramerskronig ( data_controller, ene, epsi ):
 
   # Range checks for Simpson Integrals
   if end_ie == ini_ie:
-    return
+    return epsr
   if ini_ie < 3:
     ini_ie = 3
   if end_ie == esize:
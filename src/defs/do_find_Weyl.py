@@ -42,27 +42,21 @@ size = comm.Get_size()
 #np.set_printoptions(precision=8, threshold=100, edgeitems=50, linewidth=350, suppress=True)
 
 def band_loop_H ( ini_ik, end_ik, HRaux, kq, R ):
-  nawf,_,_,nspin = HRaux.shape
-  kdot = np.zeros((1,R.shape[0]), dtype=complex, order='C')
-  kdot = np.tensordot(R, 2.0j*np.pi*kq[:,ini_ik:end_ik], axes=([1],[0]))
-  np.exp(kdot, kdot)
-
-  auxh = np.zeros((nawf,nawf,1,nspin), dtype=complex, order='C')
-  for ispin in range(nspin):
-    auxh[:,:,ini_ik:end_ik,ispin] = np.tensordot(HRaux[:,:,:,ispin], kdot, axes=([2],[0]))
-  return auxh
+  # HRaux is either dense or the truncated hoppings of truncated_HR, on the lattice vectors R
+  from .kspace_hamiltonian import hamiltonian_k
+  return np.moveaxis(hamiltonian_k(HRaux, R, kq[:,ini_ik:end_ik]), 0, 2)
 
 def gen_eigs ( HRaux, kq, R ):
   # Load balancing
 
-  nawf,_,_,nspin = HRaux.shape
-  E_kp = np.zeros((1,nawf,nspin), dtype=np.float64)
-
   kq=kq[:,None]
 
 #  Hks_int  = np.zeros((nawf,nawf,1,nspin),dtype=complex,order='C') # final data arrays
   Hks_int = band_loop_H(0,1,HRaux,kq,R)
 
+  nawf,_,_,nspin = Hks_int.shape
+  E_kp = np.zeros((1,nawf,nspin), dtype=np.float64)
+
   for ispin in range(nspin):
     E_kp[:,:,ispin] =  LAN.eigvalsh(Hks_int[:,:,0,ispin],UPLO='U')
 
@@ -122,12 +116,17 @@ def find_weyl ( data_controller, test_rad, search_grid ):
 
   HRs = np.reshape(HRs, (nawf,nawf,nk1*nk2*nk3,nspin))
 
+  if 'sparse_HR_threshold' in attr:
+    from .sparse_HR import truncated_HR
+    R,HRs,_ = truncated_HR(data_controller)
+
   mag_soc = np.logical_and(attr["dftMAG"], attr["dftSO"])
 
-  CAND, ene = find_min(HRs, nelec, R, b_vectors, symf, verbose, search_grid)
+  CAND, gaps = find_min(HRs, nelec, R, b_vectors, symf, verbose, search_grid)
 
   WEYL = {}
   if rank == 0:
+    CAND = unique_candidates(CAND, symops, TR_flag, mag_soc, symf, verbose)
     if symf:
       # get all equiv k
       CAND = get_equiv_k(CAND, symops, TR_flag, mag_soc)
@@ -201,75 +200,176 @@ def find_weyl ( data_controller, test_rad, search_grid ):
     with open(os.path.join(attr['opath'],'weyl_points.dat'), 'w') as ofo:
       ofo.write(wcs)
 
-def find_min ( HRs, nelec, R, a_vectors, symf, verbose, search_grid=[8,8,8] ):
-
-  snk = tuple(search_grid[i] for i in range(3))
-  #snk2 = search_grid[1]
-  #snk3 = search_grid[2]
-  #search_grid = do_search_grid(snk1,snk2,snk3)
+def gap_and_gradient ( HRs, R, kq, nelec ):
+  '''
+  Gap between bands nelec-1 and nelec (first spin) at a batch of k-points, and its
+  gradient from the Hellmann-Feynman theorem, dE_n/dk = <n|dH/dk|n>
+
+  Arguments:
+      HRs (ndarray or csr_matrix): Dense or truncated real space Hamiltonian
+      R (ndarray): Lattice vectors in crystal coordinates (nR,3)
+      kq (ndarray): k-points in crystal coordinates (nk,3)
+      nelec (int): Number of occupied bands
+
+  Returns:
+      gap (ndarray): Gap at each k-point (nk)
+      dgap (ndarray): Gradient of the gap, in crystal coordinates (nk,3)
+  '''
+  from .do_eigh import batched_eigh
+  from .kspace_hamiltonian import hamiltonian_k
+
+  Hks,dHks = hamiltonian_k(HRs, R, kq.T, order=1)
+  E_k,v_k = batched_eigh(np.ascontiguousarray(Hks[...,0]))
+
+  vb = v_k[:,:,nelec-1:nelec+1]
+  dE = np.real(np.einsum('kin,kaij,kjn->kan', np.conj(vb), dHks[...,0], vb, optimize=True))
+
+  return E_k[:,nelec]-E_k[:,nelec-1], dE[:,:,1]-dE[:,:,0]
+
+
+def gap_lipschitz ( HRs, R ):
+  '''
+  Bound on |dgap/dk_a| over the whole BZ, from ||dH/dk_a||_2 <= sum_R 2pi|R_a| ||H(R)||_F.
+  Each band moves at most that fast (Weyl's inequality), so the gap moves at most twice as fast.
+
+  Arguments:
+      HRs (ndarray or csr_matrix): Dense or truncated real space Hamiltonian
+      R (ndarray): Lattice vectors in crystal coordinates (nR,3)
+
+  Returns:
+      lip (ndarray): Bound for each crystal direction (3)
+  '''
+  from scipy import sparse
+
+  if sparse.issparse(HRs):
+    nspin = HRs.shape[0]//max(1,R.shape[0])
+    HRnorm = np.sqrt(np.asarray(abs(HRs[::nspin]).power(2).sum(axis=1))[:,0])
+  else:
+    HRnorm = np.sqrt(np.sum(np.abs(HRs[...,0])**2, axis=(0,1)))
+
+  return 2*2*np.pi*(np.abs(R).T @ HRnorm)
+
+
+def find_min ( HRs, nelec, R, a_vectors, symf, verbose, search_grid=[8,8,8], gap_tol=1.e-5, max_iter=200 ):
+  '''
+  Search every box of the search grid for a band crossing between bands nelec-1 and nelec.
+  All the boxes of a rank advance together: each iteration evaluates the gaps and their
+  analytic gradients for the whole batch, then moves every point by a Newton step on the
+  gap (k -> k - gap*grad/|grad|^2, exact on a linear crossing), backtracking where the gap
+  does not decrease and staying inside the box. Boxes whose gap cannot reach zero anywhere
+  inside them, by the bound of gap_lipschitz, are dropped.
+
+  Arguments:
+      HRs (ndarray or csr_matrix): Dense (nawf,nawf,nR,nspin) or truncated real space Hamiltonian
+      nelec (int): Number of occupied bands
+      R (ndarray): Lattice vectors in crystal coordinates (nR,3)
+      a_vectors (ndarray): Unused
+      symf (bool): Unused, equivalent hits are removed by unique_candidates
+      verbose (bool): Print the progress of the search
+      search_grid (list): Number of boxes in each direction
+      gap_tol (float): Largest gap of a hit
+      max_iter (int): Maximum number of iterations
+
+  Returns:
+      candidates (ndarray): Crystal coordinates of the hits, on rank 0, sorted by gap (ncand,3)
+      gaps (ndarray): Gap of each hit, on rank 0
+  '''
+  snk = np.array(search_grid[:3])
   search_grid = get_search_grid(*snk)
-  
-  #get the search grid off possible HSP
-  end = np.array([.5]*3)
-  start = np.array([-.5]*3)
-  #end1 = end2 = end3 = 0.5
-  #start1 = start2 = start3 = -0.5
-  bounds_K  = np.zeros((search_grid.shape[0],3,2))
-  #guess_K   = np.zeros((search_grid.shape[0],3))
-
-  #do the bounds for each search subsection of FBZ
-  #search in boxes
-  bounds_K[:,:,0] = search_grid
-  bbox = np.array([(end[i]-start[i])/snk[i] for i in range(3)])
-  bounds_K[:,:,1] = search_grid + bbox
-  #initial guess is in the middle of each box
-  guess_K = search_grid + 0.5*bbox
-
-  sgi = np.arange(bounds_K.shape[0], dtype=int)
+
+  # Boxes of side 1/snk, starting from their centers
+  bbox = 1./snk
+  lo = search_grid
+  hi = search_grid + bbox
+
+  sgi = np.arange(search_grid.shape[0], dtype=int)
   sgi = scatter_full(sgi, 1)
   print('finding Weyl points... rank={0} npoints={1}'.format(rank, sgi.shape[0]))
 
-  candidates = np.zeros((sgi.shape[0],3))
-
-  lam_XiP = lambda K: get_gap(HRs, K, R, nelec)
-  for i in range(sgi.shape[0]):
-    solx = OP.minimize(lam_XiP, guess_K[sgi[i]], bounds=bounds_K[sgi[i]], method="L-BFGS-B", options={"ftol":1.e-14,"gtol":1.e-12})
-
-    if np.abs(solx.fun) < 1.e-5:
-      candidates[i] = solx.x
-      
-  candidates = gather_full(candidates,1)
-
-  ene = None
-  if rank == 0:  
-    # filter out non hits
-    candidates = candidates[np.where(np.sum(candidates,axis=1)!=0.0)]
-    # calculate energy at each candidate to reduce equiv ones
-    ene = np.zeros((candidates.shape[0]))
-    gaps = np.zeros((candidates.shape[0]))
-    for i in range(ene.shape[0]):
-      eigs = gen_eigs(HRs,candidates[i],R)[0,:,0]
-      ene[i] = eigs[nelec]
-      gaps[i] = eigs[nelec]-eigs[nelec-1]
-
-    if symf:
-      # sort by gap size (should be nearly zero)
-      idx = np.argsort(gaps)
-      ene = ene[idx]
-      candidates = candidates[idx]     
-      # filter out duplicates by degeneracy
-      _,idx=np.unique(np.around(ene,decimals=4),return_index=True)
-      ene = ene[idx]
-      candidates = candidates[idx]
-      if verbose:
-       print('\nfound %s non-equivilent candidates'%candidates.shape[0])
-       for i in range(ene.shape[0]):
-         tup = tuple(candidates[i][j] for j in range(3)) + (ene[i],)
-         print("[ % 7.4f % 7.4f % 7.4f ] % 4.4f"%tup)
-       print()
+  lip = gap_lipschitz(HRs, R)
+
+  kq = lo[sgi] + 0.5*bbox
+  lo,hi = lo[sgi],hi[sgi]
+  gap,dgap = gap_and_gradient(HRs, R, kq, nelec)
+  step = np.ones(sgi.shape[0])
+  active = np.ones(sgi.shape[0], dtype=bool)
+
+  for it in range(max_iter):
+    # No crossing is reachable if the gap exceeds its largest possible drop within the box
+    reach = np.sum(lip*np.maximum(kq-lo, hi-kq), axis=1)
+    active &= (gap < reach) & (gap > 1.e-2*gap_tol) & (step > 1.e-8)
+    ind = np.flatnonzero(active)
+    if ind.size == 0:
+      break
+
+    # Gradient components pushing against a wall of the box are dropped
+    g,dg = gap[ind],dgap[ind].copy()
+    dg[((kq[ind] <= lo[ind]) & (dg > 0)) | ((kq[ind] >= hi[ind]) & (dg < 0))] = 0.
+    dk = -(g/np.maximum(np.sum(dg**2,axis=1),1.e-30))[:,None]*dg
+    # Never move further than the box size
+    dk *= np.minimum(1., np.amin(bbox/np.maximum(np.abs(dk),1.e-30), axis=1))[:,None]
+    knew = np.clip(kq[ind]+step[ind,None]*dk, lo[ind], hi[ind])
+
+    gnew,dgnew = gap_and_gradient(HRs, R, knew, nelec)
+
+    # Steps must decrease the gap by a finite fraction, so points stuck in a gapped minimum stop
+    better = gnew < (1.-1.e-6)*g
+    acc,rej = ind[better],ind[~better]
+    kq[acc],gap[acc],dgap[acc] = knew[better],gnew[better],dgnew[better]
+    step[acc] = np.minimum(1., 2*step[acc])
+    step[rej] *= 0.5
+
+  if verbose:
+    print('Weyl search on rank {0}: {1} iterations, {2} boxes excluded by the gap bound'.format(rank, it+1, np.count_nonzero(gap >= np.sum(lip*np.maximum(kq-lo, hi-kq), axis=1))))
+
+  # Crystal coordinates, gap and hit flag of every box
+  result = np.concatenate((kq, gap[:,None], (gap < gap_tol)[:,None]), axis=1)
+  result = gather_full(result, 1)
+
+  candidates = gaps = None
+  if rank == 0:
+    result = result[result[:,4] == 1.]
+    idx = np.argsort(result[:,3])
+    candidates,gaps = result[idx,:3],result[idx,3]
 
   comm.Barrier()
-  return (candidates, ene)
+  return (candidates, gaps)
+
+
+def unique_candidates ( cand, symop, sym_TR, mag_soc, symf, verbose, tol=1.e-4 ):
+  '''
+  Remove hits equivalent to a previous one, by translation or, with symf, by a symmetry
+  operation in the star generated by get_equiv_k
+
+  Arguments:
+      cand (ndarray): Crystal coordinates of the hits (ncand,3)
+      symop (ndarray): Symmetry operations
+      sym_TR (ndarray): Time reversal flag of each operation
+      mag_soc (bool): True for magnetic systems with spin orbit coupling
+      symf (bool): If True remove symmetry equivalent hits
+      verbose (bool): Print the inequivalent hits
+      tol (float): Largest distance between equivalent k-points
+
+  Returns:
+      reps (ndarray): One hit for each class of equivalent hits (nrep,3)
+  '''
+  reps = []
+  stars = np.zeros((0,3))
+  for k in cand:
+    diff = (k[None,:]-stars+0.5)%1.0-0.5
+    if stars.shape[0] > 0 and np.amin(np.amax(np.abs(diff),axis=1)) < tol:
+      continue
+    reps.append(k)
+    star = get_equiv_k(k[None,:], symop, sym_TR, mag_soc) if symf else k[None,:]
+    stars = np.vstack([stars,star])
+  reps = np.array(reps).reshape(-1,3)
+
+  if verbose and symf:
+    print('\nfound %s non-equivilent candidates'%reps.shape[0])
+    for k in reps:
+      print("[ % 7.4f % 7.4f % 7.4f ]"%tuple(k))
+    print()
+  return reps
 
 
 def get_equiv_k(kp,symop,sym_TR,mag_soc):
@@ -19,8 +19,9 @@
 
 def do_gradient ( data_controller ):
   import numpy as np
-  from scipy import fftpack as FFT
+  from .batched_fft import batched_fftn
   from .get_R_grid_fft import get_R_grid_fft
+  from .communication import gather_scatter
 
   arry,attr = data_controller.data_dicts()
 
@@ -34,18 +35,31 @@ def do_gradient ( data_controller ):
   # fft grid in R shifted to have (0,0,0) in the center
   get_R_grid_fft(data_controller, nk1, nk2, nk3)
 
-  arry['dHksp'] = np.empty((snawf,nk1,nk2,nk3,3,nspin), dtype=complex, order='C')
-  for ispin in range(nspin):
-    for n in range(snawf):
-      ########################################
-      ### real space grid replaces k space ###
-      ########################################
-      if attr['use_cuda']:
-        arry['Hksp'][n,:,:,:,ispin] = cuda_ifftn(arry['Hksp'][n,:,:,:,ispin])*1.0j*attr['alat']
-      else:
-        arry['Hksp'][n,:,:,:,ispin] = FFT.ifftn(arry['Hksp'][n,:,:,:,ispin])*1.0j*attr['alat']
-
-      # Compute R*H(R)
-      for l in range(3):
-        arry['dHksp'][n,:,:,:,l,ispin] = FFT.fftn(arry['Rfft'][:,:,:,l]*arry['Hksp'][n,:,:,:,ispin])
+  backend,workers = attr.get('fft_backend','scipy'),attr.get('fft_threads',1)
 
+  def gradient_pool ( Hksp ):
+    ########################################
+    ### real space grid replaces k space ###
+    ########################################
+    # Written back in place, band curvature reads i*alat*H(R) from Hksp
+    if attr['use_cuda']:
+      for ispin in range(nspin):
+        for n in range(Hksp.shape[0]):
+          Hksp[n,:,:,:,ispin] = cuda_ifftn(Hksp[n,:,:,:,ispin])*1.0j*attr['alat']
+    else:
+      Hksp[...] = batched_fftn(Hksp, axes=(1,2,3), inverse=True, backend=backend, workers=workers)*(1.0j*attr['alat'])
+
+    # Compute R*H(R), one batched FFT of the whole pool per direction
+    dHksp = np.empty((Hksp.shape[0],nk1,nk2,nk3,3,nspin), dtype=complex, order='C')
+    for l in range(3):
+      RH = arry['Rfft'][None,:,:,:,l,None]*Hksp
+      dHksp[:,:,:,:,l,:] = batched_fftn(RH, axes=(1,2,3), backend=backend, workers=workers, overwrite=True)
+    RH = None
+    dHksp = np.reshape(dHksp, (Hksp.shape[0],nktot,3,nspin))
+    return dHksp if ibz_ind is None else dHksp[:,ibz_ind]
+
+  # dHksp is distributed over k-points (nawf**2,snktot,3,nspin); each pool of
+  # orbitals is differentiated while the previous one is being transposed.
+  # In IBZ mode only the irreducible k-points are kept and distributed
+  ibz_ind = arry.get('ibz_ind') if attr.get('ibz',False) else None
+  arry['dHksp'] = gather_scatter(arry['Hksp'], 1, attr['npool'], func=gradient_pool)
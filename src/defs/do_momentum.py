@@ -19,7 +19,8 @@
 
 def do_momentum ( data_controller ):
   import numpy as np
-  from .perturb_split import perturb_split
+  from .perturb_split import perturb_split_batch
+  from .do_eigh import get_degen_spin
 
   arry,attr = data_controller.data_dicts()
 
@@ -27,10 +28,9 @@ def do_momentum ( data_controller ):
 
   arry['pksp'] = np.zeros_like(arry['dHksp'])
 
+  # Each direction lifts the degeneracies in its own subspace basis
   for ispin in range(nspin):
-    for ik in range(nktot):
-      for l in range(3):
-         arry['pksp'][ik,l,:,:,ispin],_ = perturb_split(arry['dHksp'][ik,l,:,:,ispin], 
-                                                        arry['dHksp'][ik,l,:,:,ispin], 
-                                                        arry['v_k'][ik,:,:,ispin],
-                                                        arry['degen'][ispin][ik])
+    arry['pksp'][...,ispin] = perturb_split_batch(arry['dHksp'][...,ispin],
+                                                  arry['v_k'][...,ispin],
+                                                  get_degen_spin(arry['degen'], ispin),
+                                                  ref=None)
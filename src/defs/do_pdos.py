@@ -23,7 +23,54 @@ from mpi4py import MPI
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 
+def pdos_weights ( v_k ):
+  '''
+  Projection weights |v_k|^2 of each state (k,band) on each orbital
+
+  Arguments:
+    v_k (ndarray): Eigenvectors (nk,nawf,nawf) for one spin
+
+  Returns:
+    weights (ndarray): (nk*nawf,nawf) weights, states ordered as E_k[:,:].ravel()
+  '''
+  nawf = v_k.shape[1]
+  return np.ascontiguousarray(np.swapaxes(np.abs(v_k)**2,1,2)).reshape(-1,nawf)
+
+
+def write_pdos ( data_controller, ene, pdos, label, ispin ):
+  '''
+  Write the orbital resolved PDOS of one spin, one file per orbital or, with the
+  attribute 'pdos_columns', a single file with one column per orbital. Their sum
+  is written to a separate file
+
+  Arguments:
+    data_controller (DataController): The DataController
+    ene (ndarray): Energy grid (ne)
+    pdos (ndarray): PDOS (nawf,ne) on rank 0, None elsewhere
+    label (str): File prefix ('pdos' or 'pdosdk')
+    ispin (int): Spin index
+
+  Returns:
+    None
+  '''
+  attr = data_controller.data_attributes
+  nawf = attr['nawf']
+
+  if attr.get('pdos_columns', False):
+    header = 'E(eV) ' + ' '.join(['orb_%d'%m for m in range(nawf)])
+    fpdos = '%s_%d.dat'%(label,ispin)
+    data_controller.write_file_cols(fpdos, ene, pdos, header=header)
+  else:
+    for m in range(nawf):
+      fpdos = '%d_%s_%d.dat'%(m,label,ispin)
+      data_controller.write_file_row_col(fpdos, ene, (pdos[m] if rank==0 else None))
+
+  fpdos = '%s_sum_%d.dat'%(label,ispin)
+  data_controller.write_file_row_col(fpdos, ene, (np.sum(pdos,axis=0) if rank==0 else None))
+
+
 def do_pdos ( data_controller, emin, emax, ne, delta ):
+  from .do_dos import smeared_sum
 
   arrays,attributes = data_controller.data_dicts()
 
@@ -38,15 +85,12 @@ def do_pdos ( data_controller, emin, emax, ne, delta ):
 
   for ispin in range(nspin):
 
-    pdosaux = np.zeros((nawf,ne), dtype=float)
-    v_kaux = np.real(np.abs(arrays['v_k'][:,:,:,ispin])**2)
-
     E_k = arrays['E_k'][:,:,ispin]
+    v_kaux = pdos_weights(arrays['v_k'][:,:,:,ispin])
 
-    for n in range(ne):
-      taux = np.exp(-((ene[n]-E_k)/delta)**2)/np.sqrt(np.pi)
-      for m in range(nawf):
-        pdosaux[m,n] += np.sum(taux*v_kaux[:,m,:])
+    # All orbitals at once: kernel matrix (ne,nstates) times weights (nstates,nawf)
+    pdosaux = smeared_sum(ene, E_k, delta, weights=v_kaux)
+    v_kaux = None
 
     pdos = (np.zeros((nawf,ne),dtype=float) if rank==0 else None)
 
@@ -54,22 +98,14 @@ def do_pdos ( data_controller, emin, emax, ne, delta ):
     pdosaux = None
 
     if rank == 0:
-      pdos /= (float(nktot)*np.sqrt(np.pi)*delta)
-
-    pdos_sum = (np.zeros(ne, dtype=float) if rank==0 else None)
+      pdos /= (float(nktot)*np.sqrt(np.pi))
 
-    for m in range(nawf):
-      if rank == 0:
-        pdos_sum += pdos[m]
-      fpdos = '%d_pdos_%d.dat'%(m,ispin)
-      data_controller.write_file_row_col(fpdos, ene, (pdos[m] if rank==0 else None))
-
-    fpdos = 'pdos_sum_%d.dat'%ispin
-    data_controller.write_file_row_col(fpdos, ene, pdos_sum)
+    write_pdos(data_controller, ene, pdos, 'pdos', ispin)
 
 
 def do_pdos_adaptive ( data_controller, emin, emax, ne ):
   from .smearing import metpax, gaussian
+  from .do_dos import smeared_sum
 
   arrays = data_controller.data_arrays
   attributes = data_controller.data_attributes
@@ -86,18 +122,14 @@ def do_pdos_adaptive ( data_controller, emin, emax, ne ):
 
     pdosaux = np.zeros((nawf,ne), dtype=float)
 
-    v_kaux = np.real(np.abs(arrays['v_k'][:,:,:,ispin])**2)
-
-    taux = np.zeros((arrays['deltakp'].shape[0],nawf), dtype=float)
+    v_kaux = pdos_weights(arrays['v_k'][:,:,:,ispin])
 
-    for n in range (ne):
-      if attributes['smearing'] == 'gauss':
-        taux = gaussian(ene[n], E_k, arrays['deltakp'][:,:,ispin]) 
-      elif attributes['smearing'] == 'm-p':
-        taux = metpax(ene[n], E_k, arrays['deltakp'][:,:,ispin])
-      for i in range(nawf):
-          # Adaptive Gaussian Smearing
-          pdosaux[i,n] += np.sum(taux*v_kaux[:,i,:])
+    # Adaptive smearing
+    if attributes['smearing'] == 'gauss':
+      pdosaux = smeared_sum(ene, E_k, arrays['deltakp'][:,:,ispin], weights=v_kaux, kernel=gaussian)
+    elif attributes['smearing'] == 'm-p':
+      pdosaux = smeared_sum(ene, E_k, arrays['deltakp'][:,:,ispin], weights=v_kaux, kernel=metpax)
+    v_kaux = None
 
     pdos = (np.zeros((nawf,ne), dtype=float) if rank==0 else None)
 
@@ -107,13 +139,4 @@ def do_pdos_adaptive ( data_controller, emin, emax, ne ):
     if rank == 0:
       pdos /= float(attributes['nkpnts'])
 
-    pdos_sum = (np.zeros(ne, dtype=float) if rank==0 else None)
-
-    for m in range(nawf):
-      if rank == 0:
-        pdos_sum += pdos[m]
-      fpdos = '%d_pdosdk_%d.dat'%(m,ispin)
-      data_controller.write_file_row_col(fpdos, ene, (pdos[m] if rank==0 else None))
-
-    fpdos = 'pdosdk_sum_%d.dat'%ispin
-    data_controller.write_file_row_col(fpdos, ene, pdos_sum)
+    write_pdos(data_controller, ene, pdos, 'pdosdk', ispin)
@@ -87,7 +87,7 @@ def do_spin_orbit_H ( data_controller ):
     # Down-Up
     HR_double[ddi:ddj,uui:uuj,0,0,0,0] += socStrengh[n,0]*HR_soc_p[norb:2*norb,0:norb] + socStrengh[n,1]*HR_soc_d[norb:2*norb,0:norb]
 
-    del arry['HRs']
+    data_controller.release_array('HRs')
     arry['HRs'] = HR_double
     attr['nawf'] = arry['HRs'].shape[0]
 
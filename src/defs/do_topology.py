@@ -28,6 +28,7 @@ def do_topology ( data_controller ):
   from .constants import LL, ANGSTROM_AU
   from .get_R_grid_fft import get_R_grid_fft
   from .communication import scatter_full,gather_full
+  from .kspace_hamiltonian import hamiltonian_k
   from .kpnts_interpolation_mesh import kpnts_interpolation_mesh
 
   comm = MPI.COMM_WORLD
@@ -135,79 +136,32 @@ def do_topology ( data_controller ):
   kq_aux = scatter_full(arrays['kq'].T, npool)
   kq_aux = kq_aux.T
 
-  # Compute R*H(R)
+  # dH(k)/dk and d2H(k)/dkdk' on the path, from i*R*H(R) and -R*R'*H(R)
   Rfft = np.reshape(arrays['Rfft'], (nk1*nk2*nk3,3), order='C')
   HRs = np.reshape(HRs, (nawf,nawf,nk1*nk2*nk3,nspin), order='C')
-  HRs = np.moveaxis(HRs, 2, 0)
+  if 'sparse_HR_threshold' in attributes:
+    from .sparse_HR import truncated_HR
+    irvec,HRs,_ = truncated_HR(data_controller)
+    Rfft = irvec @ arrays['a_vectors']
+  Hks_aux = hamiltonian_k(HRs, Rfft, kq_aux, Rcart=alat*ANGSTROM_AU*Rfft, order=(2 if eff_mass else 1), mem_budget=attributes['hk_mem_budget'], nspin=nspin)
+  dHks_aux = Hks_aux[1]
 
-  HRs_aux = scatter_full(HRs, npool)
-  Rfft_aux = scatter_full(Rfft, npool)
-
-  HRs = np.reshape(np.moveaxis(HRs,0,2), (nawf,nawf,nk1,nk2,nk3,nspin), order='C')
+  # Momenta, spin currents and kinetic energy in the basis of the lowest bnd eigenvectors
+  v_k = arrays['v_k'][:,:,:bnd,:]
+  pks = np.ascontiguousarray(np.einsum('kais,klabs,kbjs->klijs', np.conj(v_k), dHks_aux, v_k, optimize=True))
 
   if spin_Hall:
-    Sj = arrays['Sj']
-    jks = np.zeros((kq_aux.shape[1],3,bnd,bnd,nspin), dtype=complex)
-
-  pks = np.zeros((kq_aux.shape[1],3,bnd,bnd,nspin), dtype=complex)
-  for l in range(3):
-    dHRs  = np.zeros((HRs_aux.shape[0],nawf,nawf,nspin),dtype=complex)
-    for ispin in range(nspin):
-      for n in range(nawf):
-        for m in range(nawf):
-          dHRs[:,n,m,ispin] = 1.0j*alat*ANGSTROM_AU*Rfft_aux[:,l]*HRs_aux[:,n,m,ispin]
-
-    dHRs = gather_full(dHRs, npool)
-    if rank != 0:
-      dHRs = np.zeros((nk1*nk2*nk3,nawf,nawf,nspin), dtype=complex)
-    comm.Bcast(dHRs)
-    dHRs = np.moveaxis(dHRs,0,2)
-
-    # Compute dH(k)/dk on the path
-    dHks_aux = band_loop_H(dHRs, Rfft, kq_aux, nawf, nspin)
-
-    dHRs = None
-
-    # Compute momenta
-    for ik in range(dHks_aux.shape[0]):
-      for ispin in range(nspin):
-        pks[ik,l,:,:,ispin] = np.conj(arrays['v_k'][ik,:,:,ispin].T).dot(dHks_aux[ik,:,:,ispin]).dot(arrays['v_k'][ik,:,:,ispin])[:bnd,:bnd]
-
-    if spin_Hall:
-      for ik in range(pks.shape[0]):
-        for ispin in range(nspin):
-          jks[ik,l,:,:,ispin] = (np.conj(arrays['v_k'][ik,:,:,ispin].T).dot \
-            (0.5*(np.dot(Sj[spol],dHks_aux[ik,:,:,ispin])+np.dot(dHks_aux[ik,:,:,ispin],Sj[spol]))).dot(arrays['v_k'][ik,:,:,ispin]))[:bnd,:bnd]
+    Sj = arrays['Sj'][spol]
+    jHks = 0.5*(np.einsum('ab,klbcs->klacs', Sj, dHks_aux)+np.einsum('klabs,bc->klacs', dHks_aux, Sj))
+    jks = np.ascontiguousarray(np.einsum('kais,klabs,kbjs->klijs', np.conj(v_k), jHks, v_k, optimize=True))
+    jHks = None
 
   if eff_mass == True:
-    tks = np.zeros((kq_aux.shape[1],3,3,bnd,bnd,nspin), dtype=complex)
-
-    for l in range(3):
-      for lp in range(3):
-        d2HRs = np.zeros((HRs_aux.shape[0],nawf,nawf,nspin), dtype=complex)
-        for ispin in range(nspin):
-          for n in range(nawf):
-            for m in range(nawf):
-              d2HRs[:,n,m,ispin] = -1.0*alat**2*ANGSTROM_AU**2*Rfft_aux[:,l]*Rfft_aux[:,lp]*HRs_aux[:,n,m,ispin]
+    tks = np.ascontiguousarray(np.einsum('kais,klmabs,kbjs->klmijs', np.conj(v_k), Hks_aux[2], v_k, optimize=True))
 
-        d2HRs = gather_full(d2HRs, npool)
-        if rank != 0:
-          d2HRs = np.zeros((nk1*nk2*nk3,nawf,nawf,nspin), dtype=complex)
-        comm.Bcast(d2HRs)
-        d2HRs = np.moveaxis(d2HRs, 0, 2)
-
-        # Compute d2H(k)/dk*dkp on the path
-        d2Hks_aux = band_loop_H(d2HRs, Rfft, kq_aux, nawf, nspin)
-
-        d2HRs = None
-
-        # Compute kinetic energy
-        for ik in range(d2Hks_aux.shape[0]):
-          for ispin in range(nspin):
-            tks[ik,l,lp,:,:,ispin] = (np.conj(arrays['v_k'][ik,:,:,ispin].T).dot(d2Hks_aux[ik,:,:,ispin]).dot(arrays['v_k'][ik,:,:,ispin]))[:bnd,:bnd]
-
-        d2Hks_aux = None
+  Hks_aux = dHks_aux = None
 
+  if eff_mass == True:
     # Compute effective mass
     mkm1 = np.zeros((tks.shape[0],bnd,3,3,nspin), dtype=complex)
     for ik in range(tks.shape[0]):
@@ -239,7 +193,6 @@ def do_topology ( data_controller ):
 
     mkm1 = None
 
-  HRs_aux = None
   HRs = None
 
   # Compute Berry curvature
@@ -287,18 +240,3 @@ def do_topology ( data_controller ):
     data_controller.write_file_row_col(fOmj_zk, lrng, (Omj_zk[:,0] if rank==0 else None))
   Omj_zk = fOmj_zk = None
 
-
-def band_loop_H ( HRaux, R, kq, nawf, nspin ):
-
-  kdot = np.zeros((kq.shape[1],R.shape[0]),dtype=complex,order="C")
-  kdot = np.tensordot(R,2.0j*np.pi*kq,axes=([1],[0]))
-  np.exp(kdot,kdot)
-
-  Haux = np.zeros((nawf,nawf,kq.shape[1],nspin),dtype=complex,order="C")
-
-  for ispin in range(nspin):
-    Haux[:,:,:,ispin] = np.tensordot(HRaux[:,:,:,ispin], kdot, axes=([2],[0]))
-
-  kdot  = None
-  Haux = np.transpose(Haux,(2,0,1,3))
-  return Haux
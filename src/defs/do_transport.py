@@ -46,6 +46,12 @@ def do_transport ( data_controller, temps, ene, velkp, channels, weights, do_hal
       if do_hall:
         fhall = ojf('hall_trace', ispin)
 
+    # All temperatures are evaluated in a single pass over k-points and bands
+    itemps = np.asarray(temps, dtype=float)/temp_conv
+    if attr['smearing'] is not None:
+      L0dk,_,_ = do_Boltz_tensors(data_controller, attr['smearing'], itemps, ene, velkp, ispin, channels, weights)
+    L0T,L1T,L2T = do_Boltz_tensors(data_controller, None, itemps, ene, velkp, ispin, channels, weights)
+
     for iT,temp in enumerate(temps):
 
       itemp = temp/temp_conv
@@ -61,13 +67,12 @@ def do_transport ( data_controller, temps, ene, velkp, channels, weights, do_hal
         gtup_hall = lambda tu,i : (temp,ene[i],tu[i])
 
       if attr['smearing'] is not None:
-        L0,_,_ = do_Boltz_tensors(data_controller, attr['smearing'], itemp, ene, velkp, ispin, channels, weights)
         #----------------------
         # Conductivity (in units of 1.e21/Ohm/m/s)
         #----------------------
         if rank == 0:
           # convert in units of 10*21 siemens m^-1 s^-1
-          L0 *= spin_mult*siemen_conv/attr['omega']
+          L0 = L0dk[iT]*spin_mult*siemen_conv/attr['omega']
           # convert in units of siemens m^-1 s^-1
           sigma = L0*1.e21
 
@@ -78,7 +83,7 @@ def do_transport ( data_controller, temps, ene, velkp, channels, weights, do_hal
 
         comm.Barrier()
 
-      L0,L1,L2 = do_Boltz_tensors(data_controller, None, itemp, ene, velkp, ispin, channels, weights)
+      L0,L1,L2 = (L0T[iT],L1T[iT],L2T[iT]) if rank==0 else (None,None,None)
 
       if do_hall: 
         L0_hall = do_Boltz_tensors_hall(data_controller, None, itemp, ene, velkp, ispin, channels, weights)
@@ -172,6 +177,8 @@ def do_transport ( data_controller, temps, ene, velkp, channels, weights, do_hal
           PF = None
       comm.Barrier()
 
+    L0dk = L0T = L1T = L2T = None
+
     if write_to_file:
       fsigma.close()
       fPF.close()
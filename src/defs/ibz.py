@@ -0,0 +1,218 @@
+#
+# PAOFLOW
+#
+# Copyright 2016-2024 - Marco BUONGIORNO NARDELLI (mbn@unt.edu)
+#
+# Reference:
+#
+# F.T. Cerasoli, A.R. Supka, A. Jayaraj, I. Siloi, M. Costa, J. Slawinska, S. Curtarolo, M. Fornari, D. Ceresoli, and M. Buongiorno Nardelli,
+# Advanced modeling of materials with PAOFLOW 2.0: New features and software design, Comp. Mat. Sci. 200, 110828 (2021).
+#
+# M. Buongiorno Nardelli, F. T. Cerasoli, M. Costa, S Curtarolo,R. De Gennaro, M. Fornari, L. Liyanage, A. Supka and H. Wang,
+# PAOFLOW: A utility to construct and operate on ab initio Hamiltonians from the Projections of electronic wavefunctions on
+# Atomic Orbital bases, including characterization of topological materials, Comp. Mat. Sci. vol. 143, 462 (2018).
+#
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+
+# Irreducible wedge (IBZ) of the interpolated k-point grid. In IBZ mode the k-distributed
+# arrays (E_k, v_k, dHksp, pksp, deltakp, ...) only hold one k-point per star, scattered
+# over the ranks as by scatter_full. Sums over the full grid become sums over the stars
+# weighted by their multiplicities, and rank 2 tensors are averaged over the point group.
+#
+# Arrays:
+#   'ibz_ind'  - Index in the full grid of every irreducible k-point (replicated)
+#   'ibz_mult' - Multiplicity of the local irreducible k-points (distributed)
+#   'ibz_rot'  - Cartesian rotations of the k-space point group (replicated)
+
+import numpy as np
+
+def kspace_symmetries ( data_controller, time_reversal=None ):
+  '''
+  Point group acting on the crystal coordinates of k, restricted to the operations which
+  map the current nk1 x nk2 x nk3 grid onto itself. The rotations are read from the DFT
+  symmetry information ('sym_rot'), and time reversal (k -> -k) is added when requested.
+  By default it is added unless the DFT system is magnetic with spin-orbit coupling.
+  Without symmetry information (e.g. for models) time reversal must be set explicitly,
+  and only the identity and, if requested, time reversal are used.
+
+  Arguments:
+      data_controller (DataController): The DataController
+      time_reversal (bool): Add time reversal to the point group. None to decide from the DFT data
+
+  Returns:
+      symop (ndarray): Integer rotations of the crystal coordinates of k (nsym,3,3)
+  '''
+  from .pao_sym import correct_roundoff
+
+  arrays,attr = data_controller.data_dicts()
+  nk = np.array([attr['nk1'],attr['nk2'],attr['nk3']])
+
+  if time_reversal is None:
+    if 'sym_rot' not in arrays:
+      raise ValueError('No symmetry information to reduce the k-point grid. Set time_reversal explicitly.')
+    time_reversal = not (attr.get('dftMAG',False) and attr.get('dftSO',False))
+
+  symop = np.eye(3)[None]
+  if 'sym_rot' in arrays:
+    symop = correct_roundoff(np.asarray(arrays['sym_rot'], dtype=float))
+    if 'sym_TR' in arrays:
+      symop = np.where(np.asarray(arrays['sym_TR'])[:,None,None], -symop, symop)
+  symop = np.rint(symop).astype(int)
+
+  if time_reversal:
+    symop = np.concatenate((symop,-symop))
+  symop = np.unique(symop, axis=0)
+
+  # An operation maps the grid onto itself if it maps the generators e_b/nk_b onto it,
+  # i.e. if every S_ab*nk_a/nk_b is an integer
+  on_grid = np.all((symop*nk[None,:,None])%nk[None,None,:] == 0, axis=(1,2))
+  return symop[on_grid]
+
+
+def irreducible_kpoints ( symop, nk1, nk2, nk3, chunk=2**14 ):
+  '''
+  Irreducible k-points of the nk1 x nk2 x nk3 grid. The representative of each star is the
+  k-point with the lowest index in the full grid.
+
+  Arguments:
+      symop (ndarray): Integer rotations of the crystal coordinates of k (nsym,3,3), mapping the grid onto itself
+      nk1,nk2,nk3 (int): Dimensions of the grid
+      chunk (int): Number of k-points whose images are held in memory at once
+
+  Returns:
+      ibz_ind (ndarray): Index in the full grid of every irreducible k-point
+      mult (ndarray): Number of k-points in the star of each irreducible k-point
+  '''
+  nk = np.array([nk1,nk2,nk3])
+  nktot = nk1*nk2*nk3
+
+  # Integer coordinates of the grid, images are folded back with a modulo
+  coords = np.stack(np.unravel_index(np.arange(nktot), (nk1,nk2,nk3)), axis=-1)
+  # k'_a = sum_b S_ab k_b, with k_b = i_b/nk_b
+  scale = symop*nk[None,:,None]//nk[None,None,:]
+
+  rep = np.empty(nktot, dtype=int)
+  for ini_k in range(0, nktot, chunk):
+    images = np.einsum('sab,kb->ska', scale, coords[ini_k:ini_k+chunk])%nk
+    rep[ini_k:ini_k+chunk] = np.amin(np.ravel_multi_index(np.moveaxis(images,-1,0), (nk1,nk2,nk3)), axis=0)
+
+  ibz_ind,mult = np.unique(rep, return_counts=True)
+  return ibz_ind, mult
+
+
+def reduce_to_ibz ( data_controller, time_reversal=None ):
+  '''
+  Find the irreducible k-points of the interpolated grid and populate the DataController
+  with 'ibz_ind', 'ibz_mult' and 'ibz_rot'
+
+  Arguments:
+      data_controller (DataController): The DataController
+      time_reversal (bool): Add time reversal to the point group, as in kspace_symmetries
+
+  Returns:
+      None
+  '''
+  from .communication import scatter_indices
+
+  arrays,attr = data_controller.data_dicts()
+
+  symop = kspace_symmetries(data_controller, time_reversal)
+  ibz_ind,mult = irreducible_kpoints(symop, attr['nk1'], attr['nk2'], attr['nk3'])
+
+  # k_cart = k_crys @ b_vectors, so S acts on Cartesian k as b^T S b^-T
+  b = arrays['b_vectors']
+  rot = np.einsum('ia,sab,bj->sij', b.T, symop, np.linalg.inv(b.T))
+
+  arrays['ibz_ind'] = ibz_ind
+  arrays['ibz_mult'] = mult[scatter_indices(ibz_ind.size, attr['npool'], data_controller.rank)].astype(float)
+  arrays['ibz_rot'] = rot
+  attr['ibz'] = True
+  attr['nkibz'] = ibz_ind.size
+
+  if data_controller.rank == 0 and attr['verbose']:
+    print('Irreducible wedge: %d of %d k-points, %d symmetry operations'%(ibz_ind.size,attr['nkpnts'],symop.shape[0]))
+
+
+def ibz_rows ( data_controller, arr ):
+  '''
+  Irreducible k-points of an array distributed over the full grid as by scatter_full
+
+  Arguments:
+      data_controller (DataController): The DataController
+      arr (ndarray): Local block, first axis distributed over the full grid
+
+  Returns:
+      rows (ndarray): Local block of the irreducible k-points, first axis distributed as by scatter_full
+  '''
+  from .communication import fetch_rows,scatter_indices
+
+  arrays,attr = data_controller.data_dicts()
+  ind = arrays['ibz_ind']
+  local = ind[scatter_indices(ind.size, attr['npool'], data_controller.rank)]
+  return fetch_rows(arr, attr['npool'], local)
+
+
+def k_weights ( data_controller ):
+  '''
+  Integration weight of each local k-point, 1/nkpnts on the full grid and the
+  multiplicity over nkpnts for the irreducible k-points
+
+  Arguments:
+      data_controller (DataController): The DataController
+
+  Returns:
+      wght (ndarray): Weight of each local k-point
+  '''
+  arrays,attr = data_controller.data_dicts()
+  if 'ibz_mult' in arrays:
+    return arrays['ibz_mult']/attr['nkpnts']
+  return np.full(arrays['E_k'].shape[0], 1./attr['nkpnts'])
+
+
+def multiplicity_sum ( data_controller, func, *karrays ):
+  '''
+  Sum of func(*karrays) over the local k-points weighted by their multiplicities. The
+  k-points are grouped by multiplicity, so func is called once per distinct value.
+
+  Arguments:
+      data_controller (DataController): The DataController
+      func (callable): Function of the k-point blocks of karrays, returning an additive quantity
+      karrays (ndarray): Arrays with the local k-points on the first axis
+
+  Returns:
+      total: func(*karrays) on the full grid, the weighted sum of the groups in IBZ mode
+  '''
+  arrays = data_controller.data_arrays
+  if 'ibz_mult' not in arrays:
+    return func(*karrays)
+
+  mult = arrays['ibz_mult']
+  groups = np.unique(mult)
+  if groups.size == 0:
+    return func(*karrays)
+
+  total = 0.
+  for m in groups:
+    sel = mult == m
+    total = total + m*func(*[a[sel] for a in karrays])
+  return total
+
+
+def symmetrize_tensor ( T, rot, axis=0 ):
+  '''
+  Average of a rank 2 tensor over the point group, T -> 1/nsym sum_g R_g T R_g^T
+
+  Arguments:
+      T (ndarray): Tensor, with its Cartesian components on axes (axis,axis+1)
+      rot (ndarray): Cartesian rotations (nsym,3,3)
+      axis (int): First Cartesian axis of T
+
+  Returns:
+      T (ndarray): The symmetrized tensor
+  '''
+  Tm = np.moveaxis(T, (axis,axis+1), (0,1))
+  Tm = np.einsum('gia,gjb,ab...->ij...', rot, rot, Tm, optimize=True)/rot.shape[0]
+  return np.moveaxis(Tm, (0,1), (axis,axis+1))
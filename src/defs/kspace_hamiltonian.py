@@ -0,0 +1,120 @@
+#
+# PAOFLOW
+#
+# Copyright 2016-2024 - Marco BUONGIORNO NARDELLI (mbn@unt.edu)
+#
+# Reference:
+#
+# F.T. Cerasoli, A.R. Supka, A. Jayaraj, I. Siloi, M. Costa, J. Slawinska, S. Curtarolo, M. Fornari, D. Ceresoli, and M. Buongiorno Nardelli,
+# Advanced modeling of materials with PAOFLOW 2.0: New features and software design, Comp. Mat. Sci. 200, 110828 (2021).
+#
+# M. Buongiorno Nardelli, F. T. Cerasoli, M. Costa, S Curtarolo,R. De Gennaro, M. Fornari, L. Liyanage, A. Supka and H. Wang,
+# PAOFLOW: A utility to construct and operate on ab initio Hamiltonians from the Projections of electronic wavefunctions on
+# Atomic Orbital bases, including characterization of topological materials, Comp. Mat. Sci. vol. 143, 462 (2018).
+#
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+
+# H(k), dH/dk and d2H/dk2 at arbitrary k-points, from the real space Hamiltonian. Every
+# derivative is the Fourier sum of H(R) times a polynomial in R,
+#   H(k) = sum_R H(R) e^{ik.R},  dH/dk_a = sum_R iR_a H(R) e^{ik.R},  d2H/dk_a dk_b = -sum_R R_a R_b H(R) e^{ik.R}
+# so the phases of a chunk of k-points are stacked with those factors into one matrix, and
+# all the components come out of a single matrix product per spin.
+
+import numpy as np
+
+def derivative_factors ( Rcart, order ):
+  '''
+  Factors of H(R) for each component returned by hamiltonian_k
+
+  Arguments:
+      Rcart (ndarray): Cartesian lattice vectors (nR,3)
+      order (int): 0 for H, 1 adds dH/dk_a, 2 adds d2H/dk_a dk_b
+
+  Returns:
+      fac (ndarray): Factors (nR,ncomp), ordered as 1, iR_a, then -R_a R_b for a <= b
+  '''
+  fac = [np.ones(Rcart.shape[0], dtype=complex)]
+  if order > 0:
+    fac += [1.0j*Rcart[:,a] for a in range(3)]
+  if order > 1:
+    fac += [-Rcart[:,a]*Rcart[:,b] for a in range(3) for b in range(a,3)]
+  return np.stack(fac, axis=1)
+
+
+def hamiltonian_k ( HRs, R, kq, Rcart=None, order=0, mem_budget=256, dense_fill=0.05, nspin=None ):
+  '''
+  H(k) and, optionally, its gradient and Hessian for a list of k-points. The k-points are
+  processed in chunks holding about 'mem_budget' MBytes of phases and results.
+
+  Arguments:
+      HRs (ndarray or csr_matrix): Dense real space Hamiltonian (nawf,nawf,nR,nspin), or
+                                   the truncated hoppings (nR*nspin,nawf*nawf) of truncated_HR
+      R (ndarray): Lattice vectors (nR,3), in the coordinates conjugate to kq (the phase is exp(2pi i k.R))
+      kq (ndarray): k-points (3,nkpi)
+      Rcart (ndarray): Cartesian lattice vectors (nR,3) for the derivatives, in the length unit
+                       of the derivatives. Defaults to 2pi*R
+      order (int): 0 for H(k), 1 for H(k) and dH/dk, 2 for H(k), dH/dk and d2H/dk2
+      mem_budget (float): Memory of the phases and results of a chunk of k-points (MBytes)
+      dense_fill (float): Fraction of nonzero truncated hoppings above which they are multiplied as a dense matrix
+      nspin (int): Number of spins of the truncated hoppings. Defaults to their rows per lattice vector
+
+  Returns:
+      Hks (ndarray): H(k) (nkpi,nawf,nawf,nspin)
+      dHks (ndarray): dH/dk_a (nkpi,3,nawf,nawf,nspin), if order > 0
+      d2Hks (ndarray): d2H/dk_a dk_b (nkpi,3,3,nawf,nawf,nspin), if order > 1
+  '''
+  from scipy import sparse
+
+  nR,nkpi = R.shape[0],kq.shape[1]
+
+  # One (nawf*nawf,nR) operator per spin. Truncated hoppings filling more than
+  # 'dense_fill' of their lattice vectors are faster through dense BLAS products
+  if sparse.issparse(HRs):
+    if nspin is None:
+      if nR == 0:
+        raise ValueError('nspin is required for truncated hoppings without lattice vectors')
+      nspin = HRs.shape[0]//nR
+    nawf = int(round(np.sqrt(HRs.shape[1])))
+    if HRs.nnz >= dense_fill*np.prod(HRs.shape):
+      HRm = [HRs[ispin::nspin].T.toarray() for ispin in range(nspin)]
+    else:
+      HRm = [HRs[ispin::nspin].T.tocsr() for ispin in range(nspin)]
+  else:
+    nawf,nspin = HRs.shape[0],HRs.shape[-1]
+    HRm = [np.reshape(HRs[...,ispin], (nawf*nawf,nR)) for ispin in range(nspin)]
+
+  if Rcart is None:
+    Rcart = 2*np.pi*R
+  fac = derivative_factors(Rcart, order)
+  ncomp = fac.shape[1]
+
+  out = np.empty((nkpi,ncomp,nawf,nawf,nspin), dtype=complex)
+
+  # Stacked phases and results of a k-point take 16*ncomp*(nR+nawf^2*nspin) bytes
+  chunk = max(1, int(mem_budget*1024**2//(16*ncomp*(nR+nawf*nawf*nspin))))
+  for ini_k in range(0, nkpi, chunk):
+    end_k = min(nkpi, ini_k+chunk)
+    kdot = np.exp(2.0j*np.pi*(R @ kq[:,ini_k:end_k]))
+    phases = np.reshape(fac[:,:,None]*kdot[:,None,:], (nR,ncomp*(end_k-ini_k)))
+    for ispin in range(nspin):
+      Hc = np.reshape(HRm[ispin] @ phases, (nawf,nawf,ncomp,end_k-ini_k))
+      out[ini_k:end_k,...,ispin] = np.transpose(Hc, (3,2,0,1))
+
+  if order == 0:
+    return out[:,0]
+
+  if order == 1:
+    return out[:,0], out[:,1:4]
+
+  d2Hks = np.empty((nkpi,3,3,nawf,nawf,nspin), dtype=complex)
+  ic = 4
+  for a in range(3):
+    for b in range(a,3):
+      d2Hks[:,a,b] = out[:,ic]
+      if a != b:
+        d2Hks[:,b,a] = out[:,ic]
+      ic += 1
+  return out[:,0], out[:,1:4], d2Hks
@@ -23,10 +23,10 @@ import scipy.linalg as LA
 from scipy.special import factorial as fac
 from tempfile import NamedTemporaryFile
 import re
-from .communication import scatter_full, gather_full, gather_scatter
+from .communication import scatter_full, gather_full, gather_scatter, fetch_rows, scatter_indices
 from scipy.spatial.distance import cdist
 from mpi4py import MPI
-from .zero_pad import zero_pad
+from .zero_pad import spectral_pad
 import time
 
 comm = MPI.COMM_WORLD
@@ -593,43 +593,68 @@ def mat2eul(R):
 ############################################################################################
 ############################################################################################
 
-def find_equiv_k(kp, symop, full_grid, sym_TR, check=True, include_self=False):
-  # find indices and symops that generate full grid H from wedge H
-  orig_k_ind = []
-  new_k_ind = []
-  si_per_k = []
-  counter = 0
-  kp_track = []
-  kp = correct_roundoff(kp)
+def grid_lookup(full_grid, atol=1.e-6):
+  # integer coordinates of each k on the grid axes, and a dense
+  # table mapping integer coordinates to the index in full_grid
+  axes = []
+  coords = np.zeros(full_grid.shape, dtype=int)
+  for d in range(3):
+    vals = np.sort(full_grid[:, d])
+    # one value per cluster of coordinates closer than atol
+    vals = vals[np.concatenate(([True], np.diff(vals) > atol))]
+    axes.append(vals)
+    coords[:, d] = snap_axis(full_grid[:, d], vals, atol)
 
-  full_grid_mask = np.copy(full_grid)
+  table = -np.ones([a.shape[0] for a in axes], dtype=int)
+  table[coords[:, 0], coords[:, 1], coords[:, 2]] = np.arange(full_grid.shape[0])
+
+  return axes, table
 
-  for isym in range(symop.shape[0]):
-    # transform k -> k' with the sym op
-    if sym_TR[isym]:
-      newk = ((((-symop[isym] @ (kp.T % 1.0)) % 1.0) + 0.5) % 1.0) - 0.5
-    else:
-      newk = ((((symop[isym] @ (kp.T % 1.0)) % 1.0) + 0.5) % 1.0) - 0.5
-    newk = correct_roundoff(newk)
-    newk[np.where(np.isclose(newk, 0.5))] = -0.5
-    newk[np.where(np.isclose(newk, -1.0))] = 0.0
-    newk[np.where(np.isclose(newk, 1.0))] = 0.0
 
-    # find index in the full grid where this k -> k' with this sym op
-    nw = np.where(np.isclose(cdist(newk.T, full_grid_mask), 0.0, atol=1.e-6, rtol=1.e-6, ))
+def snap_axis(x, vals, atol):
+  # index of the closest value of the sorted vals, -1 if further than atol
+  pos = np.searchsorted(vals, x)
+  lo = np.clip(pos - 1, 0, vals.shape[0] - 1)
+  hi = np.clip(pos, 0, vals.shape[0] - 1)
+  pos = np.where(np.abs(x - vals[lo]) <= np.abs(x - vals[hi]), lo, hi)
+  return np.where(np.abs(x - vals[pos]) <= atol, pos, -1)
 
-    if not include_self:
-      full_grid_mask[nw[1]] = np.ma.masked
 
-    new_k_ind.extend(nw[1].tolist())
-    si_per_k.extend([isym] * nw[1].shape[0])
-    orig_k_ind.extend(nw[0].tolist())
+def snap_to_grid(k, axes, table, atol=1.e-6):
+  # index in the full grid of each k (last axis), -1 if k is not on the grid
+  coords = [snap_axis(k[..., d], axes[d], atol) for d in range(3)]
+  on_grid = (coords[0] >= 0) & (coords[1] >= 0) & (coords[2] >= 0)
+  ind = table[tuple(np.where(on_grid, c, 0) for c in coords)]
+  return np.where(on_grid, ind, -1)
 
-  new_k_ind = np.array(new_k_ind)
-  orig_k_ind = np.array(orig_k_ind)
-  si_per_k = np.array(si_per_k)
 
+def equiv_k_images(kp, symop, sym_TR):
+  # k -> k' for every symop at once, folded to [-0.5,0.5), shape (nsym,nk,3)
+  sign = np.where(sym_TR, -1.0, 1.0)[:, None, None]
+  newk = ((((sign * symop) @ (kp.T % 1.0)) % 1.0) + 0.5) % 1.0 - 0.5
+  newk = correct_roundoff(newk)
+  newk[np.where(np.isclose(newk, 0.5))] = -0.5
+  newk[np.where(np.isclose(newk, -1.0))] = 0.0
+  newk[np.where(np.isclose(newk, 1.0))] = 0.0
+
+  return np.moveaxis(newk, 1, 2)
+
+
+def find_equiv_k(kp, symop, full_grid, sym_TR, check=True, include_self=False):
+  # find indices and symops that generate full grid H from wedge H
+  kp = correct_roundoff(kp)
+
+  # index in the full grid where each k -> k' with each sym op
+  axes, table = grid_lookup(full_grid)
+  nw = snap_to_grid(equiv_k_images(kp, symop, sym_TR), axes, table)
+
+  # pairs ordered by symop, then by k in the wedge
+  si_per_k, orig_k_ind = np.nonzero(nw >= 0)
+  new_k_ind = nw[si_per_k, orig_k_ind]
+
+  counter = 0
   if not include_self:
+    # keep the first symop and k which reach each k'
     inds = np.unique(new_k_ind, return_index=True)
 
     new_k_ind = new_k_ind[inds[1]]
@@ -646,12 +671,29 @@ def find_equiv_k(kp, symop, full_grid, sym_TR, check=True, include_self=False):
     print(full_grid[np.setxor1d(new_k_ind, np.arange(full_grid.shape[0]))])
     raise SystemExit
 
-  else:
-    pass
-
   return new_k_ind, orig_k_ind, si_per_k
 
 
+def find_equiv_k_per_k(kp, symop, full_grid, sym_TR):
+  # find_equiv_k(kp[i][None], ..., include_self=True) for every k at once,
+  # stacked as (nk, 3, nsym) when every symop maps each k onto the grid
+  nsym = symop.shape[0]
+  new_k_ind, orig_k_ind, si_per_k = find_equiv_k(np.copy(kp), symop, full_grid, sym_TR, check=False, include_self=True)
+
+  if new_k_ind.shape[0] == nsym * kp.shape[0]:
+    nkl = np.zeros((kp.shape[0], 3, nsym), dtype=int)
+    nkl[:, 0] = new_k_ind.reshape((nsym, kp.shape[0])).T
+    nkl[:, 2] = si_per_k.reshape((nsym, kp.shape[0])).T
+    return nkl
+
+  order = np.argsort(orig_k_ind, kind='stable')
+  splits = np.searchsorted(orig_k_ind[order], np.arange(1, kp.shape[0]))
+  nkl = np.empty((kp.shape[0], 3), dtype=object)
+  for i, o in enumerate(np.split(order, splits)):
+    nkl[i] = [new_k_ind[o], np.zeros(o.shape[0], dtype=int), si_per_k[o]]
+  return nkl
+
+
 ############################################################################################
 ############################################################################################
 ############################################################################################
@@ -700,6 +742,55 @@ def get_U_k(k, shift, a_index, U):
   return U_k
 
 
+############################################################################################
+############################################################################################
+############################################################################################
+
+# maximum number of H(k) rotated together by rotate_H
+rot_chunk = 2048
+
+def rotate_H(H, k, si, U, a_index, phase_shifts, inv_flag, U_inv, sym_TR, spin_orb, reverse=False):
+  # transforms a stack of H(k) with the phase shifted U_k of symop si[j] at k[j].
+  # k points are grouped by symop, so each group is rotated with two matrix products
+  nawf = U.shape[1]
+  THP = np.array(H, dtype=complex)
+
+  for isym in np.unique(si):
+    # if symop is identity
+    if isym == 0:
+      continue
+
+    Us = U[isym] if not reverse else np.conj(U[isym].T)
+    sel = np.nonzero(si == isym)[0]
+    for c in range(0, sel.shape[0], rot_chunk):
+      j = sel[c:c + rot_chunk]
+
+      # U_k = U D with D = diag(phase), so U_k H U_k^dagger = U (D H D^*) U^dagger
+      phase = np.exp(2.0j * np.pi * (k[j] @ phase_shifts[isym][a_index].T))
+      outer = phase[:, :, None] * np.conj(phase[:, None, :])
+
+      # transformated H(k)
+      T = THP[j] if reverse else THP[j] * outer
+      T = np.reshape(np.reshape(T, (-1, nawf)) @ np.conj(Us.T), T.shape)
+      T = np.moveaxis(np.tensordot(Us, T, axes=(1, 1)), 0, 1)
+      if reverse:
+        T *= np.conj(outer)
+
+      # apply inversion operator if needed
+      if inv_flag[isym]:
+        T *= U_inv
+
+      # time inversion is anti-unitary
+      if sym_TR[isym]:
+        if spin_orb:
+          T *= U_inv
+        T = np.conj(T)
+
+      THP[j] = T
+
+  return THP
+
+
 ############################################################################################
 ############################################################################################
 ############################################################################################
@@ -798,6 +889,41 @@ def enforce_t_rev(Hksp_s, nk1, nk2, nk3, spin_orb, U_inv, jchia):
   return Hksp_s
 
 
+def enforce_t_rev_dist(Hksp, nk1, nk2, nk3, spin_orb, U_inv, jchia, npool):
+  # enforce_t_rev on H(k) distributed over k as by scatter_full. Each rank
+  # fetches the H(-k) partners of its own k points from the ranks holding them
+  nk = nk1 * nk2 * nk3
+
+  # the (k,-k) pairs visited by enforce_t_rev, in the same order
+  i, j, k = np.meshgrid(np.arange(int(nk1 / 2) + 1), np.arange(int(nk2 / 2) + 1),
+                        np.arange(int(nk3 / 2) + 1), indexing='ij')
+  p = ((i * nk2 + j) * nk3 + k).ravel()
+  q = ((((nk1 - i) % nk1) * nk2 + (nk2 - j) % nk2) * nk3 + (nk3 - k) % nk3).ravel()
+
+  # source of the new value of each k, -1 if it is left unchanged
+  src = -np.ones(nk, dtype=int)
+  src[q] = p
+  if not spin_orb:
+    src[p] = q
+
+  loc = scatter_indices(nk, npool, rank)
+  src = src[loc]
+  upd = np.nonzero(src >= 0)[0]
+  Hm = fetch_rows(Hksp, npool, src[upd])
+
+  if not spin_orb:
+    # H(k) and H(-k) are averaged with each other's old values,
+    # except for k = -k where the second update sees the first
+    own = src[upd] == loc[upd]
+    Hksp[upd[~own]] = (Hksp[upd[~own]] + np.conj(Hm[~own])) / 2.0
+    Hksp[upd[own]] = Hksp[upd[own]] / 4.0 + 3.0 * np.conj(Hm[own]) / 4.0
+  else:
+    U_TR = get_U_TR(jchia)
+    Hksp[upd] = np.conj(U_inv * (U_TR @ Hm @ np.conj(U_TR.T)))
+
+  return Hksp
+
+
 ############################################################################################
 ############################################################################################
 ############################################################################################
@@ -839,8 +965,7 @@ def apply_t_rev(Hksp, kp, spin_orb, U_inv, jchia):
 
 def enforce_hermaticity(Hksp):
   # enforce H(k) to be hermitian (it should be already)
-  for k in range(Hksp.shape[0]):
-    Hksp[k] = (Hksp[k] + np.conj(Hksp[k].T)) / 2.0
+  Hksp[:] = (Hksp + np.conj(np.swapaxes(Hksp, 1, 2))) / 2.0
 
   return Hksp
 
@@ -863,8 +988,9 @@ def add_U_wyc(U, U_wyc):
 ############################################################################################
 
 def wedge_to_grid(Hksp, U, a_index, phase_shifts, kp, new_k_ind, orig_k_ind, si_per_k, inv_flag, U_inv, sym_TR,
-                  spin_orb, npool):
+                  spin_orb, npool, gather=True):
   # generates full grid from k points in IBZ
+  # (gathered on rank 0, or distributed over k as by scatter_full if not gather)
   nawf = Hksp.shape[1]
 
   fgm = scatter_full(np.arange(si_per_k.shape[0], dtype=int), npool)
@@ -874,46 +1000,20 @@ def wedge_to_grid(Hksp, U, a_index, phase_shifts, kp, new_k_ind, orig_k_ind, si_
 
   Hksp_s = np.zeros((new_k_ind.shape[0], nawf, nawf), dtype=complex)
 
-  for j in range(new_k_ind.shape[0]):
-    isym = si_per_k[j]
-    oki = orig_k_ind[j]
-    nki = np.where(new_k_ind[j] == fgm)[0]
-
-    # if symop is identity
-    if isym == 0:
-      Hksp_s[nki] = Hksp[oki]
-      continue
-
-    # other cases
-    H = Hksp[oki]
-
-    # get k dependent U
-    U_k = get_U_k(kp[oki], phase_shifts[isym], a_index, U[isym])
-
-    # transformated H(k)
-    THP = U_k @ H @ np.conj(U_k.T)
-
-    # apply inversion operator if needed
-    if inv_flag[isym]:
-      THP *= U_inv
-
-    # time inversion is anti-unitary
-    # old version
-    # if sym_TR[isym]:
-    #    THP *= U_inv
-    #    THP = np.conj(THP)
-    if sym_TR[isym]:
-      if spin_orb:
-        THP *= U_inv
-      THP = np.conj(THP)
+  # position of each k' among the k points of this rank
+  nki = np.clip(np.searchsorted(fgm, new_k_ind), 0, max(fgm.shape[0] - 1, 0))
+  found = np.nonzero(fgm[nki] == new_k_ind)[0] if fgm.shape[0] else nki[:0]
 
-    Hksp_s[nki] = THP
+  # transform H(k) -> H(k')
+  Hksp_s[nki[found]] = rotate_H(Hksp[orig_k_ind[found]], kp[orig_k_ind[found]], si_per_k[found], U, a_index,
+                                phase_shifts, inv_flag, U_inv, sym_TR, spin_orb)
 
   # make sure of hermiticity of each H(k)
   Hksp_s = enforce_hermaticity(Hksp_s)
 
   Hksp = None
-  Hksp_s = gather_full(Hksp_s, npool)
+  if gather:
+    Hksp_s = gather_full(Hksp_s, npool)
 
   return Hksp_s
 
@@ -967,19 +1067,13 @@ def open_grid(Hksp, full_grid, kp, symop, symop_cart, atom_pos, shells, a_index,
   # and index of symop that transforms k to k'
   new_k_ind, orig_k_ind, si_per_k = find_equiv_k(kp, symop, full_grid, sym_TR, check=True)
 
-  # transform H(k) -> H(k')
+  # transform H(k) -> H(k'), distributed over k
   Hksp = wedge_to_grid(Hksp, U, a_index, phase_shifts, kp,
-                       new_k_ind, orig_k_ind, si_per_k, inv_flag, U_inv, sym_TR, spin_orb, npool)
+                       new_k_ind, orig_k_ind, si_per_k, inv_flag, U_inv, sym_TR, spin_orb, npool, gather=False)
 
-  if rank == 0:
-    # enforce time reversion where appropriate
-    if not (spin_orb and mag_calc):
-      Hksp = enforce_t_rev(Hksp, nk1, nk2, nk3, spin_orb, U_inv, jchia)
-
-  else:
-    Hksp = np.zeros((full_grid.shape[0], nawf, nawf), dtype=complex)
-
-  comm.Bcast(Hksp)
+  # enforce time reversion where appropriate
+  if not (spin_orb and mag_calc):
+    Hksp = enforce_t_rev_dist(Hksp, nk1, nk2, nk3, spin_orb, U_inv, jchia, npool)
 
   if symm_grid:
 
@@ -987,11 +1081,8 @@ def open_grid(Hksp, full_grid, kp, symop, symop_cart, atom_pos, shells, a_index,
     for i in range(symop.shape[0]):
       symop_inv[i] = LA.inv(symop[i])
 
-    nkl = []
     partial_grid = scatter_full(full_grid, npool)
-    for i in range(partial_grid.shape[0]):
-      nkl.append(find_equiv_k(partial_grid[i][None], symop_inv, full_grid, sym_TR, check=False, include_self=True))
-    nkl_no_interp = np.array(nkl)
+    nkl_no_interp = find_equiv_k_per_k(partial_grid, symop_inv, full_grid, sym_TR)
     Hksp, tmax = symmetrize_grid(Hksp, U, a_index, phase_shifts, inv_flag, U_inv, sym_TR,
                                  full_grid, jchia, spin_orb, mag_calc, nk1, nk2, nk3,
                                  nkl_no_interp, partial_grid, npool)
@@ -1004,12 +1095,8 @@ def open_grid(Hksp, full_grid, kp, symop, symop_cart, atom_pos, shells, a_index,
     nfft3 = nk3 + upscale3
 
     full_grid_interp = get_full_grid(nfft1, nfft2, nfft3, o1, o2, o3)
-    nkl = []
     partial_grid_interp = scatter_full(full_grid_interp, npool)
-    for i in range(partial_grid_interp.shape[0]):
-      nkl.append(
-        find_equiv_k(partial_grid_interp[i][None], symop_inv, full_grid_interp, sym_TR, check=False, include_self=True))
-    nkl_interp = np.array(nkl)
+    nkl_interp = find_equiv_k_per_k(partial_grid_interp, symop_inv, full_grid_interp, sym_TR)
     # max difference bewtween H(k) and H(k*)
     tmax = 999999
 
@@ -1023,73 +1110,24 @@ def open_grid(Hksp, full_grid, kp, symop, symop_cart, atom_pos, shells, a_index,
       nfft2 = nk2 + add2
       nfft3 = nk3 + add3
 
-      if rank == 0:
-        Hksp = np.reshape(Hksp, (nk1 * nk2 * nk3, nawf * nawf))
-        Hksp = np.ascontiguousarray(Hksp.T)
+      # padded spectra, reused by the pools of matrix elements of the same size
+      pad_buffer = {}
 
-      Hksp = scatter_full(Hksp, npool)
+      def resample(Hm):
+        # Fourier interpolation of matrix elements from the nk to the nfft grid
+        HRs = np.fft.ifftn(np.reshape(Hm, (Hm.shape[0], nk1, nk2, nk3)), axes=(1, 2, 3))
+        if Hm.shape[0] not in pad_buffer:
+          pad_buffer[Hm.shape[0]] = np.empty((Hm.shape[0], nfft1, nfft2, nfft3), dtype=complex)
+        Hf = np.fft.fftn(spectral_pad(HRs, (nfft1, nfft2, nfft3), out=pad_buffer[Hm.shape[0]]), axes=(1, 2, 3))
+        return np.reshape(Hf, (Hm.shape[0], nfft1 * nfft2 * nfft3))
 
-      Hksp = np.reshape(Hksp, (Hksp.shape[0], nk1, nk2, nk3))
-      HRs = np.fft.ifftn(Hksp, axes=(1, 2, 3))
-
-      switch = True
-      if switch == True:
-
-        Hksp = None
-        Hksp = np.zeros((HRs.shape[0], nfft1, nfft2, nfft3), dtype=complex)
-
-        for m in range(Hksp.shape[0]):
-          Hksp[m, :, :, :] = np.fft.fftn(zero_pad(HRs[m, :, :, :], nk1, nk2, nk3, add1, add2, add3))
-        #                     if not i%2:
-        #                         Hksp[m,:,:,:]=np.fft.fftn(zero_pad(HRs[m,:,:,:],nk1,nk2,nk3,add1,add2,add3))
-        #                     else:
-        # #                        Hksp[m,:,:,:]=np.fft.fftn(LPF(HRs[m,:,:,:],nk1,nk2,nk3,add1,add2,add3))
-        #                         Hksp[m,:,:,:]=np.fft.fftn(down_samp(HRs[m,:,:,:],nk1,nk2,nk3,add1,add2,add3))
-
-        HRs = None
-        Hksp = np.reshape(Hksp, (Hksp.shape[0], nfft1 * nfft2 * nfft3))
-        Hksp = gather_full(Hksp, npool)
-
-        if rank == 0:
-          Hksp = np.ascontiguousarray(Hksp.T)
-          Hksp = np.reshape(Hksp, (nfft1 * nfft2 * nfft3, nawf, nawf))
-        else:
-          Hksp = np.zeros((nfft1 * nfft2 * nfft3, nawf, nawf), dtype=complex)
+      # k-wise -> orbital-wise, for the Fourier interpolation of each matrix element
+      Hksp = gather_scatter(np.reshape(Hksp, (Hksp.shape[0], nawf * nawf)), 1, npool)
+      Hksp = np.ascontiguousarray(Hksp.T)
 
-        comm.Bcast(Hksp)
-
-        # Hksp=None
-        # Hksp=np.zeros((HRs.shape[0],nfft1,nfft2,nfft3),dtype=complex)
-
-        # for m in range(Hksp.shape[0]):
-        #     Hksp[m,:,:,:]=np.fft.fftn(zero_pad(HRs[m,:,:,:],nk1,nk2,nk3,add1,add2,add3))
-
-        # HRs  = None
-        # Hksp = np.reshape(Hksp,(Hksp.shape[0],nfft1*nfft2*nfft3))
-        # Hksp = gather_full(Hksp,npool)
-        # if rank==0:
-        #     Hksp = np.ascontiguousarray(Hksp.T)
-        #     Hksp = np.reshape(Hksp,(nfft1*nfft2*nfft3,nawf,nawf))
-        # else:
-        #     Hksp=np.zeros((nfft1*nfft2*nfft3,nawf,nawf),dtype=complex)
-        # comm.Bcast(Hksp)
-
-      else:
-        HRs = np.zeros((Hksp.shape[0], nfft1, nfft2, nfft3), dtype=complex)
-        for m in range(Hksp.shape[0]):
-          HRs[m, :, :, :] = zero_pad(Hksp[m, :, :, :], nk1, nk2, nk3, add1, add2, add3)
-        Hksp = None
-        Hksp = np.fft.fftn(HRs, axes=(1, 2, 3))
-        HRs = None
-        Hksp = np.reshape(Hksp, (Hksp.shape[0], nfft1 * nfft2 * nfft3))
-        Hksp = gather_scatter(Hksp, 1, npool)
-        Hksp = np.ascontiguousarray(Hksp.T)
-        Hksp = gather_full(Hksp, npool)
-        if rank == 0:
-          Hksp = np.reshape(Hksp, (nfft1 * nfft2 * nfft3, nawf, nawf))
-          print(Hksp[0, :8, :8].real)
-
-        Hksp = np.reshape(Hksp, (nfft1 * nfft2 * nfft3, nawf, nawf))
+      # orbital-wise -> k-wise on the new grid, interpolating each pool of elements
+      Hksp = gather_scatter(Hksp, 1, npool, func=resample)
+      Hksp = np.reshape(np.ascontiguousarray(Hksp.T), (-1, nawf, nawf))
 
       # if it's the non interpolated grid
       if i % 2:
@@ -1115,6 +1153,9 @@ def open_grid(Hksp, full_grid, kp, symop, symop_cart, atom_pos, shells, a_index,
         if i % 2 and i >= 3:
           break
 
+  # full grid on rank 0
+  Hksp = gather_full(Hksp, npool)
+
   # for debugging purposes
   # try:
   #    if rank==0:
@@ -1202,11 +1243,8 @@ def open_grid_nspin2(Hksp, full_grid, kp, symop, symop_cart, atom_pos, shells, a
     for i in range(symop.shape[0]):
       symop_inv[i] = LA.inv(symop[i])
 
-    nkl = []
     partial_grid = scatter_full(full_grid, npool)
-    for i in range(partial_grid.shape[0]):
-      nkl.append(find_equiv_k(partial_grid[i][None], symop_inv, full_grid, sym_TR, check=False, include_self=True))
-    nkl_no_interp = np.array(nkl)
+    nkl_no_interp = find_equiv_k_per_k(partial_grid, symop_inv, full_grid, sym_TR)
 
     Hksp, tmax = symmetrize_grid_nspin2(Hksp, U, a_index, phase_shifts, inv_flag, U_inv, sym_TR,
                                    full_grid, nk1, nk2, nk3,
@@ -1220,12 +1258,8 @@ def open_grid_nspin2(Hksp, full_grid, kp, symop, symop_cart, atom_pos, shells, a
     nfft3 = nk3 + upscale3
 
     full_grid_interp = get_full_grid(nfft1, nfft2, nfft3, o1, o2, o3)
-    nkl = []
     partial_grid_interp = scatter_full(full_grid_interp, npool)
-    for i in range(partial_grid_interp.shape[0]):
-      nkl.append(
-        find_equiv_k(partial_grid_interp[i][None], symop_inv, full_grid_interp, sym_TR, check=False, include_self=True))
-    nkl_interp = np.array(nkl)
+    nkl_interp = find_equiv_k_per_k(partial_grid_interp, symop_inv, full_grid_interp, sym_TR)
     # max difference bewtween H(k) and H(k*)
     tmax = [999999,999999]
 
@@ -1249,11 +1283,7 @@ def open_grid_nspin2(Hksp, full_grid, kp, symop, symop_cart, atom_pos, shells, a
       HRs = np.fft.ifftn(Hksp, axes=(1, 2, 3))
 
       Hksp = None
-      Hksp = np.zeros((HRs.shape[0], nfft1, nfft2, nfft3, 2), dtype=complex)
-
-      for m in range(Hksp.shape[0]):
-        Hksp[m, :, :, :, 0] = np.fft.fftn(zero_pad(HRs[m, :, :, :, 0], nk1, nk2, nk3, add1, add2, add3))
-        Hksp[m, :, :, :, 1] = np.fft.fftn(zero_pad(HRs[m, :, :, :, 1], nk1, nk2, nk3, add1, add2, add3))
+      Hksp = np.fft.fftn(spectral_pad(HRs, (nfft1, nfft2, nfft3)), axes=(1, 2, 3))
 
       HRs = None
       Hksp = np.reshape(Hksp, (Hksp.shape[0], nfft1 * nfft2 * nfft3, 2))
@@ -1415,7 +1445,8 @@ def open_grid_wrapper(data_controller):
                      shells, a_index, equiv_atom,
                      nk1, nk2, nk3, o1, o2, o3, spin_orb, sym_TR, jchia, mag_calc,
                      symm_grid, thresh, max_iter, verbose, npool)
-    Hks_full = Hks_full[...,np.newaxis]
+    if rank == 0:
+      Hks_full = Hks_full[...,np.newaxis]
   else:
     Hks_full = open_grid_nspin2(Hksp, full_grid, kp_red, symop, symop_cart, atom_pos,
                          shells, a_index, equiv_atom,
@@ -1440,48 +1471,8 @@ def open_grid_wrapper(data_controller):
 def symmetrize(Hksp, U, a_index, phase_shifts, new_k_ind, orig_k_ind, si_per_k, inv_flag, U_inv, sym_TR, spin_orb,
                full_grid, reverse=False):
   # generates full grid from k points in IBZ
-  nawf = Hksp.shape[1]
-  Hksp_s = np.zeros((new_k_ind.shape[0], nawf, nawf), dtype=complex)
-
-  for j in range(new_k_ind.shape[0]):
-    isym = si_per_k[j]
-    oki = orig_k_ind[j]
-    nki = new_k_ind[j]
-
-    # if symop is identity
-    if isym == 0:
-      Hksp_s[j] = Hksp[nki]
-      continue
-
-    # other cases
-    H = Hksp[nki]
-
-    # get k dependent U
-    U_k = get_U_k(full_grid[nki], phase_shifts[isym], a_index, U[isym])
-
-    # transformated H(k)
-    if not reverse:
-      THP = U_k @ H @ np.conj(U_k.T)
-    else:
-      THP = np.conj(U_k.T) @ H @ U_k
-
-    # apply inversion operator if needed
-    if inv_flag[isym]:
-      THP *= U_inv
-
-    # time inversion is anti-unitary
-    # old version
-    # if sym_TR[isym]:
-    #    THP *= U_inv
-    #    THP = np.conj(THP)
-    if sym_TR[isym]:
-      if spin_orb:
-        THP *= U_inv
-      THP = np.conj(THP)
-
-    Hksp_s[j] = THP
-
-  return Hksp_s
+  return rotate_H(Hksp[new_k_ind], full_grid[new_k_ind], si_per_k, U, a_index, phase_shifts,
+                  inv_flag, U_inv, sym_TR, spin_orb, reverse=reverse)
 
 
 ############################################################################################
@@ -1490,36 +1481,43 @@ def symmetrize(Hksp, U, a_index, phase_shifts, new_k_ind, orig_k_ind, si_per_k,
 
 def symmetrize_grid(Hksp, U, a_index, phase_shifts, inv_flag, U_inv, sym_TR, full_grid, jchia, spin_orb,
                     mag_calc, nk1, nk2, nk3, nkl, partial_grid, npool):
-  max_iter = 1
-  tmax = []
+  # averages H(k) over the symmetry images of k. Hksp and partial_grid are distributed
+  # over k as by scatter_full, the images are fetched from the ranks holding them
+  tmax = [0.]
   Hksp_d = np.zeros((partial_grid.shape[0], Hksp.shape[1], Hksp.shape[2]), dtype=complex)
 
-  for i in range(partial_grid.shape[0]):
-    new_k_ind, orig_k_ind, si_per_k = nkl[i]
+  # images of blocks of k are fetched and rotated together,
+  # every rank takes part in the same number of fetches
+  nimg = np.array([len(nkl[i][0]) for i in range(partial_grid.shape[0])], dtype=int)
+  nb = max(1, rot_chunk // max(1, comm.allreduce(int(np.amax(nimg, initial=0)), op=MPI.MAX)))
+  nblocks = comm.allreduce(-(-partial_grid.shape[0] // nb), op=MPI.MAX)
+
+  for c in range(0, nblocks * nb, nb):
+    block = range(c, min(c + nb, partial_grid.shape[0]))
+    new_k_ind = np.concatenate([nkl[i][0] for i in block] + [[]]).astype(int)
+    si_per_k = np.concatenate([nkl[i][2] for i in block] + [[]]).astype(int)
+    temp = fetch_rows(Hksp, npool, new_k_ind)
+    if len(block) == 0:
+      continue
 
-    temp = symmetrize(Hksp, U, a_index, phase_shifts, new_k_ind,
-                      orig_k_ind, si_per_k, inv_flag, U_inv, sym_TR, spin_orb, full_grid)
+    temp = rotate_H(temp, full_grid[new_k_ind], si_per_k, U, a_index, phase_shifts,
+                    inv_flag, U_inv, sym_TR, spin_orb)
 
-    tmax.append(np.amax(np.abs(temp[0][None] - temp)))
-    Hksp_d[i] = np.sum(temp, axis=0) / (temp.shape[0])
+    # first image of each k, and average over its images
+    first = np.r_[0, np.cumsum(nimg[block])[:-1]]
+    diff = np.amax(np.abs(temp - np.repeat(temp[first], nimg[block], axis=0)), axis=(1, 2))
+    tmax.append(np.amax(diff))
+    Hksp_d[block.start:block.stop] = np.add.reduceat(temp, first, axis=0) / nimg[block][:, None, None]
 
   # make sure of hermiticity of each H(k)
   Hksp_d = enforce_hermaticity(Hksp_d)
 
-  if rank == 0:
-    Hksp = gather_full(Hksp_d, npool)
-    if not (spin_orb and mag_calc):
-      Hksp = enforce_t_rev(Hksp, nk1, nk2, nk3, spin_orb, U_inv, jchia)
-
-  else:
-    gather_full(Hksp_d, npool)
+  if not (spin_orb and mag_calc):
+    Hksp_d = enforce_t_rev_dist(Hksp_d, nk1, nk2, nk3, spin_orb, U_inv, jchia, npool)
 
-  tm = np.array([np.amax(tmax)])
-  tmax = np.copy(tm)
-  comm.Reduce(tm, tmax, op=MPI.MAX)
-  comm.Bcast(tmax)
+  tmax = np.array([comm.allreduce(np.amax(tmax), op=MPI.MAX)])
 
-  return Hksp, tmax
+  return Hksp_d, tmax
 
 def symmetrize_grid_nspin2(Hksp, U, a_index, phase_shifts, inv_flag, U_inv, sym_TR, full_grid,
                      nk1, nk2, nk3, nkl, partial_grid, npool):
@@ -33,8 +33,7 @@ def perturb_split(rot_op1,rot_op2,v_k,degen,return_v_k=False):
     
     for i in range(len(degen)):
         # degenerate subspace indices upper and lower lim
-        ll = degen[i][0]
-        ul = degen[i][-1]+1
+        ll,ul = degen[i]
 
         # diagonalize in degenerate subspace
         vals,weight = LAN.eigh(op1[ll:ul,ll:ul])
@@ -51,3 +50,67 @@ def perturb_split(rot_op1,rot_op2,v_k,degen,return_v_k=False):
       return(op1, op2, v_k_temp)
     else:
       return(op1, op2)
+
+
+def perturb_split_batch(ops,v_k,degen,ref=0,return_v_k=False):
+    '''
+    Rotate a stack of operators into the eigenbasis of every k-point at once
+
+    Inside each degenerate subspace the eigenvectors are rotated so that the reference
+    operator ops[:,ref] becomes diagonal, as done by perturb_split. The subspace rotation
+    is computed once per subspace and applied to every operator of the stack. Subspaces of
+    equal dimension are diagonalized together with stacked LAPACK calls.
+
+    Arguments:
+        ops (ndarray): Operators with shape (nk,nop,nawf,nawf)
+        v_k (ndarray): Eigenvectors stored in columns, shape (nk,nawf,nawf)
+        degen (tuple): Degenerate subspaces of this spin as (offsets, bands), with offsets of shape (nk+1,) (see get_degeneracies)
+        ref (int or None): Index of the operator which lifts the degeneracies. If None each operator is split in its own subspace basis
+        return_v_k (bool): If True also return the rotated eigenvectors (requires ref)
+
+    Returns:
+        rops (ndarray): Rotated operators with shape (nk,nop,nawf,nawf)
+        v_k (ndarray): Rotated eigenvectors (only if return_v_k)
+    '''
+    import numpy as np
+
+    offsets,bands = degen
+
+    v_kH = np.conj(np.swapaxes(v_k,1,2))
+    rops = v_kH[:,None] @ ops @ v_k[:,None]
+
+    if return_v_k:
+      v_k = np.copy(v_k)
+
+    bands = bands[offsets[0]:offsets[-1]]
+    if bands.shape[0] == 0:
+      return (rops, v_k) if return_v_k else rops
+
+    # k-point index and dimension of every degenerate subspace
+    kg = np.repeat(np.arange(offsets.size-1), np.diff(offsets))
+    dim = bands[:,1] - bands[:,0]
+
+    nop = rops.shape[1]
+    iops = range(nop) if ref is None else [ref]
+
+    for m in np.unique(dim):
+        sel = np.where(dim==m)[0]
+        ks = kg[sel][:,None]
+        rows = bands[sel,0][:,None] + np.arange(m)[None,:]
+
+        for iop in iops:
+            # diagonalize the operator in each degenerate subspace
+            blocks = rops[ks[:,:,None],iop,rows[:,:,None],rows[:,None,:]]
+            _,weight = np.linalg.eigh(blocks)
+            weightH = np.conj(np.swapaxes(weight,1,2))
+
+            # apply the subspace rotation to the operators which share it
+            for jop in (range(nop) if ref is not None else [iop]):
+                rop = rops[:,jop]
+                rop[ks,rows,:] = weightH @ rop[ks,rows,:]
+                rop[ks,:,rows] = np.einsum('gab,gan->gbn', weight, rop[ks,:,rows])
+
+            if return_v_k:
+                v_k[ks,:,rows] = np.einsum('gab,gan->gbn', weight, v_k[ks,:,rows])
+
+    return (rops, v_k) if return_v_k else rops
@@ -0,0 +1,155 @@
+#
+# PAOFLOW
+#
+# Copyright 2016-2024 - Marco BUONGIORNO NARDELLI (mbn@unt.edu)
+#
+# Reference:
+#
+# F.T. Cerasoli, A.R. Supka, A. Jayaraj, I. Siloi, M. Costa, J. Slawinska, S. Curtarolo, M. Fornari, D. Ceresoli, and M. Buongiorno Nardelli,
+# Advanced modeling of materials with PAOFLOW 2.0: New features and software design, Comp. Mat. Sci. 200, 110828 (2021).
+#
+# M. Buongiorno Nardelli, F. T. Cerasoli, M. Costa, S Curtarolo,R. De Gennaro, M. Fornari, L. Liyanage, A. Supka and H. Wang,
+# PAOFLOW: A utility to construct and operate on ab initio Hamiltonians from the Projections of electronic wavefunctions on
+# Atomic Orbital bases, including characterization of topological materials, Comp. Mat. Sci. vol. 143, 462 (2018).
+#
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+
+# Truncated real space Hamiltonian. The hoppings of HRs are attached to the Wigner-Seitz
+# lattice vectors of the nk1 x nk2 x nk3 supercell, with the weight 1/ndeg of vectors shared
+# by ndeg equidistant images, and only the (R,i,j) entries above a magnitude threshold and
+# within a distance cutoff are kept. H(k) at arbitrary k is then a sparse sum over the kept
+# entries, costing O(nnz) per k-point instead of O(nawf^2*nR).
+#
+# Truncation is enabled by the attributes 'sparse_HR_threshold' and 'sparse_HR_rcut', set by
+# PAOFLOW.sparse_hamiltonian. The compact list is rebuilt from the current HRs by every
+# module using it, so it always follows the changes of the Hamiltonian.
+
+import numpy as np
+
+def wigner_seitz_R ( a_vectors, nr1, nr2, nr3, search=2 ):
+  '''
+  Wigner-Seitz lattice vectors of the nr1 x nr2 x nr3 supercell. Each point of the R grid
+  is mapped to its shortest images, modulo the supercell, with weight 1/ndeg when ndeg
+  images are equidistant.
+
+  Arguments:
+      a_vectors (ndarray): Primitive lattice vectors (3,3)
+      nr1,nr2,nr3 (int): Dimensions of the R grid
+      search (int): Supercells searched for images in each direction
+
+  Returns:
+      irvec (ndarray): Integer lattice vectors, in crystal coordinates (nws,3)
+      ind (ndarray): Index of each vector on the flattened R grid (nws)
+      wght (ndarray): Degeneracy weight of each vector (nws)
+  '''
+  nr = np.array([nr1,nr2,nr3])
+  nrtot = nr1*nr2*nr3
+
+  grid = np.stack(np.unravel_index(np.arange(nrtot), (nr1,nr2,nr3)), axis=-1)
+  shifts = np.stack(np.meshgrid(*[np.arange(-search,search+1)]*3, indexing='ij'), axis=-1).reshape(-1,3)*nr
+
+  # Squared lengths of every image, with the metric of the lattice
+  images = grid[:,None,:] + shifts[None,:,:]
+  metric = a_vectors @ a_vectors.T
+  dist = np.einsum('nsa,ab,nsb->ns', images, metric, images)
+
+  dmin = np.amin(dist, axis=1)
+  shortest = dist <= dmin[:,None]*(1.+1.e-8) + 1.e-12
+  ndeg = np.sum(shortest, axis=1)
+
+  ind,ish = np.nonzero(shortest)
+  return images[ind,ish], ind, 1./ndeg[ind]
+
+
+def truncated_HR ( data_controller, threshold=None, rcut=None, report=False ):
+  '''
+  Sparse list of the Wigner-Seitz hoppings of HRs above 'threshold' and within 'rcut'
+
+  Arguments:
+      data_controller (DataController): The DataController
+      threshold (float): Smallest |H_ij(R)| kept (eV). Defaults to attr['sparse_HR_threshold']
+      rcut (float): Longest |R| kept (Angstrom), None for no cutoff. Defaults to attr['sparse_HR_rcut']
+      report (bool): If True rank 0 prints the size of the list and the truncation error
+
+  Returns:
+      irvec (ndarray): Lattice vectors with at least one kept entry, in crystal coordinates (nR,3)
+      HRsp (csr_matrix): Kept hoppings (nR*nspin,nawf*nawf), with rows ordered as (R,ispin) and columns as (i,j)
+      error (float): Upper bound of ||H(k)-H_sparse(k)||_2 over all k (eV)
+  '''
+  from scipy import sparse
+  from .constants import ANGSTROM_AU
+
+  arrays,attr = data_controller.data_dicts()
+
+  if threshold is None:
+    threshold = attr.get('sparse_HR_threshold', 0.)
+  if rcut is None:
+    rcut = attr.get('sparse_HR_rcut', None)
+
+  nawf,_,nk1,nk2,nk3,nspin = arrays['HRs'].shape
+  irvec,ind,wght = wigner_seitz_R(arrays['a_vectors'], nk1, nk2, nk3)
+
+  # (nws,nawf*nawf,nspin), each grid vector spread over its degenerate images
+  HRs = np.moveaxis(np.reshape(arrays['HRs'], (nawf*nawf,nk1*nk2*nk3,nspin)), 1, 0)
+  HRws = HRs[ind]*wght[:,None,None]
+
+  keep = np.amax(np.abs(HRws), axis=2) >= threshold
+  if rcut is not None:
+    Rcart = irvec @ arrays['a_vectors']*attr['alat']/ANGSTROM_AU
+    keep &= (np.linalg.norm(Rcart, axis=1) <= rcut)[:,None]
+
+  # ||dH(k)||_2 <= ||dH(k)||_F <= sqrt(sum_ij (sum_R |dH_ij(R)|)^2)
+  dropped = np.sum(np.where(keep[:,:,None], 0., np.abs(HRws)), axis=0)
+  error = np.amax(np.sqrt(np.sum(dropped**2, axis=0)))
+
+  rows = np.flatnonzero(np.any(keep, axis=1))
+  irvec,HRws,keep = irvec[rows],HRws[rows],keep[rows]
+  if rows.size == 0:
+    raise ValueError('Sparse HR: no hopping kept with threshold %g eV and rcut %s Angstrom'%(threshold,rcut))
+  r,ij = np.nonzero(keep)
+  srows = (r[:,None]*nspin + np.arange(nspin)[None,:]).ravel()
+  HRsp = sparse.csr_matrix((HRws[r,ij].ravel(), (srows, np.repeat(ij,nspin))), shape=(rows.size*nspin,nawf*nawf))
+
+  if report and data_controller.rank == 0:
+    nnz = np.count_nonzero(HRws[r,ij])
+    print('Sparse HR: %d of %d entries on %d of %d lattice vectors'%(nnz,wght.size*nawf*nawf*nspin,rows.size,wght.size))
+    print('Sparse HR: truncation error bound %.3e eV'%error)
+
+  return irvec, HRsp, error
+
+
+def sparse_Hk ( irvec, HRsp, kq, nspin ):
+  '''
+  H(k) at arbitrary k-points from the truncated hoppings
+
+  Arguments:
+      irvec (ndarray): Lattice vectors, in crystal coordinates (nR,3)
+      HRsp (csr_matrix): Hoppings (nR*nspin,nawf*nawf), as returned by truncated_HR
+      kq (ndarray): k-points in crystal coordinates (3,nkpi)
+      nspin (int): Number of spins
+
+  Returns:
+      Hks (ndarray): Hamiltonian at each k-point (nawf,nawf,nkpi,nspin)
+  '''
+  from .kspace_hamiltonian import hamiltonian_k
+  return np.moveaxis(hamiltonian_k(HRsp, irvec, kq, nspin=nspin), 0, 2)
+
+
+def sparse_band_loop_H ( data_controller, kq ):
+  '''
+  Truncated counterpart of band_loop_H, for k-points in Cartesian coordinates (2pi/alat)
+
+  Arguments:
+      data_controller (DataController): The DataController
+      kq (ndarray): k-points in Cartesian coordinates (3,nkpi)
+
+  Returns:
+      Hks (ndarray): Hamiltonian at each k-point (nawf,nawf,nkpi,nspin)
+  '''
+  arrays = data_controller.data_arrays
+  irvec,HRsp,_ = truncated_HR(data_controller)
+  # k_crys_i = a_i . k_cart, since a_i . b_j = delta_ij
+  return sparse_Hk(irvec, HRsp, arrays['a_vectors'] @ kq, arrays['HRs'].shape[-1])
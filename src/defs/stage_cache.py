@@ -0,0 +1,197 @@
+#
+# PAOFLOW
+#
+# Copyright 2016-2024 - Marco BUONGIORNO NARDELLI (mbn@unt.edu)
+#
+# Reference:
+#
+# F.T. Cerasoli, A.R. Supka, A. Jayaraj, I. Siloi, M. Costa, J. Slawinska, S. Curtarolo, M. Fornari, D. Ceresoli, and M. Buongiorno Nardelli,
+# Advanced modeling of materials with PAOFLOW 2.0: New features and software design, Comp. Mat. Sci. 200, 110828 (2021).
+#
+# M. Buongiorno Nardelli, F. T. Cerasoli, M. Costa, S Curtarolo,R. De Gennaro, M. Fornari, L. Liyanage, A. Supka and H. Wang,
+# PAOFLOW: A utility to construct and operate on ab initio Hamiltonians from the Projections of electronic wavefunctions on
+# Atomic Orbital bases, including characterization of topological materials, Comp. Mat. Sci. vol. 143, 462 (2018).
+#
+# This file is distributed under the terms of the
+# GNU General Public License. See the file `License'
+# in the root directory of the present distribution,
+# or http://www.gnu.org/copyleft/gpl.txt .
+
+# Content addressed cache of the pipeline stages. The key of a stage hashes the key of
+# the previous stage, the stage name, its arguments and the attributes it starts from,
+# so a key identifies the whole chain of inputs leading to the stage's output. Every
+# entry is a checkpoint directory (see checkpoint.py) named after its key.
+
+# Attributes which do not change the data produced by the stages
+volatile_attributes = ['workpath', 'outputdir', 'opath', 'verbose', 'abort_on_exception', 'fft_backend', 'fft_threads']
+
+def path_fingerprint ( path ):
+  '''
+  Fingerprint of a file or directory, from the names, sizes and modification times of its files
+
+  Arguments:
+      path (str): File or directory
+
+  Returns:
+      fingerprint (list): [relative path, size, modification time] of each file. None if 'path' does not exist
+  '''
+  from os import walk,stat
+  from os.path import isfile,join,relpath,exists
+
+  if path is None or not exists(path):
+    return None
+  if isfile(path):
+    st = stat(path)
+    return [['', st.st_size, st.st_mtime_ns]]
+
+  fingerprint = []
+  for root,dirs,files in walk(path):
+    dirs.sort()
+    for f in sorted(files):
+      st = stat(join(root,f))
+      fingerprint.append([relpath(join(root,f),path), st.st_size, st.st_mtime_ns])
+  return fingerprint
+
+
+def plain_value ( value ):
+  # Hashable representation of int, float, str, bool and None values, and of lists, tuples and dicts of them
+  import numpy as np
+
+  if value is None or isinstance(value, (bool,int,float,str,np.number)):
+    return repr(value)
+  if isinstance(value, (list,tuple)):
+    items = [plain_value(v) for v in value]
+    return None if None in items else '[%s]'%','.join(items)
+  if isinstance(value, dict):
+    items = [(repr(k),plain_value(v)) for k,v in sorted(value.items(), key=lambda kv:repr(kv[0]))]
+    return None if any(v is None for _,v in items) else '{%s}'%','.join('%s:%s'%kv for kv in items)
+  if isinstance(value, np.ndarray) and value.size <= 4096:
+    return '%s%s%s'%(value.dtype.str, value.shape, value.tobytes().hex())
+  return None
+
+
+def stage_key ( parent, stage, args, attributes ):
+  '''
+  Cache key of a stage
+
+  Arguments:
+      parent (str): Key of the previous stage
+      stage (str): Name of the stage
+      args (dict): Arguments of the stage
+      attributes (dict): The DataController's attributes when the stage starts, None before restart_load
+
+  Returns:
+      key (str): Hexadecimal SHA-256 digest
+  '''
+  from hashlib import sha256
+
+  h = sha256()
+  h.update(('%s|%s|'%(parent,stage)).encode())
+  for k in sorted(args):
+    if k != 'self':
+      h.update(('%s=%s;'%(k,plain_value(args[k]))).encode())
+  h.update(b'|')
+  for k in sorted({} if attributes is None else attributes):
+    if k not in volatile_attributes:
+      v = plain_value(attributes[k])
+      if v is not None:
+        h.update(('%s=%s;'%(k,v)).encode())
+  return h.hexdigest()
+
+
+def load_stage ( data_controller, cache_dir, key ):
+  '''
+  Populate the DataController with the output of a cached stage
+
+  Arguments:
+      data_controller (DataController): The DataController
+      cache_dir (str): Cache directory
+      key (str): Key of the stage
+
+  Returns:
+      hit (bool): True if the stage was found in the cache and loaded
+  '''
+  from os import utime
+  from os.path import join,exists
+  from .checkpoint import read_checkpoint
+
+  comm,rank = data_controller.comm,data_controller.rank
+
+  path = join(cache_dir, key)
+  hit = exists(join(path,'manifest.json')) if rank==0 else None
+  if not comm.bcast(hit, root=0):
+    return False
+
+  # Mark the entry as recently used
+  if rank == 0:
+    utime(join(path,'manifest.json'))
+
+  # Paths and verbosity stay those of the current run
+  attributes = data_controller.data_attributes
+  current = {k:attributes[k] for k in volatile_attributes if k in attributes}
+
+  data_controller.free_windows()
+  read_checkpoint(data_controller, path)
+  data_controller.data_attributes.update(current)
+  return True
+
+
+def store_stage ( data_controller, cache_dir, key, max_size ):
+  '''
+  Store the DataController's content as the output of a stage, then evict the least
+  recently used entries until the cache fits in 'max_size'
+
+  Arguments:
+      data_controller (DataController): The DataController
+      cache_dir (str): Cache directory
+      key (str): Key of the stage
+      max_size (float): Maximum size of the cache in GBytes
+
+  Returns:
+      None
+  '''
+  from os.path import join
+  from .checkpoint import write_checkpoint
+
+  # Written to a temporary name and renamed, so interrupted writes are never hit
+  tmp = join(cache_dir, 'tmp_'+key)
+  write_checkpoint(data_controller, tmp)
+  if data_controller.rank == 0:
+    from os import rename
+    from shutil import rmtree
+    rmtree(join(cache_dir,key), ignore_errors=True)
+    rename(tmp, join(cache_dir,key))
+    evict_stages(cache_dir, max_size, keep=key)
+  data_controller.comm.Barrier()
+
+
+def evict_stages ( cache_dir, max_size, keep=None ):
+  '''
+  Remove the least recently used cache entries until the cache fits in 'max_size'
+
+  Arguments:
+      cache_dir (str): Cache directory
+      max_size (float): Maximum size of the cache in GBytes
+      keep (str): Key of an entry which is never removed
+
+  Returns:
+      None
+  '''
+  from shutil import rmtree
+  from os import listdir,scandir
+  from os.path import join,getmtime,exists
+
+  entries = []
+  for key in listdir(cache_dir):
+    manifest = join(cache_dir, key, 'manifest.json')
+    if exists(manifest):
+      size = sum(f.stat().st_size for f in scandir(join(cache_dir,key)) if f.is_file())
+      entries.append((getmtime(manifest), key, size))
+
+  total = sum(e[2] for e in entries)
+  for _,key,size in sorted(entries):
+    if total <= max_size*1024**3:
+      break
+    if key != keep:
+      rmtree(join(cache_dir,key), ignore_errors=True)
+      total -= size
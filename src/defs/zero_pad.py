@@ -19,6 +19,68 @@
 
 import numpy as np
 
+def pad_runs(nk,nfft):
+    '''
+    Copies along one axis of the padding of zero_pad.
+
+    Arguments:
+        nk (int): current size of the axis
+        nfft (int): number of zeroes to pad the axis by (negative values truncate)
+
+    Returns:
+        runs (list): (destination slice, source slice) pairs
+        nyquist (list): destination indices of the halved Nyquist planes
+    '''
+    # halfway point and parity (even <-> p==1), no Nyquist halving when nfft==0
+    sk = (nk+1)//2
+    p = (nk & 1)^1 if nfft != 0 else 0
+
+    # the upper half is written last, so it wins where a truncation overlaps the halves
+    low = max(0,min(sk+p,sk+nfft))
+    runs = [(slice(0,low),slice(0,low)),(slice(nfft+sk,nk+nfft),slice(sk,nk))]
+    nyquist = [sk,nk+nfft-sk] if p else []
+    return runs,nyquist
+
+
+def spectral_pad(aux,shape,out=None):
+    '''
+    Pad the frequency domain of a stack of 3D arrays with zeroes, as zero_pad
+        does for each aux[i]. The eight spectral corners are written straight
+        into the output, so no intermediate array is built.
+
+    Arguments:
+        aux (ndarray): unpadded frequency domain data (n,nk1,nk2,nk3,...),
+                       any trailing axes are carried along
+        shape (tuple): padded sizes (nk1p,nk2p,nk3p), each may differ from nk
+        out (ndarray): (optional) preallocated output (n,nk1p,nk2p,nk3p,...),
+                       e.g. a buffer reused between calls
+
+    Returns:
+        out (ndarray): padded frequency domain data
+    '''
+    from itertools import product
+
+    oshape = (aux.shape[0],)+tuple(shape)+aux.shape[4:]
+    if out is None:
+        out = np.zeros(oshape,dtype=complex)
+    else:
+        if out.shape != oshape:
+            raise ValueError('spectral_pad: output shape %s, expected %s'%(out.shape,oshape))
+        out.fill(0)
+
+    axes = [pad_runs(aux.shape[d+1],shape[d]-aux.shape[d+1]) for d in range(3)]
+
+    for (d1,s1),(d2,s2),(d3,s3) in product(*[a[0] for a in axes]):
+        out[:,d1,d2,d3] = aux[:,s1,s2,s3]
+
+    # halve Nyquist planes
+    for d,(_,nyquist) in enumerate(axes):
+        for i in nyquist:
+            out[(slice(None),)*(d+1)+(i,)] /= 2
+
+    return out
+
+
 def zero_pad(aux,nk1,nk2,nk3,nfft1,nfft2,nfft3):
     '''
     Pad frequency domain with zeroes, such that any relationship between
@@ -36,49 +98,7 @@ def zero_pad(aux,nk1,nk2,nk3,nfft1,nfft2,nfft3):
     Returns:
         auxp3 (ndarray): padded frequency domain data
     '''
-    # post-padding dimensions
-    nk1p = nfft1+nk1
-    nk2p = nfft2+nk2
-    nk3p = nfft3+nk3
-    # halfway points
-    sk1 = int((nk1+1)/2)
-    sk2 = int((nk2+1)/2)
-    sk3 = int((nk3+1)/2)
-    # parities (even <-> p==1)
-    p1 = (nk1 & 1)^1
-    p2 = (nk2 & 1)^1
-    p3 = (nk3 & 1)^1
-
-    # accomodate nfft==0
-    if nfft1 == 0:  p1 = 0
-    if nfft2 == 0:  p2 = 0
-    if nfft3 == 0:  p3 = 0
-
-    # first dimension
-    auxp1 = np.zeros((nk1,nk2,nk3p),dtype=complex)
-    auxp1[:,:,:sk3+p3]=aux[:,:,:sk3+p3]
-    auxp1[:,:,nfft3+sk3:]=aux[:,:,sk3:]
-    # second dimension
-    auxp2 = np.zeros((nk1,nk2p,nk3p),dtype=complex)
-    auxp2[:,:sk2+p2,:]=auxp1[:,:sk2+p2,:]
-    auxp2[:,nfft2+sk2:,:]=auxp1[:,sk2:,:]
-    # third dimension
-    auxp3 = np.zeros((nk1p,nk2p,nk3p),dtype=complex)
-    auxp3[:sk1+p1,:,:]=auxp2[:sk1+p1,:,:]
-    auxp3[nfft1+sk1:,:,:]=auxp2[sk1:,:,:]
-
-    # halve Nyquist axes
-    if p1:
-        auxp3[ sk1,:,:] /= 2
-        auxp3[-sk1,:,:] /= 2
-    if p2:
-        auxp3[:, sk2,:] /= 2
-        auxp3[:,-sk2,:] /= 2
-    if p3:
-        auxp3[:,:, sk3] /= 2
-        auxp3[:,:,-sk3] /= 2
-
-    return(auxp3)
+    return spectral_pad(aux[None],(nk1+nfft1,nk2+nfft2,nk3+nfft3))[0]
 
 
 def zero_pad_float(aux,nk1,nk2,nk3,nfft1,nfft2,nfft3):